@@ -13,6 +13,10 @@ cd $klayout_dir
 ################
 top_design=${TOP_DESIGN:-"croc_chip"}
 def_path=${DEF_PATH:-"$root_dir/openroad/out/croc.def"}
+# output: gds (default, for tapeout), gds.gz or oas (fast hand-offs)
+out_format=${OUT_FORMAT:-"gds"}
+out_level=${OUT_LEVEL:-""}         # OASIS compaction 0-10 or gzip level 1-9
+out_compare=${OUT_COMPARE:-0}      # 1: report size/write time of every format
 
 
 ################
@@ -75,15 +79,55 @@ sed "/<lef-files><\/lef-files>/c $lef_files" "$tech" > $KLAYOUT_HOME/tech/sg13g2
 
 echo "$gds" > $KLAYOUT_HOME/tech/tech_gds.f
 
+# pre-merged library cache, set LIB_CACHE=0 to always read the libraries
+# def2stream.py checks the content hashes, here the cache is dropped as soon
+# as the set of PDK/bondpad files or their size/mtime changes
+lib_cache=""
+if [[ "${LIB_CACHE:-1}" != "0" ]]; then
+    cache_dir="$KLAYOUT_HOME/cache"
+    lib_cache="$cache_dir/libs.oas"
+    fingerprint=$(stat -L -c '%n %s %Y' $gds | sha256sum | cut -d' ' -f1)
+    if [[ "$(cat "$cache_dir/fingerprint" 2>/dev/null)" != "$fingerprint" ]]; then
+        echo "Library files changed, invalidating $cache_dir"
+        rm -rf "$cache_dir"
+        mkdir -p "$cache_dir"
+        echo "$fingerprint" > "$cache_dir/fingerprint"
+    fi
+fi
+
+# set LIB_SELECT=1 to only read the library cells used by the DEF
+lib_select=${LIB_SELECT:-0}
+
 
 klayout_cmd="$KLAYOUT -zz \
           -rd design_name=\"$top_design\" \
           -rd in_def=\"$def_path\" \
           -rd gds_flist=\"$KLAYOUT_HOME/tech/tech_gds.f\" \
-          -rd out_file=\"${top_design}.gds\" \
+          -rd out_file=\"${top_design}.${out_format}\" \
+          -rd out_level=\"$out_level\" \
+          -rd out_compare=\"$out_compare\" \
           -rd tech_file=\"$KLAYOUT_HOME/tech/sg13g2.lyt\" \
           -rd layer_map=\"$KLAYOUT_HOME/tech/sg13g2.map\" \
+          -rd lib_cache=\"$lib_cache\" \
+          -rd lib_select=\"$lib_select\" \
+          -rd lib_index=\"$KLAYOUT_HOME/index\" \
           -rm def2stream.py"
 
 echo $klayout_cmd
-eval $klayout_cmd
\ No newline at end of file
+eval $klayout_cmd
+status=$?
+
+# optional: XOR against a golden layout (XOR_REF=<gds/oas>), tiled over all cores
+if [[ $status -eq 0 && -n "$XOR_REF" ]]; then
+    xor_cmd="$KLAYOUT -zz \
+          -rd in_gds=\"${top_design}.${out_format}\" \
+          -rd ref_gds=\"$(realpath $XOR_REF)\" \
+          -rd top_cell=\"$top_design\" \
+          -rd tile_size=\"${XOR_TILE:-500}\" \
+          -rd threads=\"${XOR_THREADS:-$(nproc)}\" \
+          -rm xor.py"
+    echo $xor_cmd
+    eval $xor_cmd
+    status=$?
+fi
+exit $status
\ No newline at end of file
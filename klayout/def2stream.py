@@ -4,10 +4,323 @@ import json
 import copy
 import sys
 import os
+import hashlib
+import shutil
+import shlex
+import struct
+import tempfile
+import time
 
 errors = 0
+start_time = time.time()
+
+# Optional: merged library cache (-rd lib_cache=<file.oas>), empty disables it
+lib_cache = globals().get('lib_cache', '')
+# Optional: only read the library cells used by the DEF (-rd lib_select=1),
+# with the per-library cell index kept in -rd lib_index=<dir>
+lib_select = globals().get('lib_select', '') not in ('', '0')
+lib_index = globals().get('lib_index', '')
+# JSON report with phase timings, counts and check results (-rd report_file=...)
+report_file = globals().get('report_file', '') or out_file + ".json"
+# Output format follows the out_file extension: .gds, .gds.gz or .oas
+# -rd out_level=N: OASIS compaction level (0-10) or gzip level (1-9)
+out_level = globals().get('out_level', '')
+# -rd out_compare=1: also write every format to a scratch dir and report size/time
+out_compare = globals().get('out_compare', '') not in ('', '0')
+
+OUT_FORMATS = ('gds', 'gds.gz', 'oas')
+
+report = {
+  'design': design_name,
+  'def': in_def,
+  'out_file': out_file,
+  'phases': [],
+  'counts': {},
+  'empty_cells': [],
+  'orphan_cells': [],
+}
+current_phase = None
+
+
+def reset_peak_rss():
+  # start a new RSS high-water mark (VmHWM), False if the kernel does not allow it
+  try:
+    with open('/proc/self/clear_refs', 'w') as f:
+      f.write('5')
+    return True
+  except OSError:
+    return False
+
+
+def rss_mib():
+  # current and peak (since the last reset_peak_rss) resident set size
+  status = {}
+  with open('/proc/self/status') as f:
+    for line in f:
+      key, _, value = line.partition(':')
+      if key in ('VmRSS', 'VmHWM'):
+        status[key] = int(value.split()[0]) / 1024
+  return status['VmRSS'], status['VmHWM']
+
+
+process_peak = rss_mib()[1]
+
+
+def phase(name):
+  # Close the running phase (if any) and start the next one
+  global current_phase, process_peak
+  now = time.time()
+  if current_phase is not None:
+    rss, peak = rss_mib()
+    process_peak = max(process_peak, peak)
+    current_phase['seconds'] = round(now - current_phase.pop('start'), 3)
+    current_phase['rss_mib'] = round(rss, 1)
+    # without a reset VmHWM is the peak of the whole process so far
+    key = 'peak_rss_mib' if current_phase.pop('peak_reset') else 'process_peak_rss_mib'
+    current_phase[key] = round(peak, 1)
+    print("[INFO] Phase '{0}': {1:.2f} s, RSS {2:.0f} MiB, peak {3:.0f} MiB".format(
+      current_phase['name'], current_phase['seconds'], rss, peak))
+    report['phases'].append(current_phase)
+  current_phase = {'name': name, 'start': now, 'peak_reset': reset_peak_rss()} if name else None
+
+
+def layout_counts(layout):
+  # number of cells, instances and shapes over all cells of a layout
+  layers = list(layout.layer_indexes())
+  counts = {'cells': layout.cells(), 'instances': 0, 'shapes': 0}
+  for c in layout.each_cell():
+    counts['instances'] += c.child_instances()
+    for li in layers:
+      counts['shapes'] += c.shapes(li).size()
+  return counts
+
+
+# GDSII record types needed to index the structures (cells) of a library
+GDS_HEADER  = 0x0002
+GDS_ENDLIB  = 0x0400
+GDS_BGNSTR  = 0x0502
+GDS_STRNAME = 0x0606
+GDS_ENDSTR  = 0x0700
+GDS_SNAME   = 0x1206
+
+
+def output_format(path):
+  if path.endswith('.gz'):
+    return 'gds.gz'
+  if path.endswith(('.oas', '.oasis')):
+    return 'oas'
+  return 'gds'
+
+
+def write_layout(layout, path, fmt, level=''):
+  # Write layout in one of OUT_FORMATS, returns the time taken
+  start = time.time()
+  options = pya.SaveLayoutOptions()
+  if fmt == 'oas':
+    options.format = "OASIS"
+    options.oasis_strict_mode = True    # name tables and offsets, fast to read back
+    options.oasis_write_cblocks = True
+    options.oasis_compression_level = 2 if level == '' else int(level)
+    layout.write(path, options)
+  elif fmt == 'gds.gz':
+    # stream through gzip (KLayout's built-in gzip has no level setting); the
+    # pipe exit status is lost, so the file is only renamed into place on success
+    options.format = "GDS2"
+    part = path + ".part"
+    if os.path.exists(path):
+      os.remove(path)
+    try:
+      layout.write("pipe:gzip -c -{0} > {1} && mv -f {1} {2} || rm -f {1}".format(
+        6 if level == '' else int(level), shlex.quote(part), shlex.quote(path)), options)
+    finally:
+      if os.path.exists(part):
+        os.remove(part)
+    if not os.path.exists(path):
+      raise RuntimeError("gzip failed to write '{0}'".format(path))
+  else:
+    options.format = "GDS2"
+    layout.write(path, options)
+  return time.time() - start
+
+
+def file_digest(path, stamps):
+  # sha256 of a library file, rehashed only if its size or mtime changed
+  st = os.stat(path)
+  stamp = stamps.get(path)
+  if stamp and stamp['size'] == st.st_size and stamp['mtime_ns'] == st.st_mtime_ns:
+    return stamp['sha256']
+  h = hashlib.sha256()
+  with open(path, 'rb') as f:
+    for chunk in iter(lambda: f.read(1 << 20), b''):
+      h.update(chunk)
+  stamps[path] = {'size': st.st_size, 'mtime_ns': st.st_mtime_ns, 'sha256': h.hexdigest()}
+  return stamps[path]['sha256']
+
+
+def library_key(files, stamps):
+  # order matters: later files override cells of the same name
+  h = hashlib.sha256()
+  for path in files:
+    h.update("{0}\0{1}\0".format(path, file_digest(path, stamps)).encode())
+  return h.hexdigest()
+
+
+def merge_libraries(layout, files, cache):
+  # Read all libraries into layout, through a pre-merged OASIS cache if given
+  if not cache:
+    print("[INFO] Merging GDS/OAS files...")
+    for fil in files:
+      print("\t{0}".format(fil))
+      layout.read(fil)
+    return
+
+  meta_file = cache + ".json"
+  meta = {}
+  if os.path.exists(meta_file):
+    with open(meta_file) as f:
+      meta = json.load(f)
+  stamps = meta.get('files', {})
+  key = library_key(files, stamps)
+
+  if meta.get('key') == key and os.path.exists(cache):
+    print("[INFO] Library cache is up to date, reading '{0}'".format(cache))
+  else:
+    print("[INFO] Library cache is stale, merging GDS/OAS files into '{0}'...".format(cache))
+    libs = pya.Layout()
+    for fil in files:
+      print("\t{0}".format(fil))
+      libs.read(fil)
+    os.makedirs(os.path.dirname(os.path.abspath(cache)), exist_ok=True)
+    write_layout(libs, cache + ".tmp", 'oas')
+    libs._destroy()
+    os.replace(cache + ".tmp", cache)
+    with open(meta_file, 'w') as f:
+      json.dump({'key': key, 'files': {p: stamps[p] for p in files}}, f, indent=2)
+  layout.read(cache)
+
+
+def gds_name(record):
+  return record.rstrip(b'\0').decode()
+
+
+def scan_gds(path):
+  # Index a GDSII stream: end of the library header and, per structure,
+  # its byte range and the names of the structures it references
+  with open(path, 'rb') as f:
+    first = f.read(4)
+    if len(first) < 4 or struct.unpack('>HH', first)[1] != GDS_HEADER:
+      return None
+    f.seek(0)
+    header_end = None
+    cells = {}
+    buf = b''
+    base = 0   # file offset of buf[0]
+    done = False
+    while not done:
+      chunk = f.read(1 << 20)
+      if not chunk:
+        break
+      buf += chunk
+      pos = 0
+      while pos + 4 <= len(buf):
+        length, rtype = struct.unpack_from('>HH', buf, pos)
+        if length < 4:   # zero padding after ENDLIB
+          done = True
+          break
+        if pos + length > len(buf):
+          break
+        if rtype == GDS_BGNSTR:
+          if header_end is None:
+            header_end = base + pos
+          cell_start = base + pos
+          refs = set()
+        elif rtype == GDS_STRNAME:
+          name = gds_name(buf[pos + 4:pos + length])
+        elif rtype == GDS_SNAME:
+          refs.add(gds_name(buf[pos + 4:pos + length]))
+        elif rtype == GDS_ENDSTR:
+          cells[name] = [cell_start, base + pos + length, sorted(refs)]
+        elif rtype == GDS_ENDLIB:
+          done = True
+          break
+        pos += length
+      buf = buf[pos:]
+      base += pos
+  return {'header_end': header_end or 0, 'cells': cells}
+
+
+def load_gds_index(path, index_dir):
+  # Cell index of a library, reused from index_dir while the file is unchanged
+  st = os.stat(path)
+  index_file = None
+  if index_dir:
+    name = hashlib.sha1(os.path.abspath(path).encode()).hexdigest()[:12]
+    index_file = os.path.join(index_dir, "{0}.{1}.json".format(os.path.basename(path), name))
+    if os.path.exists(index_file):
+      with open(index_file) as f:
+        index = json.load(f)
+      if index['size'] == st.st_size and index['mtime_ns'] == st.st_mtime_ns:
+        return index
+  index = scan_gds(path)
+  if index is None:
+    return None
+  index.update(size=st.st_size, mtime_ns=st.st_mtime_ns)
+  if index_file:
+    os.makedirs(index_dir, exist_ok=True)
+    with open(index_file, 'w') as f:
+      json.dump(index, f)
+  return index
+
+
+def load_libraries_selective(layout, files, used, index_dir):
+  # Read only the cells in used plus everything they reference from the
+  # libraries, by copying their structures into a small GDS per library
+  print("[INFO] Indexing GDS/OAS files...")
+  indexes = {}
+  for fil in files:
+    indexes[fil] = load_gds_index(fil, index_dir)
+    if indexes[fil] is None:
+      print("\t{0} (not GDSII, read completely)".format(fil))
+    else:
+      print("\t{0} ({1} cells)".format(fil, len(indexes[fil]['cells'])))
+
+  # dependencies may live in another library, resolve over all of them
+  needed = set()
+  todo = list(used)
+  while todo:
+    name = todo.pop()
+    if name in needed:
+      continue
+    needed.add(name)
+    for index in indexes.values():
+      if index is not None and name in index['cells']:
+        todo.extend(index['cells'][name][2])
+
+  print("[INFO] Reading {0} used cells from GDS/OAS files...".format(len(needed)))
+  for fil in files:
+    index = indexes[fil]
+    if index is None:
+      layout.read(fil)
+      continue
+    ranges = sorted(index['cells'][n][:2] for n in needed if n in index['cells'])
+    if not ranges:
+      continue
+    print("\t{0}: {1} cells".format(fil, len(ranges)))
+    fd, subset = tempfile.mkstemp(suffix=".gds")
+    try:
+      with open(fil, 'rb') as src, os.fdopen(fd, 'wb') as dst:
+        dst.write(src.read(index['header_end']))
+        for begin, end in ranges:
+          src.seek(begin)
+          dst.write(src.read(end - begin))
+        dst.write(struct.pack('>HH', 4, GDS_ENDLIB))
+      layout.read(subset)
+    finally:
+      os.remove(subset)
+
 
 # Load technology file
+phase('tech')
 tech = pya.Technology()
 tech.load(tech_file)
 layoutOptions = tech.load_layout_options
@@ -15,9 +328,11 @@ if len(layer_map) > 0:
   layoutOptions.lefdef_config.map_file = layer_map
 
 # Load def file
+phase('def_read')
 main_layout = pya.Layout()
 print("[INFO] Reading DEF ...")
 main_layout.read(in_def, layoutOptions)
+report['counts']['def'] = layout_counts(main_layout)
 
 print("[INFO] Reporting cells after loading DEF ...")
 for i in main_layout.each_cell():
@@ -28,6 +343,7 @@ top_cell_index = main_layout.cell(design_name).cell_index()
 
 # remove orphan cell BUT preserve cell with VIA_
 #  - KLayout is prepending VIA_ when reading DEF that instantiates LEF's via
+phase('clear')
 print("[INFO] Clearing cells...")
 for i in main_layout.each_cell():
   if i.cell_index() != top_cell_index:
@@ -35,20 +351,29 @@ for i in main_layout.each_cell():
       i.clear()
 
 # Load in the gds to merge
-print("[INFO] Merging GDS/OAS files...")
+phase('lib_merge')
 with open(gds_flist, 'rb') as file:
     in_files_list = file.read()
-for fil in in_files_list.split():
-  print("\t{0}".format(fil))
-  main_layout.read(fil)
+in_files = [f.decode() for f in in_files_list.split()]
+report['libraries'] = {'files': in_files, 'mode': 'select' if lib_select else 'cache' if lib_cache else 'full'}
+if lib_select:
+  used = set(main_layout.cell(c).name for c in main_layout.cell(design_name).called_cells())
+  load_libraries_selective(main_layout, in_files, used, lib_index)
+else:
+  merge_libraries(main_layout, in_files, lib_cache)
 
 # Copy the top level only to a new layout
+phase('copy_tree')
 print("[INFO] Copying toplevel cell '{0}'".format(design_name))
 top_only_layout = pya.Layout()
 top_only_layout.dbu = main_layout.dbu
 top = top_only_layout.create_cell(design_name)
 top.copy_tree(main_layout.cell(design_name))
 
+phase('checks')
+report['counts']['merged'] = layout_counts(main_layout)
+report['counts']['final'] = layout_counts(top_only_layout)
+
 print("[INFO] Checking for missing cell from GDS/OAS...")
 missing_cell = False
 regex = None
@@ -58,7 +383,9 @@ if 'GDS_ALLOW_EMPTY' in os.environ:
 for i in top_only_layout.each_cell():
   if i.is_empty():
     missing_cell = True
-    if regex is not None and re.match(regex, i.name):
+    allowed = regex is not None and re.match(regex, i.name) is not None
+    report['empty_cells'].append({'name': i.name, 'allowed': allowed})
+    if allowed:
         print("[WARNING] LEF Cell '{0}' ignored. Matches GDS_ALLOW_EMPTY.".format(i.name))
     else:
         print("[ERROR] LEF Cell '{0}' has no matching GDS/OAS cell."
@@ -73,6 +400,7 @@ orphan_cell = False
 for i in top_only_layout.each_cell():
   if i.name != design_name and i.parent_cells() == 0:
     orphan_cell = True
+    report['orphan_cells'].append(i.name)
     print("[ERROR] Found orphan cell '{0}'".format(i.name))
     errors += 1
 
@@ -81,7 +409,38 @@ if not orphan_cell:
 
 
 # Write out the GDS
-print("[INFO] Writing out GDS/OAS '{0}'".format(out_file))
-top_only_layout.write(out_file)
+phase('write')
+out_format = output_format(out_file)
+print("[INFO] Writing out {0} '{1}'".format(out_format, out_file))
+seconds = write_layout(top_only_layout, out_file, out_format, out_level)
+report['output'] = {'format': out_format, 'level': out_level or None,
+                    'size': os.path.getsize(out_file), 'seconds': round(seconds, 3)}
+print("[INFO] Wrote {0:.1f} MiB in {1:.2f} s".format(report['output']['size'] / 2**20, seconds))
+
+if out_compare:
+  phase('compare_formats')
+  print("[INFO] Comparing output formats...")
+  report['formats'] = []
+  scratch = tempfile.mkdtemp()
+  try:
+    for fmt in OUT_FORMATS:
+      path = os.path.join(scratch, "{0}.{1}".format(design_name, fmt))
+      seconds = write_layout(top_only_layout, path, fmt, out_level if fmt == out_format else '')
+      size = os.path.getsize(path)
+      report['formats'].append({'format': fmt, 'size': size, 'seconds': round(seconds, 3)})
+      print("[INFO] {0:<7} {1:>10.1f} MiB {2:>8.2f} s".format(fmt, size / 2**20, seconds))
+  finally:
+    shutil.rmtree(scratch)
+
+phase(None)
+report['gds_allow_empty'] = regex
+report['errors'] = errors
+report['seconds'] = round(time.time() - start_time, 3)
+report['peak_rss_mib'] = round(process_peak, 1)
+print("[INFO] Runtime {0:.1f} s, peak RSS {1:.0f} MiB".format(report['seconds'], report['peak_rss_mib']))
+
+print("[INFO] Writing report '{0}'".format(report_file))
+with open(report_file, 'w') as f:
+  json.dump(report, f, indent=2)
 
 sys.exit(errors)
@@ -0,0 +1,135 @@
+import pya
+import json
+import os
+import sys
+import time
+
+# Tiled, multi-threaded XOR of a layout against a golden GDS/OAS.
+#
+# Variables (-rd name=value):
+#   in_gds       layout to check (e.g. croc_chip.gds)
+#   ref_gds      golden layout
+#   top_cell     top cell to compare (default: the single top cell)
+#   tile_size    tile edge in um (default 500)
+#   threads      worker threads (default: all cores)
+#   max_boxes    differing regions listed per layer (default 20)
+#   report_file  JSON summary (default: <in_gds>.xor.json)
+
+def var(name, default=''):
+  value = globals().get(name, '')
+  return value if value != '' else default
+
+top_name = var('top_cell')
+tile_size = float(var('tile_size', 500))
+threads = int(var('threads', os.cpu_count()))
+max_boxes = int(var('max_boxes', 20))
+report_file = var('report_file', in_gds + ".xor.json")
+
+start_time = time.time()
+
+
+def load(path):
+  layout = pya.Layout()
+  print("[INFO] Reading '{0}' ...".format(path))
+  layout.read(path)
+  if top_name:
+    top = layout.cell(top_name)
+    if top is None:
+      print("[ERROR] '{0}' has no cell '{1}'".format(path, top_name))
+      sys.exit(2)
+  else:
+    tops = list(layout.each_top_cell())
+    if len(tops) != 1:
+      print("[ERROR] '{0}' has {1} top cells, select one with -rd top_cell=...".format(path, len(tops)))
+      sys.exit(2)
+    top = layout.cell(tops[0])
+  return layout, top
+
+
+def layer_key(info):
+  return (info.layer, info.datatype)
+
+
+def box_um(box, dbu):
+  return [round(box.left * dbu, 3), round(box.bottom * dbu, 3),
+          round(box.right * dbu, 3), round(box.top * dbu, 3)]
+
+
+layout_a, top_a = load(in_gds)
+layout_b, top_b = load(ref_gds)
+
+# union of the layers of both layouts, missing ones compare against nothing
+layers = {}
+for layout in (layout_a, layout_b):
+  for li in layout.layer_indexes():
+    layers.setdefault(layer_key(layout.get_info(li)), layout.get_info(li))
+
+tp = pya.TilingProcessor()
+tp.dbu = layout_a.dbu
+tp.tile_size(tile_size, tile_size)
+tp.threads = threads
+# the reference may use another database unit
+ref_trans = pya.ICplxTrans(layout_b.dbu / layout_a.dbu)
+
+results = []
+for n, (key, info) in enumerate(sorted(layers.items())):
+  la = layout_a.find_layer(info)
+  lb = layout_b.find_layer(info)
+  if la is None:
+    la = layout_a.insert_layer(info)
+  if lb is None:
+    lb = layout_b.insert_layer(info)
+  region = pya.Region()
+  tp.input("a{0}".format(n), layout_a.begin_shapes(top_a, la))
+  tp.input("b{0}".format(n), layout_b.begin_shapes(top_b, lb), ref_trans)
+  tp.output("o{0}".format(n), region)
+  tp.queue("_output(o{0}, a{0} ^ b{0})".format(n))
+  results.append((key, region))
+
+print("[INFO] XOR of {0} layers, {1} um tiles, {2} threads ...".format(len(results), tile_size, threads))
+xor_start = time.time()
+tp.execute("XOR")
+xor_time = time.time() - xor_start
+
+report = {
+  'in_gds': in_gds,
+  'ref_gds': ref_gds,
+  'top_cell': top_a.name,
+  'tile_size_um': tile_size,
+  'threads': threads,
+  'layers': [],
+}
+dbu = layout_a.dbu
+for (layer, datatype), region in results:
+  if region.is_empty():
+    continue
+  # tiles split polygons at their borders, merge before counting
+  merged = region.merged()
+  boxes = sorted((p.bbox() for p in merged.each()), key=lambda b: b.area(), reverse=True)
+  report['layers'].append({
+    'layer': layer,
+    'datatype': datatype,
+    'count': merged.count(),
+    'area_um2': round(merged.area() * dbu * dbu, 6),
+    'bbox': box_um(merged.bbox(), dbu),
+    'boxes': [box_um(b, dbu) for b in boxes[:max_boxes]],
+  })
+
+report['seconds'] = round(time.time() - start_time, 3)
+report['load_seconds'] = round(xor_start - start_time, 3)
+report['xor_seconds'] = round(xor_time, 3)
+
+if report['layers']:
+  print("[ERROR] {0} layer(s) differ:".format(len(report['layers'])))
+  for l in report['layers']:
+    print("[ERROR] {0}/{1}: {2} region(s), {3} um2, bbox {4}".format(
+      l['layer'], l['datatype'], l['count'], l['area_um2'], l['bbox']))
+else:
+  print("[INFO] No differences")
+print("[INFO] XOR done in {0:.1f} s".format(report['seconds']))
+
+print("[INFO] Writing report '{0}'".format(report_file))
+with open(report_file, 'w') as f:
+  json.dump(report, f, indent=2)
+
+sys.exit(1 if report['layers'] else 0)
@@ -22,6 +22,7 @@ NETLIST		?= $(realpath $(OR_DIR)/../yosys/out/$(PROJ_NAME)_yosys.v)
 SAVE	 	 ?= $(OR_DIR)/save
 REPORTS	 	 ?= $(OR_DIR)/reports
 OR_OUT  	 ?= $(OR_DIR)/out
+METRICS_DB	 ?= $(OR_DIR)/metrics.db
 OR_OUT_FILES  = $(OR_OUT)/$(PROJ_NAME).def $(OR_OUT)/$(PROJ_NAME).v $(OR_OUT)/$(PROJ_NAME).sdc $(OR_OUT)/$(PROJ_NAME).odb
 
 backend: $(OR_OUT)/$(PROJ_NAME).def
@@ -47,6 +48,12 @@ $(OR_OUT_FILES): $(NETLIST) $(OR_DIR)/scripts/*.tcl $(OR_DIR)/src/*.tcl $(OR_DIR
 		-log $(PROJ_NAME).log \
 		2>&1 | TZ=UTC gawk '{ print strftime("[%Y-%m-%d %H:%M %Z]"), $$0 }';
 
+## Add the metric reports of the last run to the trend database and check them (run=<name>, STRICT=1)
+or_metrics:
+	python3 $(OR_DIR)/scripts/report_db.py ingest $(METRICS_DB) $(REPORTS) \
+		$$(if [ -n "$(run)" ]; then echo "--run $(run)"; else echo "--run $$(date -u +%Y-%m-%d_%H%M)"; fi)
+	python3 $(OR_DIR)/scripts/report_db.py check $(METRICS_DB) $(if $(STRICT),--strict)
+
 or_clean:
 	rm -rf $(SAVE)
 	rm -rf $(REPORTS)
@@ -67,4 +74,4 @@ start_openroad_gui:
 	REPORTS="$(REPORTS)" \
 	$(OPENROAD) -gui scripts/startup.tcl
 
-.PHONY: backend openroad or_clean start_openroad start_openroad_gui
+.PHONY: backend openroad or_metrics or_clean start_openroad start_openroad_gui
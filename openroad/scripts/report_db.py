@@ -0,0 +1,469 @@
+#!/usr/bin/env python3
+
+# Copyright (c) 2024 ETH Zurich and University of Bologna.
+# Licensed under the Apache License, Version 2.0, see LICENSE for details.
+# SPDX-License-Identifier: Apache-2.0
+#
+# Trend database of the OpenROAD metric reports.
+#
+# `report_metrics` (scripts/reports.tcl) writes `$report_dir/<when>.rpt` for
+# every flow stage, e.g. `04_croc.gpl1.rpt`, as a series of sections:
+#     ==========================================================================
+#     <when> <section>
+#     --------------------------------------------------------------------------
+#     <free text>
+# The sections are parsed into numeric metrics (TNS/WNS, worst slack, path
+# slacks, ERC slacks and violation counts, critical path, power, area) and
+# stored in SQLite. Parsed reports are content-addressed by their SHA-256:
+# unchanged files (same size and mtime) are not even read again, and a
+# report that is identical to one seen before is not parsed again.
+#
+# Runs are kept in ingestion order (e.g. one per nightly flow), so trends,
+# run-to-run diffs and stage-over-stage QoR regressions are single queries.
+#
+# Usage:
+#     python report_db.py --help
+
+import os, sys, argparse
+import hashlib, re, sqlite3, time
+import textwrap
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS runs (
+    id      INTEGER PRIMARY KEY,
+    name    TEXT UNIQUE NOT NULL,
+    created REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS reports (
+    sha256  TEXT PRIMARY KEY,
+    parsed  REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS files (
+    run_id   INTEGER NOT NULL REFERENCES runs(id),
+    path     TEXT NOT NULL,
+    step     INTEGER,
+    stage    TEXT NOT NULL,
+    sha256   TEXT NOT NULL REFERENCES reports(sha256),
+    size     INTEGER NOT NULL,
+    mtime_ns INTEGER NOT NULL,
+    PRIMARY KEY (run_id, path)
+);
+CREATE TABLE IF NOT EXISTS metrics (
+    sha256  TEXT NOT NULL REFERENCES reports(sha256),
+    metric  TEXT NOT NULL,
+    value   REAL NOT NULL,
+    PRIMARY KEY (sha256, metric)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS files_stage ON files (stage, run_id);
+CREATE INDEX IF NOT EXISTS files_sha256 ON files (sha256);
+CREATE INDEX IF NOT EXISTS metrics_metric ON metrics (metric, sha256);
+CREATE VIEW IF NOT EXISTS run_metrics AS
+    SELECT runs.id AS run_id, runs.name AS run, files.step, files.stage, metrics.metric, metrics.value
+    FROM files JOIN runs ON runs.id = files.run_id JOIN metrics USING (sha256);
+"""
+
+SEPARATOR = re.compile(r'^={20,}\s*$')
+RULE = re.compile(r'^-{20,}\s*$')
+REPORT_NAME = re.compile(r'^(?:(\d+)_)?(?:.*\.)?([^.]+)$')  # <step>_<proj>.<stage>
+NUMBER = r'(-?(?:\d+\.?\d*|\.\d+)(?:[eE][-+]?\d+)?|-?inf|INF)'
+
+LINE_METRICS = [
+    # report_tns / report_wns / report_worst_slack: "tns max -1.23" or "wns 0.00"
+    (re.compile(r'^(tns|wns)(?:\s+(max|min))?\s+' + NUMBER + r'\s*$'), lambda m: m[1] + ('_min' if m[2] == 'min' else '')),
+    (re.compile(r'^worst slack(?:\s+(max|min))?\s+' + NUMBER + r'\s*$'),
+     lambda m: 'worst_slack' + ('_min' if m[1] == 'min' else '')),
+    # report_clock_skew (newer OpenROAD): "0.05 setup skew"
+    (re.compile(r'^\s*' + NUMBER + r'\s+(setup|hold) skew'), lambda m: f'clock_skew_{m[2]}'),
+    # ERC counts: "max slew violation count 3", "setup violation count 0"
+    (re.compile(r'^([a-z ]+?) violation count\s+' + NUMBER + r'\s*$'),
+     lambda m: m[1].replace(' ', '_') + '_violation_count'),
+    # report_design_area: "Design area 1234 u^2 53% utilization."
+    (re.compile(r'^Design area\s+' + NUMBER + r'\s+u\^2'), lambda m: 'design_area'),
+    (re.compile(r'^Design area .*?' + NUMBER + r'% utilization'), lambda m: 'design_utilization'),
+    # area by hierarchy: "Die Area:  1234.5 um2", "Core Utilization:  0.53"
+    (re.compile(r'^((?:Die|Core|Total|Total Active) Area|Core Utilization|Std Cell Utilization):\s+' + NUMBER),
+     lambda m: m[1].lower().replace(' ', '_')),
+]
+SLACK = re.compile(r'^\s*' + NUMBER + r'\s+slack \((MET|VIOLATED)\)')
+ARRIVAL = re.compile(r'^\s*' + NUMBER + r'\s+data arrival time')
+POWER = re.compile(r'^(Sequential|Combinational|Clock|Macro|Pad|Total)\s+' + r'\s+'.join([NUMBER] * 4))
+POWER_COLUMNS = ['internal', 'switching', 'leakage', 'total']
+
+# whether a metric is better when higher (+1), lower (-1) or neither (0);
+# the first matching pattern wins
+DIRECTIONS = [
+    (re.compile(r'limit'), 0),
+    (re.compile(r'utilization'), 0),
+    (re.compile(r'slack|tns|wns'), +1),
+    (re.compile(r'count|warnings|skew|delay|arrival|area|power'), -1),
+]
+TIMING = re.compile(r'slack|tns|wns|skew|delay|arrival')
+# metrics the flow step before a stage (scripts/chip.tcl) is expected to move,
+# not checked stage-over-stage into that stage
+STAGE_CHANGES = {
+    'gpl2': re.compile(r'area|power'),                                 # repair_design, repair_timing
+    'dpl': re.compile(r'area|power|' + TIMING.pattern),               # legalization (and gpl2's repairs
+                                                                       # when there is no gpl2 report)
+    'cts_unrepaired': re.compile(r'area|power|' + TIMING.pattern),    # clock tree, propagated clocks
+    'cts': re.compile(r'area|power'),                                  # repair_timing
+    'grt': TIMING,                                                     # global route parasitics
+    'grt_repaired': re.compile(r'area|power'),                         # repair_design, repair_timing
+    'drt': re.compile(r'area|power|' + TIMING.pattern),               # antenna diodes, routing
+}
+
+
+def metric_key(name: str) -> str:
+    return re.sub(r'[^a-z0-9]+', '_', name.lower()).strip('_')
+
+
+def parse_sections(lines):
+    """Yield (section, content lines) of a report_metrics file."""
+    section, content = None, []
+    lines = iter(lines)
+    for line in lines:
+        line = line.rstrip('\n')
+        if SEPARATOR.match(line):
+            if section is not None:
+                yield section, content
+            header = next(lines, '').strip()
+            rule = next(lines, '')
+            if not RULE.match(rule):
+                content = [rule.rstrip('\n')]
+            else:
+                content = []
+            section = header
+        elif section is not None:
+            content.append(line)
+    if section is not None:
+        yield section, content
+
+
+def parse_report(lines) -> dict:
+    """Metrics of a report_metrics file; {} if it is another kind of report."""
+    metrics = {}
+    for header, content in parse_sections(lines):
+        # the header repeats the <when> of the file name before the section name
+        section = header.split(None, 1)[1] if ' ' in header else header
+        text = [line for line in content if line.strip()]
+        if section == 'check_setup':
+            metrics['check_setup_warnings'] = len(text)
+            continue
+        if section.startswith('report_checks'):
+            kind = 'min' if '-path_delay min' in section else 'max' if '-path_delay max' in section else None
+            for line in text:
+                m = SLACK.match(line)
+                if m and kind:
+                    metrics.setdefault(f'path_slack_{kind}', float(m[1]))
+                m = ARRIVAL.match(line)
+                if m and kind:
+                    metrics.setdefault(f'path_arrival_{kind}', float(m[1]))
+            continue
+        if section.startswith('report_power'):
+            for line in text:
+                m = POWER.match(line)
+                if m:
+                    group = m[1].lower()
+                    for column, value in zip(POWER_COLUMNS, m.groups()[1:]):
+                        if group == 'total':
+                            metrics[f'power_{column}'] = float(value)
+                        elif column == 'total':
+                            metrics[f'power_{group}'] = float(value)
+            continue
+        # a section with just a number, e.g. "max_slew_check_slack" or "critical path delay"
+        if len(text) == 1 and re.fullmatch(r'\s*' + NUMBER + r'\s*', text[0]):
+            metrics[metric_key(section)] = float(text[0])
+            continue
+        for line in text:
+            for pattern, name in LINE_METRICS:
+                m = pattern.match(line)
+                if m:
+                    metrics.setdefault(name(m), float(m[m.lastindex]))
+    return metrics
+
+
+def direction(metric: str) -> int:
+    for pattern, sign in DIRECTIONS:
+        if pattern.search(metric):
+            return sign
+    return 0
+
+
+def regressed(metric: str, old: float, new: float, tolerance: float, time_slack: float) -> bool:
+    """Whether new is worse than old by more than the relative tolerance (or time_slack for timing metrics)."""
+    sign = direction(metric)
+    if not sign or old is None or new is None:
+        return False
+    worse = (old - new) * sign
+    allowed = abs(old) * tolerance
+    if TIMING.search(metric):
+        # slacks close to zero would flag every bit of noise
+        allowed = max(allowed, time_slack)
+    return worse > allowed
+
+
+class ReportDB:
+    """SQLite store of the parsed reports."""
+
+    def __init__(self, path: str):
+        self.db = sqlite3.connect(path)
+        self.db.executescript(SCHEMA)
+
+    def close(self):
+        self.db.close()
+
+    def run_id(self, name: str, create: bool = False) -> int:
+        row = self.db.execute("SELECT id FROM runs WHERE name = ?", (name,)).fetchone()
+        if row:
+            return row[0]
+        if not create:
+            raise ValueError(f"no run '{name}'")
+        return self.db.execute("INSERT INTO runs (name, created) VALUES (?, ?)", (name, time.time())).lastrowid
+
+    def runs(self) -> list:
+        return self.db.execute("""
+            SELECT runs.id, runs.name, runs.created, COUNT(files.path)
+            FROM runs LEFT JOIN files ON files.run_id = runs.id GROUP BY runs.id ORDER BY runs.id""").fetchall()
+
+    def resolve(self, name: str = None) -> tuple:
+        """(id, name) of a run, the latest one if no name is given; '~N' is the N-th run before the latest."""
+        runs = self.db.execute("SELECT id, name FROM runs ORDER BY id").fetchall()
+        if not runs:
+            raise ValueError("the database has no runs")
+        if name is None:
+            return runs[-1]
+        if re.fullmatch(r'~\d+', name):
+            back = int(name[1:])
+            if back >= len(runs):
+                raise ValueError(f"only {len(runs)} run(s)")
+            return runs[-1 - back]
+        return self.run_id(name), name
+
+    def ingest(self, run: str, paths: list) -> dict:
+        """Add the report files to a run, skipping unchanged ones."""
+        stats = {'files': 0, 'unchanged': 0, 'known': 0, 'parsed': 0, 'ignored': 0}
+        with self.db:
+            run_id = self.run_id(run, create=True)
+            for path in paths:
+                stats['files'] += 1
+                st = os.stat(path)
+                name = os.path.basename(path)
+                row = self.db.execute("SELECT size, mtime_ns FROM files WHERE run_id = ? AND path = ?",
+                                      (run_id, name)).fetchone()
+                if row == (st.st_size, st.st_mtime_ns):
+                    stats['unchanged'] += 1
+                    continue
+                with open(path, 'rb') as f:
+                    data = f.read()
+                sha256 = hashlib.sha256(data).hexdigest()
+                if self.db.execute("SELECT 1 FROM reports WHERE sha256 = ?", (sha256,)).fetchone():
+                    stats['known'] += 1
+                else:
+                    metrics = parse_report(data.decode(errors='replace').splitlines())
+                    # other reports (checks, congestion, ...) are kept without metrics so they are skipped next time
+                    stats['parsed' if metrics else 'ignored'] += 1
+                    self.db.execute("INSERT INTO reports (sha256, parsed) VALUES (?, ?)", (sha256, time.time()))
+                    self.db.executemany("INSERT INTO metrics (sha256, metric, value) VALUES (?, ?, ?)",
+                                        [(sha256, k, v) for k, v in metrics.items()])
+                m = REPORT_NAME.match(os.path.splitext(name)[0])
+                step = int(m[1]) if m[1] else None
+                self.db.execute("INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?, ?, ?, ?)",
+                                (run_id, name, step, m[2], sha256, st.st_size, st.st_mtime_ns))
+            # reports no longer referenced by any file
+            self.db.execute("DELETE FROM metrics WHERE sha256 NOT IN (SELECT sha256 FROM files)")
+            self.db.execute("DELETE FROM reports WHERE sha256 NOT IN (SELECT sha256 FROM files)")
+        return stats
+
+    def stages(self, run_id: int) -> list:
+        """Stages of a run with metrics, in flow order."""
+        return [r[0] for r in self.db.execute("""
+            SELECT stage FROM files WHERE run_id = ? AND sha256 IN (SELECT sha256 FROM metrics)
+            ORDER BY step, stage""", (run_id,))]
+
+    def values(self, run_id: int, stage: str = None) -> dict:
+        """{(stage, metric): value} of a run."""
+        query = "SELECT stage, metric, value FROM run_metrics WHERE run_id = ?"
+        args = [run_id]
+        if stage:
+            query += " AND stage = ?"
+            args.append(stage)
+        return {(s, m): v for s, m, v in self.db.execute(query, args)}
+
+    def trend(self, metric: str, stage: str = None, last: int = 0) -> list:
+        """(run, stage, metric, value) of metrics matching a GLOB pattern over the last runs."""
+        query = "SELECT run, stage, metric, value, step FROM run_metrics WHERE metric GLOB ?"
+        args = [metric]
+        if stage:
+            query += " AND stage GLOB ?"
+            args.append(stage)
+        if last:
+            query += " AND run_id IN (SELECT id FROM runs ORDER BY id DESC LIMIT ?)"
+            args.append(last)
+        query += " ORDER BY metric, step, stage, run_id"
+        return [row[:4] for row in self.db.execute(query, args)]
+
+
+def format_value(value) -> str:
+    if value is None:
+        return '-'
+    if value == int(value) and abs(value) < 1e15:
+        return str(int(value))
+    return f"{value:.6g}"
+
+
+def cmd_ingest(db: ReportDB, args):
+    paths = []
+    for path in args.reports:
+        if os.path.isdir(path):
+            paths += sorted(os.path.join(path, name) for name in os.listdir(path) if name.endswith('.rpt'))
+        else:
+            paths.append(path)
+    if not paths:
+        sys.exit("ERROR: no .rpt files found")
+    run = args.run
+    if run is None:
+        # e.g. nightly/2025-01-31/reports -> 2025-01-31
+        first = os.path.abspath(args.reports[0])
+        first = first if os.path.isdir(first) else os.path.dirname(first)
+        run = os.path.basename(os.path.dirname(first) if os.path.basename(first) == 'reports' else first)
+    stats = db.ingest(run, paths)
+    print(f"Run '{run}': {stats['files']} file(s), {stats['parsed']} parsed, {stats['known']} already known,"
+          f" {stats['unchanged']} unchanged, {stats['ignored']} without metrics")
+
+
+def cmd_runs(db: ReportDB, args):
+    for run_id, name, created, files in db.runs():
+        print(f"{run_id:>4}  {name:<32} {time.strftime('%Y-%m-%d %H:%M', time.localtime(created))}  {files} report(s)")
+
+
+def cmd_trend(db: ReportDB, args):
+    rows = db.trend(args.metric, args.stage, args.last)
+    if not rows:
+        sys.exit(f"ERROR: no values of '{args.metric}'")
+    runs = []
+    table = {}
+    for run, stage, metric, value in rows:
+        if run not in runs:
+            runs.append(run)
+        table.setdefault((metric, stage), {})[run] = value
+    order = [name for _, name, _, _ in db.runs() if name in runs]
+    width = max(12, *(len(r) for r in order))
+    print(f"{'metric':<28} {'stage':<16}" + ''.join(f" {r[-width:]:>{width}}" for r in order))
+    for (metric, stage), values in table.items():
+        print(f"{metric:<28} {stage:<16}" + ''.join(f" {format_value(values.get(r)):>{width}}" for r in order))
+
+
+def cmd_diff(db: ReportDB, args):
+    (a_id, a), (b_id, b) = db.resolve(args.run_a), db.resolve(args.run_b)
+    old, new = db.values(a_id, args.stage), db.values(b_id, args.stage)
+    regressions = 0
+    print(f"{'stage':<16} {'metric':<28} {a[-14:]:>14} {b[-14:]:>14} {'delta':>12}")
+    for key in sorted(set(old) | set(new), key=lambda k: (k[0], k[1])):
+        o, n = old.get(key), new.get(key)
+        if o == n and not args.all:
+            continue
+        flag = ''
+        if regressed(key[1], o, n, args.tolerance, args.time_slack):
+            flag = '  REGRESSION'
+            regressions += 1
+        delta = format_value(n - o) if o is not None and n is not None else '-'
+        print(f"{key[0]:<16} {key[1]:<28} {format_value(o):>14} {format_value(n):>14} {delta:>12}{flag}")
+    if regressions:
+        sys.exit(f"ERROR: {regressions} metric(s) regressed from '{a}' to '{b}'")
+
+
+def cmd_check(db: ReportDB, args):
+    run_id, run = db.resolve(args.run)
+    values = db.values(run_id)
+    stages = db.stages(run_id)
+    flagged = 0
+    for before, after in zip(stages, stages[1:]):
+        for (stage, metric), new in sorted(values.items()):
+            if stage != after:
+                continue
+            old = values.get((before, metric))
+            expected = STAGE_CHANGES.get(after)
+            if expected and expected.search(metric) and not args.strict:
+                continue
+            if regressed(metric, old, new, args.tolerance, args.time_slack):
+                flagged += 1
+                print(f"{run}: {metric} {before} -> {after}: {format_value(old)} -> {format_value(new)}")
+    if flagged:
+        sys.exit(f"ERROR: {flagged} stage-over-stage regression(s) in '{run}'")
+    print(f"{run}: no stage-over-stage regressions over {len(stages)} stage(s)")
+
+
+def main():
+    p = argparse.ArgumentParser(
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+        description=textwrap.dedent("""
+            Collect the OpenROAD metric reports (report_metrics) of many runs in a
+            SQLite database and query trends, diffs and QoR regressions.
+
+            Examples:
+              # add the reports of a flow run (unchanged files are skipped):
+              ./report_db.py ingest metrics.db ../reports --run nightly-2025-01-31
+
+              # WNS and TNS of every stage over the last 10 runs:
+              ./report_db.py trend metrics.db 'wns*' --last 10
+              ./report_db.py trend metrics.db tns --stage grt
+
+              # compare the latest run with the one before:
+              ./report_db.py diff metrics.db '~1' '~0'
+
+              # flag metrics that get worse from one stage to the next (area, power
+              # and timing only where the flow step is not expected to move them):
+              ./report_db.py check metrics.db --tolerance 0.1
+        """))
+    sub = p.add_subparsers(dest='command', required=True)
+
+    i = sub.add_parser('ingest', help='add report files or directories to a run')
+    i.add_argument('db', help='SQLite database (created if missing)')
+    i.add_argument('reports', nargs='+', help='.rpt files or directories holding them')
+    i.add_argument('--run', default=None,
+                   help="run name (default: the directory of the reports, or its parent if it is 'reports')")
+
+    r = sub.add_parser('runs', help='list the runs')
+    r.add_argument('db')
+
+    t = sub.add_parser('trend', help='values of a metric across runs')
+    t.add_argument('db')
+    t.add_argument('metric', help="metric name or GLOB pattern, e.g. 'power_*'")
+    t.add_argument('--stage', default=None, help='stage name or GLOB pattern, e.g. grt')
+    t.add_argument('--last', type=int, default=0, help='only the last N runs')
+
+    d = sub.add_parser('diff', help='metrics that differ between two runs')
+    d.add_argument('db')
+    d.add_argument('run_a', help="run name, or '~N' for the N-th run before the latest")
+    d.add_argument('run_b', help="run name, or '~N' (~0 is the latest)")
+    d.add_argument('--stage', default=None, help='only this stage')
+    d.add_argument('--all', action='store_true', help='also list unchanged metrics')
+
+    c = sub.add_parser('check', help='flag metrics that get worse from one stage to the next')
+    c.add_argument('db')
+    c.add_argument('--run', default=None, help="run name or '~N' (default: the latest)")
+    c.add_argument('--strict', action='store_true',
+                   help='also check the area, power and timing metrics a stage is expected to change')
+
+    for q in (d, c):
+        q.add_argument('--tolerance', type=float, default=0.05,
+                       help='relative change tolerated before flagging a regression (default: 0.05)')
+        q.add_argument('--time-slack', type=float, default=0.01,
+                       help='absolute change of timing metrics tolerated, in the library time unit (default: 0.01)')
+    args = p.parse_args()
+
+    if args.command != 'ingest' and not os.path.exists(args.db):
+        sys.exit(f"ERROR: database '{args.db}' not found")
+    db = None
+    try:
+        db = ReportDB(args.db)
+        {'ingest': cmd_ingest, 'runs': cmd_runs, 'trend': cmd_trend, 'diff': cmd_diff,
+         'check': cmd_check}[args.command](db, args)
+    except (OSError, ValueError, sqlite3.Error) as e:
+        sys.exit(f"ERROR: {e}")
+    finally:
+        if db:
+            db.close()
+
+
+if __name__ == '__main__':
+    main()
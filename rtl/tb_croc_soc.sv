@@ -59,8 +59,13 @@ module tb_croc_soc #(
     //  Command Line Arguments //
     /////////////////////////////
     string binary_path;
+    string jtag_image_path;
     initial begin
-        if ($value$plusargs("binary=%s", binary_path)) begin
+        // pre-packed load image (sw/scripts/jtagimage.py), takes precedence over +binary;
+        // an empty +jtag_image= counts as absent
+        if ($value$plusargs("jtag_image=%s", jtag_image_path) && jtag_image_path != "") begin
+            $display("Running program: %s", jtag_image_path);
+        end else if ($value$plusargs("binary=%s", binary_path)) begin
             $display("Running program: %s", binary_path);
         end else begin
             $display("No binary path provided. Running helloworld.");
@@ -240,6 +245,8 @@ module tb_croc_soc #(
         bit [31:0] data;
         bit [7:0] byte_data;
         int byte_count;
+        int word_count;
+        time start_time;
         static dm::sbcs_t sbcs = dm::sbcs_t'{sbautoincrement: 1'b1, sbaccess: 2, default: '0};
 
         file = $fopen(filename, "r");
@@ -250,6 +257,8 @@ module tb_croc_soc #(
         end
 
         $display("@%t | [JTAG] Loading binary from %s", $time, filename);
+        start_time = $time;
+        word_count = 0;
         jtag_dbg.write_dmi(dm::SBCS, sbcs);
 
         // line by line
@@ -292,11 +301,55 @@ module tb_croc_soc #(
                     addr += 4;
                     data = 32'h0;
                     byte_count = 0;
+                    word_count++;
                 end
             end
         end
         jtag_dbg.write_dmi(dm::SBCS, JtagInitSbcs);
         $fclose(file);
+        $display("@%t | [JTAG] Loaded %0d words in %t", $time, word_count, $time - start_time);
+    endtask
+
+    // Load a pre-packed image (sw/scripts/jtagimage.py):
+    // '@' address records followed by one 32bit word per line, '//' comments
+    task jtag_load_image(input string filename);
+        int file;
+        string line;
+        bit [31:0] addr;
+        bit [31:0] data;
+        int word_count;
+        time start_time;
+        static dm::sbcs_t sbcs = dm::sbcs_t'{sbautoincrement: 1'b1, sbaccess: 2, default: '0};
+
+        file = $fopen(filename, "r");
+        if (file == 0) begin
+            $fatal(1, "Error: Failed to open file %s", filename);
+        end
+
+        $display("@%t | [JTAG] Loading image from %s", $time, filename);
+        start_time = $time;
+        word_count = 0;
+        jtag_dbg.write_dmi(dm::SBCS, sbcs);
+
+        while ($fgets(line, file) != 0) begin
+            if (line.len() < 2 || line.substr(0, 1) == "//") continue;
+            if (line[0] == "@") begin
+                if ($sscanf(line, "@%h", addr) != 1) begin
+                    $fatal(1, "Error: Incorrect address line format in file %s", filename);
+                end
+                $display("@%t | [JTAG] Writing to memory @%08x ", $time, addr);
+                jtag_dbg.write_dmi(dm::SBAddress0, addr);
+            end else begin
+                if ($sscanf(line, "%h", data) != 1) begin
+                    $fatal(1, "Error: Incorrect data line format in file %s", filename);
+                end
+                jtag_write(dm::SBData0, data);
+                word_count++;
+            end
+        end
+        jtag_dbg.write_dmi(dm::SBCS, JtagInitSbcs);
+        $fclose(file);
+        $display("@%t | [JTAG] Loaded %0d words in %t", $time, word_count, $time - start_time);
     endtask
 
     // Wait for termination signal and get return code
@@ -479,7 +532,8 @@ module tb_croc_soc #(
         // write test value to sram
         jtag_write_reg32(croc_pkg::SramBaseAddr, 32'h1234_5678, 1'b1);
         // load binary to sram
-        jtag_load_hex(binary_path);
+        if (jtag_image_path != "") jtag_load_image(jtag_image_path);
+        else                       jtag_load_hex(binary_path);
 
         $display("@%t | [CORE] Start fetching instructions", $time);
         fetch_en_i = 1'b1;
@@ -8,6 +8,10 @@ import sys
 from pathlib import Path
 import argparse
 
+# Shared image helpers in sw/scripts
+sys.path.insert(0, str(Path(__file__).resolve().parents[2] / "sw" / "scripts"))
+import imageload
+
 
 # Default values
 filename = Path(__file__).parent / "user_rom.hex"
@@ -20,13 +24,7 @@ def write_hex(filename: str, data: bytes) -> None:
     # Each line in the hex file will contain 4 bytes (32 bits) in hexadecimal format
     # The $readmemh function in SystemVerilog expects the data to be in this format
     with open(filename, 'w') as f:
-        for word in range(0, len(data), 4):
-            data_word = data[word:word + 4][::-1]  # Reverse the byte order for little-endian format
-
-            # Convert each 4 bytes to a hex string
-            hex_string = ''.join(f'{byte:02X}' for byte in data_word)
-            # Write the hex string to the file
-            f.write(f"{hex_string}\n")
+        f.write(imageload.words_hex(data))
 
 def convert_string(data: str, rom_size_bytes: int) -> bytes:
     # Convert the string to bytes using UTF-8 encoding
@@ -41,7 +41,83 @@
 #define BOOT_AFTER_SD_ADDR_ADDR 0x0300001C
 #define BOOT_AFTER_SD_ADDR *reg32(BOOT_AFTER_SD_ADDR_ADDR, 0)
 
+// Boot header in a fixed card block (sw/scripts/sdimage.py). The window at
+// READWRITE_OFFSET spans 512 MiB (address bits [28:9] are the block number),
+// the header block is the last one of the first 2 MiB of the card.
+#define BLOCK_SIZE 0x200
+#define NUM_BLOCK_SLOTS 12 // NUM_SRAM_ADDRESSES in rtl/croc_pkg.sv
+#define BOOT_HEADER_BLOCK 0xFFF
+#define BOOT_HEADER_ADDR (READWRITE_OFFSET + BOOT_HEADER_BLOCK * BLOCK_SIZE)
+#define BOOT_HEADER_MAGIC 0x44535243 // 'CRSD'
+#define BOOT_HEADER_VERSION 1
+#define BOOT_MAX_SEGMENTS 8
+#define BOOT_FLAG_VERIFY 1
+
+typedef struct {
+    uint32_t addr;
+    uint32_t size;
+    uint32_t crc;
+} boot_segment_t;
+
+typedef struct {
+    uint32_t magic;
+    uint16_t version;
+    uint16_t num_segments;
+    uint32_t entry;
+    uint32_t blocks;
+    uint32_t flags;
+    uint32_t crc;
+    boot_segment_t segments[BOOT_MAX_SEGMENTS];
+} boot_header_t;
+
+// Reflected CRC-32 (0xEDB88320), continues from crc
+static uint32_t crc32(uint32_t crc, const volatile uint8_t *data, uint32_t len) {
+    crc = ~crc;
+    while (len--) {
+        crc ^= *data++;
+        for (int i = 0; i < 8; i++) {
+            crc = (crc >> 1) ^ (0xEDB88320 & -(crc & 1));
+        }
+    }
+    return ~crc;
+}
+
+// Copy the header out of the window (its block is evicted later), 1 if valid
+static int read_boot_header(boot_header_t *hdr) {
+    const volatile uint32_t *src = reg32(BOOT_HEADER_ADDR, 0);
+    uint32_t *dst = (uint32_t *)hdr;
+    for (uint32_t i = 0; i < sizeof(boot_header_t) / 4; i++) {
+        dst[i] = src[i];
+    }
+    if (hdr->magic != BOOT_HEADER_MAGIC || hdr->version != BOOT_HEADER_VERSION ||
+        hdr->num_segments > BOOT_MAX_SEGMENTS) {
+        return 0;
+    }
+    uint32_t crc = hdr->crc;
+    hdr->crc = 0;
+    int valid = crc32(0, (const uint8_t *)hdr, sizeof(boot_header_t)) == crc;
+    hdr->crc = crc;
+    return valid;
+}
+
+// Check the CRC of every segment, 1 if all match
+static int verify_segments(const boot_header_t *hdr) {
+    for (uint32_t i = 0; i < hdr->num_segments; i++) {
+        const boot_segment_t *seg = &hdr->segments[i];
+        if (crc32(0, reg8(seg->addr, 0), seg->size) != seg->crc) {
+            printf("BR>> CRC mismatch in segment at 0x%x\n", seg->addr);
+            uart_write_flush();
+            return 0;
+        }
+    }
+    return 1;
+}
+
 int main() {
+    boot_header_t hdr;
+    uint32_t blocks = NUM_BLOCK_SLOTS;
+    uint32_t entry;
+
     *reg32(SET_BLOCK_SWAP, 0) = 0;
 
     uart_init();
@@ -76,37 +152,47 @@ int main() {
 
         *reg32(SET_BLOCK_SWAP, 0) = 3;
 
-        *reg32(READWRITE_OFFSET, 0x000); 
-        *reg32(READWRITE_OFFSET, 0x200);
-        *reg32(READWRITE_OFFSET, 0x400);
-        *reg32(READWRITE_OFFSET, 0x600);
-        *reg32(READWRITE_OFFSET, 0x800);
-        *reg32(READWRITE_OFFSET, 0xA00);
-        *reg32(READWRITE_OFFSET, 0xC00);
-        *reg32(READWRITE_OFFSET, 0xE00);
-        *reg32(READWRITE_OFFSET + 0x1000, 0x000);
-        *reg32(READWRITE_OFFSET + 0x1000, 0x200);
-        *reg32(READWRITE_OFFSET + 0x1000, 0x400);
-        *reg32(READWRITE_OFFSET + 0x1000, 0x600);
-
-        printf("BR>> Blocks loaded\n");
+        // Without a header, the first NUM_BLOCK_SLOTS blocks are loaded;
+        // with one, only the blocks holding the image (the rest on demand).
+        // Whether a card has a header is only known after reading its block,
+        // so cards without one pay a single extra block read (~14 ms at
+        // divider 0x20) before the legacy load.
+        entry = BOOT_AFTER_SD_ADDR;
+        if (read_boot_header(&hdr)) {
+            if (hdr.blocks < blocks) blocks = hdr.blocks;
+            entry = hdr.entry;
+            printf("BR>> Boot header: %x blocks, entry 0x%x\n", hdr.blocks, entry);
+        } else {
+            hdr.flags = 0;
+            printf("BR>> No boot header\n");
+        }
         uart_write_flush();
 
-        *reg32(SET_BLOCK_SWAP, 0) = 1;
+        for (uint32_t i = 0; i < blocks; i++) {
+            *reg32(READWRITE_OFFSET, i * BLOCK_SIZE);
+        }
 
-        printf("BR>> Done!\n");
+        printf("BR>> Blocks loaded\n");
         uart_write_flush();
 
-        // Jump to start of SD-Card mapped SRAM
-        printf("BR>> Jumping to 0x%x\n", BOOT_AFTER_SD_ADDR);
-        uart_write_flush();
-        asm volatile (
-            "mv t0, %0\n"
-            "jr t0\n"
-            :
-            : "r"(BOOT_AFTER_SD_ADDR)
-            : "t0"
-        );
+        if ((hdr.flags & BOOT_FLAG_VERIFY) == 0 || verify_segments(&hdr)) {
+            *reg32(SET_BLOCK_SWAP, 0) = 1;
+
+            printf("BR>> Done!\n");
+            uart_write_flush();
+
+            // Jump to start of SD-Card mapped SRAM
+            printf("BR>> Jumping to 0x%x\n", entry);
+            uart_write_flush();
+            asm volatile (
+                "mv t0, %0\n"
+                "jr t0\n"
+                :
+                : "r"(entry)
+                : "t0"
+            );
+        }
+        *reg32(SET_BLOCK_SWAP, 0) = 0;
     }
 
     // Jump to start of SRAM
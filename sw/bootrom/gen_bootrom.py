@@ -14,66 +14,111 @@
 # 1. Updating the size parameter to match the new data size
 # 2. Replacing the static ROM data array
 # 
+# The ROM contents can be emitted by different backends:
+#   inline    32-bit literals between the ROM STATIC DATA markers (default)
+#   readmemh  $readmemh/$readmemb of a side file with one word per line
+#   readmemb
+#   packed    a packed-vector localparam, 16 words per literal
+#   bin       a raw little-endian binary (e.g. for the FPGA flows), the
+#             SystemVerilog file is left alone
+# 
+# The hash of the inputs is kept in a cache file, an unchanged hex file and
+# template leave the output files (and their mtimes) untouched.
+# 
 # Usage:
 #     python gen_bootrom.py --help
 
+import os
 import sys
 import re
 import argparse
+import hashlib
+import json
+from array import array
 from pathlib import Path
-from typing import Tuple, List
+from typing import Dict, Tuple, List
+
+# Shared image loader in sw/scripts
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / 'scripts'))
+import imageload
+
+ROM_DECLARATION = re.compile(
+    r"(?P<indent>[ \t]*)logic \[31:0\] rom_data \[0:SizeWords-1\] = \{\s*\n"
+    r"\s*// --- ROM STATIC DATA START ---.*?// --- ROM STATIC DATA END ---\s*\n\s*\};", re.DOTALL)
+BACKENDS = ['inline', 'readmemh', 'readmemb', 'packed', 'bin']
+MEM_DEFINE = 'BOOTROM_MEM_FILE'
+# Simulators run from verilator/ or vsim/ (both at the repository root), the
+# default side file path is relative to them
+REPO_DIR = Path(__file__).resolve().parent.parent.parent
+SIM_DIR = REPO_DIR / 'verilator'
+PACKED_WORDS = 16  # words per literal of the packed backend
+
 
+def log(message: str, quiet: bool = False):
+    if not quiet:
+        print(message)
 
-def convert_hex_file(filename: str, max_rom_size_bytes: int = None) -> Tuple[int, bytes]:
+
+def convert_hex_file(filename: str, max_rom_size_bytes: int = None, quiet: bool = False) -> Tuple[int, bytes]:
     """
-    Convert hex file to bytes format.
+    Convert hex file (or any image read by sw/scripts/imageload.py) to bytes format.
     
     Args:
         filename: Input hex file path
         max_rom_size_bytes: Maximum ROM size in bytes (None for no limit)
+        quiet: Do not print address lines and padding
         
     Returns:
         Tuple of (actual_size_bytes, data_bytes)
     """
-    current_address = None
-    result = bytearray()
-    
-    with open(filename, 'r') as f:
-        for line in f:
-            line = line.strip()
-            if not line:
-                continue
-                
-            if line.startswith('@'):
-                # Parse address line
-                parsed_address = int(line[1:], 16)
-                print(f"  Parsed address: 0x{parsed_address:08X}")
-                
-                if current_address is not None and parsed_address != current_address:
-                    # Pad with zeros if address jumps
-                    padding_size = parsed_address - current_address
-                    print(f"  Padding data from 0x{current_address:08X} to 0x{parsed_address:08X} ({padding_size} bytes)")
-                    result += b'\x00' * padding_size
-                    
-                current_address = parsed_address
-            else:
-                # Convert hex data line to bytes
-                try:
-                    data = bytes.fromhex(line)
-                    result += data
-                    if current_address is not None:
-                        current_address += len(data)
-                except ValueError as e:
-                    print(f"  Warning: Skipping invalid hex line: {line}")
-                    continue
-
-    actual_size = len(result)
+    segments = imageload.load(filename, warn=lambda line: print(f"  Warning: Skipping invalid hex line: {line}"))
+
+    previous = None
+    for seg in segments:
+        log(f"  Parsed address: 0x{seg.address:08X}", quiet)
+        if previous is not None:
+            # Pad with zeros if address jumps
+            log(f"  Padding data from 0x{previous.end:08X} to 0x{seg.address:08X} ({seg.address - previous.end} bytes)", quiet)
+        previous = seg
+
+    # The ROM starts at the first address, check the size before filling the gaps
+    first, end = imageload.span(segments)
+    actual_size = end - first
     
     # Check size limit
     if max_rom_size_bytes and actual_size > max_rom_size_bytes:
         raise ValueError(f"Data size {actual_size} bytes exceeds ROM size of {max_rom_size_bytes} bytes.")
     
-    return actual_size, bytes(result)
+    return actual_size, bytes(imageload.flatten(segments))
+
+
+def bytes_to_words(data: bytes) -> array:
+    """
+    Convert bytes to little-endian 32-bit words, zero-padding the last word.
+    
+    Args:
+        data: Input bytes
+        
+    Returns:
+        Array of 32-bit words
+    """
+    words = array('I')
+    words.frombytes(bytes(data) + b'\x00' * (-len(data) % 4))
+    if sys.byteorder == 'big':
+        words.byteswap()
+    return words
+
+
+def words_to_hex(words: array, prefix: str = "") -> List[str]:
+    """Format 32-bit words as 8-digit upper-case hex strings with a prefix."""
+    # Big-endian bytes of all words as one hex string, grouped per word
+    be = array('I', words)
+    if sys.byteorder == 'little':
+        be.byteswap()
+    digits = be.tobytes().hex(' ', 4).upper()
+    if prefix and digits:
+        digits = prefix + digits.replace(' ', ' ' + prefix)
+    return digits.split()
 
 
 def bytes_to_sv_array(data: bytes) -> List[str]:
@@ -86,21 +131,7 @@ def bytes_to_sv_array(data: bytes) -> List[str]:
     Returns:
         List of SystemVerilog formatted hex strings
     """
-    words = []
-    
-    # Process data in 4-byte chunks (32-bit words)
-    for i in range(0, len(data), 4):
-        word_bytes = data[i:i+4]
-        
-        # Pad incomplete words with zeros
-        if len(word_bytes) < 4:
-            word_bytes += b'\x00' * (4 - len(word_bytes))
-        
-        # Convert to little-endian 32-bit word
-        word_value = int.from_bytes(word_bytes, byteorder='little')
-        words.append(f"32'h{word_value:08X}")
-    
-    return words
+    return words_to_hex(bytes_to_words(data), "32'h")
 
 
 def modify_systemverilog_rom(sv_content: str, new_size_bytes: int, rom_data_words: List[str]) -> str:
@@ -129,20 +160,15 @@ def modify_systemverilog_rom(sv_content: str, new_size_bytes: int, rom_data_word
     if len(rom_data_words) == 0:
         new_rom_data = "    32'h0000_0000"
     else:
-        # Format with proper indentation and commas, 4 words per line
-        formatted_words = []
-        for i in range(0, len(rom_data_words), 4):
-            line_words = rom_data_words[i:i+4]
-            line_parts = []
-            for j, word in enumerate(line_words):
-                global_idx = i + j
-                if global_idx == len(rom_data_words) - 1:
-                    # Last word overall, no comma
-                    line_parts.append(word)
-                else:
-                    line_parts.append(word + ",")
-            line = "    " + " ".join(line_parts) + f" // 0x{i:04X} - 0x{i + len(line_words) - 1:04X}"
-            formatted_words.append(line)
+        # Format with proper indentation and commas, 4 words per line, no
+        # comma after the last word overall: all lines but the last one are
+        # formatted in one pass
+        count = len(rom_data_words)
+        last = (count - 1) // 4 * 4
+        it = iter(rom_data_words[:last])
+        formatted_words = list(map("    {}, {}, {}, {}, // 0x{:04X} - 0x{:04X}".format,
+                                   it, it, it, it, range(0, last, 4), range(3, last, 4)))
+        formatted_words.append("    " + ", ".join(rom_data_words[last:]) + f" // 0x{last:04X} - 0x{count - 1:04X}")
         # Join all lines into a single string
         new_rom_data = "\n".join(formatted_words)
     
@@ -155,24 +181,185 @@ def modify_systemverilog_rom(sv_content: str, new_size_bytes: int, rom_data_word
     return sv_content
 
 
+def replace_rom_declaration(sv_content: str, new_size_bytes: int, declaration: str) -> str:
+    """
+    Replace the whole `rom_data` declaration of the template and update the size.
+    
+    Args:
+        sv_content: Original SystemVerilog file content
+        new_size_bytes: New ROM size in bytes
+        declaration: New declaration, indented by the caller
+        
+    Returns:
+        Modified SystemVerilog content
+    """
+    sv_content = modify_systemverilog_rom(sv_content, new_size_bytes, ["32'h00000000"])
+    if not ROM_DECLARATION.search(sv_content):
+        raise ValueError("ROM data declaration with START/END markers not found in the template.")
+    return ROM_DECLARATION.sub(lambda m: declaration, sv_content, count=1)
+
+
+def mem_file(words: array, radix: str = 'h') -> str:
+    """
+    Format words for $readmemh ('h') or $readmemb ('b'), one word per line.
+    
+    Args:
+        words: 32-bit words
+        radix: 'h' or 'b'
+        
+    Returns:
+        File content
+    """
+    digits = words_to_hex(words)
+    if radix == 'b':
+        # Convert all words at once through one big integer
+        bits = format(int("".join(digits) or "0", 16), f"0{32 * len(digits)}b")
+        digits = [bits[i:i + 32] for i in range(0, len(bits), 32)]
+    return "\n".join(digits) + "\n"
+
+
+def default_mem_ref(output_mem: str) -> str:
+    """Path of the side file as seen from the simulation directories, absolute outside the repository."""
+    path = Path(output_mem).resolve()
+    if REPO_DIR not in path.parents:
+        return path.as_posix()
+    return Path(os.path.relpath(path, SIM_DIR)).as_posix()
+
+
+def readmem_declaration(radix: str, mem_ref: str) -> str:
+    """Declaration that loads the ROM from a side file, the path can be overridden with a define."""
+    return "\n".join([
+        f"`ifndef {MEM_DEFINE}",
+        f"`define {MEM_DEFINE} \"{mem_ref}\"",
+        "`endif",
+        "  logic [31:0] rom_data [0:SizeWords-1];",
+        "  initial begin",
+        "    // --- ROM STATIC DATA START ---",
+        f"    $readmem{radix}(`{MEM_DEFINE}, rom_data);",
+        "    // --- ROM STATIC DATA END ---",
+        "  end",
+    ])
+
+
+def packed_declaration(words: array) -> str:
+    """Declaration of the ROM as a packed localparam, word 0 in the LSBs."""
+    count = len(words)
+    digits = "".join(words_to_hex(words[::-1]))
+    # Split at PACKED_WORDS word boundaries counted from word 0, the highest
+    # (possibly partial) group comes first
+    first = (count % PACKED_WORDS or PACKED_WORDS) * 8
+    cuts = [0] + list(range(first, len(digits) + 1, PACKED_WORDS * 8))
+    lines = []
+    for a, b in zip(cuts, cuts[1:]):
+        hi, lo = (len(digits) - a) // 8 - 1, (len(digits) - b) // 8
+        lines.append(f"    {(b - a) * 4}'h{digits[a:b]}, // 0x{hi:04X} - 0x{lo:04X}")
+    lines[-1] = lines[-1].replace(", //", " //", 1)
+    return "\n".join([
+        "  localparam logic [SizeWords-1:0][31:0] rom_data = {",
+        "    // --- ROM STATIC DATA START ---",
+        *lines,
+        "    // --- ROM STATIC DATA END ---",
+        "  };",
+    ])
+
+
+def generate_rom(backend: str, data: bytes, sv_content: str, output_sv: str,
+                 output_mem: str = None, mem_ref: str = None, output_bin: str = None) -> Dict[str, bytes]:
+    """
+    Render the ROM with the given backend.
+    
+    Args:
+        backend: One of BACKENDS
+        data: ROM contents, padded to the ROM size
+        sv_content: SystemVerilog template content
+        output_sv, output_mem, output_bin: Output paths used by the backend
+        mem_ref: Side file path as seen by the simulator (readmem backends)
+        
+    Returns:
+        Dictionary of output path to file content
+    """
+    size = len(data)
+    if backend == 'bin':
+        return {output_bin: bytes(data)}
+    words = bytes_to_words(data)
+    if backend == 'inline':
+        return {output_sv: modify_systemverilog_rom(sv_content, size, bytes_to_sv_array(data)).encode()}
+    if backend == 'packed':
+        return {output_sv: replace_rom_declaration(sv_content, size, packed_declaration(words)).encode()}
+    radix = backend[-1]
+    declaration = readmem_declaration(radix, mem_ref or default_mem_ref(output_mem))
+    return {
+        output_sv: replace_rom_declaration(sv_content, size, declaration).encode(),
+        output_mem: mem_file(words, radix).encode(),
+    }
+
+
+def input_hash(*paths: str, **options) -> str:
+    """Hash of the input files, the options and this script."""
+    h = hashlib.sha256()
+    for path in (*paths, __file__, imageload.__file__):
+        h.update(Path(path).read_bytes())
+        h.update(b'\0')
+    h.update(json.dumps(options, sort_keys=True).encode())
+    return h.hexdigest()
+
+
+def cache_hit(cache: str, key: str) -> bool:
+    """True if the cache records `key` and all outputs still have the recorded contents."""
+    try:
+        entry = json.loads(Path(cache).read_text())
+        return entry.get('input') == key and all(
+            hashlib.sha256(Path(path).read_bytes()).hexdigest() == digest
+            for path, digest in entry.get('outputs', {}).items())
+    except (OSError, ValueError):
+        return False
+
+
+def write_if_changed(path: str, data: bytes) -> bool:
+    """Write `data` unless the file already holds it, keeping its mtime."""
+    try:
+        if Path(path).read_bytes() == data:
+            return False
+    except OSError:
+        pass
+    Path(path).write_bytes(data)
+    return True
+
+
 def main():
     parser = argparse.ArgumentParser(description="Modify SystemVerilog ROM file with new hex data.")
-    parser.add_argument("--input_hex", type=str, help="Input hex file", default="build/bootrom.hex")
+    parser.add_argument("--input_hex", type=str, help="Input hex file (or Intel HEX, ELF, binary)", default="build/bootrom.hex")
     parser.add_argument("--input_sv", type=str, help="Input SystemVerilog ROM file", default="../../rtl/bootrom/bootrom.sv.template")
     parser.add_argument("--size_bytes", type=int, help="ROM size in bytes (default: 4096)", default=4096)
     parser.add_argument("--output_sv", type=str, help="Output SystemVerilog file", default="../../rtl/bootrom/bootrom.sv")
+    parser.add_argument("--backend", choices=BACKENDS, help="ROM data backend (default: inline)", default="inline")
+    parser.add_argument("--output_mem", type=str, help="Side file of the readmem backends (default: output_sv with .memh/.memb suffix)", default=None)
+    parser.add_argument("--mem_ref", type=str, help=f"Side file path written to the {MEM_DEFINE} default (default: relative to verilator/ and vsim/, e.g. ../rtl/bootrom/bootrom.memh, or absolute outside the repository)", default=None)
+    parser.add_argument("--output_bin", type=str, help="Output of the bin backend (default: build/bootrom.bin)", default="build/bootrom.bin")
+    parser.add_argument("--cache", type=str, help="Input hash cache file, empty to disable (default: build/bootrom.sv.cache)", default="build/bootrom.sv.cache")
+    parser.add_argument("--force", action="store_true", help="Regenerate even if the inputs are unchanged")
+    parser.add_argument("--quiet", "-q", action="store_true", help="Only print errors and warnings")
     
     
     args = parser.parse_args()
+    quiet = args.quiet
+    if args.output_mem is None:
+        args.output_mem = str(Path(args.output_sv).with_suffix('.mem' + args.backend[-1]))
     
     try:
+        key = None
+        if args.cache:
+            key = input_hash(args.input_hex, args.input_sv, size_bytes=args.size_bytes, backend=args.backend,
+                             output_sv=args.output_sv, output_mem=args.output_mem, mem_ref=args.mem_ref,
+                             output_bin=args.output_bin)
+            if not args.force and cache_hit(args.cache, key):
+                log(f"ROM up to date ({args.backend})", quiet)
+                return
+
         # Read and convert hex file
-        print(f"Reading hex file: {args.input_hex}")
-        actual_size, data = convert_hex_file(args.input_hex, args.size_bytes)
-        print(f"Hex file contains {actual_size} bytes ({actual_size // 4} words)")
-        
-        # Convert to SystemVerilog format
-        rom_words = bytes_to_sv_array(data)
+        log(f"Reading hex file: {args.input_hex}", quiet)
+        actual_size, data = convert_hex_file(args.input_hex, args.size_bytes, quiet)
+        log(f"Hex file contains {actual_size} bytes ({actual_size // 4} words)", quiet)
         
         # Calculate padded size (round up to next 4-byte boundary)
         padded_size = ((actual_size + 3) // 4) * 4
@@ -180,8 +367,7 @@ def main():
         # Pad size to match requested size
         if padded_size < args.size_bytes:
             padding_size = args.size_bytes - padded_size
-            print(f"Padding ROM with {padding_size} bytes of zeros to match requested size {args.size_bytes} bytes")
-            rom_words += ['32\'h00000000'] * (padding_size // 4)
+            log(f"Padding ROM with {padding_size} bytes of zeros to match requested size {args.size_bytes} bytes", quiet)
             padded_size = args.size_bytes
         elif padded_size > args.size_bytes:
             raise ValueError(f"Data size {padded_size} bytes exceeds requested ROM size of {args.size_bytes} bytes.")
@@ -191,23 +377,26 @@ def main():
             raise ValueError(f"Data size {padded_size} bytes is not a multiple of 4, cannot create ROM.")
         
         # Read original SystemVerilog file
-        print(f"Reading SystemVerilog file: {args.input_sv}")
+        log(f"Reading SystemVerilog file: {args.input_sv}", quiet)
         with open(args.input_sv, 'r') as f:
             sv_content = f.read()
         
-        # Modify SystemVerilog content
-        # print(f"Updating ROM with {len(rom_words)} words, size = {padded_size} bytes")
-        modified_content = modify_systemverilog_rom(sv_content, padded_size, rom_words)
+        # Render the ROM with the selected backend, padding the bytes instead of the words
+        outputs = generate_rom(args.backend, data.ljust(padded_size, b'\x00'), sv_content, args.output_sv,
+                               args.output_mem, args.mem_ref, args.output_bin)
         
-        # Write output file
-        # print(f"Writing modified SystemVerilog file: {args.output_sv}")
-        with open(args.output_sv, 'w') as f:
-            f.write(modified_content)
+        # Write output files, unless they are unchanged
+        written = [path for path, content in outputs.items() if write_if_changed(path, content)]
+        if key:
+            Path(args.cache).parent.mkdir(parents=True, exist_ok=True)
+            Path(args.cache).write_text(json.dumps({'input': key, 'outputs': {
+                path: hashlib.sha256(content).hexdigest() for path, content in outputs.items()}}))
         
-        print(f"Successfully updated ROM:")
-        print(f"  - Size: {padded_size} bytes ({len(rom_words)} words)")
-        print(f"  - Data: {len(rom_words)} entries")
-        print(f"  - Output: {args.output_sv}")
+        log(f"Successfully updated ROM ({args.backend}):" if written else f"ROM contents unchanged ({args.backend}):", quiet)
+        log(f"  - Size: {padded_size} bytes ({padded_size // 4} words)", quiet)
+        log(f"  - Data: {padded_size // 4} entries", quiet)
+        for path in outputs:
+            log(f"  - Output: {path}{'' if path in written else ' (unchanged)'}", quiet)
         
     except Exception as e:
         print(f"Error: {e}", file=sys.stderr)
@@ -0,0 +1,551 @@
+#!/usr/bin/env python3
+
+# Copyright (c) 2024 ETH Zurich and University of Bologna.
+# Licensed under the Apache License, Version 2.0, see LICENSE for details.
+# SPDX-License-Identifier: Apache-2.0
+#
+# Benchmark the SD-card scripts against file-backed images.
+#
+# No root or hardware is needed: the "device" is a sparse regular file in a
+# temporary directory, so the numbers reflect the CPU and syscall overhead of
+# the scripts plus the page cache, not the speed of a real card.
+#
+# `rom` compares the ROM backends of sw/bootrom/gen_bootrom.py: generation
+# time, output size and, for the tools found in PATH, elaboration time.
+#
+# `suite` is the regression suite: dump, flash and verify on sparse
+# file-backed devices (64 MiB - 4 GiB), Verilog hex parsing with several
+# gap patterns and ROM generation (gen_bootrom.py, gen_user_rom.py). Every
+# case runs in a forked process, so its peak memory can be measured. The
+# results can be saved as a baseline and later compared against it, failing
+# on a slowdown or memory growth beyond the thresholds (e.g. in CI).
+#
+# Usage:
+#     python bench.py --help
+
+import os, sys, argparse
+import contextlib, hashlib, io, json, platform, re, resource, shutil, subprocess, tempfile, time
+import textwrap
+
+import imageload
+import read
+import write
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'bootrom'))
+import gen_bootrom
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', 'rtl', 'user_domain'))
+import gen_user_rom
+
+MiB = 1 << 20
+KiB = 1 << 10
+
+# Stand-alone module with the ROM declaration of rtl/bootrom/bootrom.sv.template,
+# so the backends can be elaborated without the OBI packages
+ROM_BENCH_TEMPLATE = """module rom_bench #(
+  parameter int                          SizeBytes = 'h0010
+) (
+  input  logic [31:0] addr_i,
+  output logic [31:0] data_o
+);
+  localparam int SizeWords = SizeBytes >> 2;
+
+  logic [31:0] rom_data [0:SizeWords-1] = {
+    // --- ROM STATIC DATA START ---
+    32'h0000_0000
+    // --- ROM STATIC DATA END ---
+  };
+
+  assign data_o = rom_data[addr_i[$clog2(SizeWords)+1:2]];
+endmodule
+"""
+
+# Synthetic Verilog hex files: bytes of data every `stride` bytes of the span
+HEX_PATTERNS = {
+    'dense': (None, None),  # a single segment
+    'gaps': (1 * KiB, 4 * KiB),
+    'sparse': (256, 64 * KiB),
+}
+DEVICE_DATA = (1 * MiB, 16 * MiB)   # device images: 1 MiB of data every 16 MiB, holes between
+SUITE_DEVICE_MIB = [64, 256]
+SUITE_HEX_KIB = [64, 1024]
+SUITE_ROM_KIB = 64
+
+# Default regression thresholds: relative slowdown and memory growth, plus
+# absolute allowances for the noise of millisecond cases and small memory numbers
+MAX_SLOWDOWN = 0.25
+MAX_MEMORY = 0.25
+TIME_SLACK = 0.005
+MEMORY_SLACK_MIB = 4
+MIN_GATED_SECONDS = 0.1  # faster cases are reported, but their time is not checked
+
+# Elaboration commands per tool, {sv} is the generated module
+ELABORATORS = {
+    'verilator': ['verilator', '--lint-only', '-Wno-fatal', '--top-module', 'rom_bench', '{sv}'],
+    'yosys': ['yosys', '-q', '-p', 'read_verilog -sv {sv}; hierarchy -top rom_bench; proc'],
+    'iverilog': ['iverilog', '-g2012', '-o', '/dev/null', '{sv}'],
+}
+
+
+def legacy_flash(image: str, device: str, block_size: int = 512, offset: int = 0, erase: bool = True):
+    # The original flash_raw write path: one buffered write per block, a fresh
+    # zero block per erase step and a progress line after every block.
+    if erase:
+        with open(image, 'rb') as img, open(device, 'r+b') as dev:
+            total = os.path.getsize(image)
+            total_blocks = (total + block_size - 1) // block_size
+            dev.seek(offset * block_size)
+            for _ in range(total_blocks):
+                dev.write(b'\x00' * block_size)
+                print(f"\rErased {_+1}/{total_blocks} blocks...", end='', flush=True)
+    with open(image, 'rb') as img, open(device, 'r+b') as dev:
+        total = os.path.getsize(image)
+        dev.seek(offset * block_size)
+        written = 0
+        while True:
+            chunk = img.read(block_size)
+            if not chunk:
+                break
+            dev.write(chunk)
+            written += len(chunk)
+            print(f"\rWritten {written*100/total:5.1f}%...", end='', flush=True)
+    os.sync()
+
+
+def legacy_dump(device: str, offset: int = 0, count: int = 1, block_size: int = 512):
+    # The original read_blocks hex-dump path: read the whole range at once and
+    # print every line separately
+    with open(device, 'rb') as dev:
+        dev.seek(offset * block_size)
+        data = dev.read(count * block_size)
+    read.hex_dump(data, offset=offset * block_size)
+
+
+def make_image(path: str, size: int):
+    with open(path, 'wb') as f:
+        for _ in range(0, size, MiB):
+            f.write(os.urandom(min(MiB, size - f.tell())))
+
+
+def make_device(path: str, size: int):
+    with open(path, 'wb') as f:
+        f.truncate(size)
+
+
+def timed(fn, *args, **kwargs) -> float:
+    # Run quietly, the progress output would only skew the measurement
+    with contextlib.redirect_stdout(io.StringIO()):
+        start = time.perf_counter()
+        fn(*args, **kwargs)
+        return time.perf_counter() - start
+
+
+def report(name: str, size: int, seconds: float):
+    print(f"  {name:<24} {seconds:8.3f} s  {size / seconds / 1e6:8.1f} MB/s")
+
+
+def bench_flash(size_mib: int, block_size: int, chunk_blocks: int, repeat: int, tmpdir: str = None,
+                fanout: int = 4):
+    size = size_mib * MiB
+    with tempfile.TemporaryDirectory(dir=tmpdir) as tmp:
+        image = os.path.join(tmp, 'image.bin')
+        device = os.path.join(tmp, 'device.img')
+        make_image(image, size)
+        make_device(device, size + MiB)
+        devices = [os.path.join(tmp, f'device{i}.img') for i in range(fanout)]
+        for d in devices:
+            make_device(d, size + MiB)
+
+        print(f"Flashing {size_mib} MiB, block size {block_size} B, chunk {chunk_blocks} blocks:")
+        runs = {
+            'legacy': lambda: legacy_flash(image, device, block_size, erase=True),
+            'streaming': lambda: write.flash_raw(image, device, block_size, erase=True,
+                                                 chunk_blocks=chunk_blocks),
+            'streaming --verify': lambda: write.flash_raw(image, device, block_size, erase=True, verify=True,
+                                                          chunk_blocks=chunk_blocks),
+            # the device already holds the image, so nothing is rewritten
+            'streaming --delta': lambda: write.flash_raw(image, device, block_size, erase=True, verify=True,
+                                                         chunk_blocks=chunk_blocks, delta=True),
+            f'streaming x{fanout} devices': lambda: write.flash_raw(image, devices, block_size, erase=True,
+                                                                   chunk_blocks=chunk_blocks),
+        }
+        results = {}
+        for name, fn in runs.items():
+            results[name] = min(timed(fn) for _ in range(repeat))
+            # the fan-out moves the image once per device
+            report(name, size * (fanout if name.endswith('devices') else 1), results[name])
+        return results
+
+
+def make_mixed_image(path: str, size: int, zero_ratio: float = 0.5):
+    # Random data interleaved with zero runs, like a padded firmware image
+    with open(path, 'wb') as f:
+        for pos in range(0, size, MiB):
+            n = min(MiB, size - pos)
+            data = int(n * (1 - zero_ratio))
+            f.write(os.urandom(data) + bytes(n - data))
+
+
+def bench_dump(size_mib: int, block_size: int, repeat: int, tmpdir: str = None):
+    size = size_mib * MiB
+    count = size // block_size
+    with tempfile.TemporaryDirectory(dir=tmpdir) as tmp:
+        device = os.path.join(tmp, 'device.img')
+        make_mixed_image(device, size)
+
+        print(f"Hex-dumping {size_mib} MiB (half zeros), block size {block_size} B:")
+        runs = {
+            'legacy': lambda: legacy_dump(device, count=count, block_size=block_size),
+            'streaming': lambda: read.read_blocks(device, count=count, block_size=block_size),
+            'streaming --squeeze': lambda: read.read_blocks(device, count=count, block_size=block_size,
+                                                            squeeze=True),
+        }
+        results = {}
+        for name, fn in runs.items():
+            results[name] = min(timed(fn) for _ in range(repeat))
+            report(name, size, results[name])
+        return results
+
+
+def elaborate(tool: str, sv: str, cwd: str) -> float:
+    # Seconds to elaborate the module, None if the tool rejects it
+    cmd = [arg.format(sv=sv) for arg in ELABORATORS[tool]]
+    start = time.perf_counter()
+    result = subprocess.run(cmd, cwd=cwd, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    return time.perf_counter() - start if result.returncode == 0 else None
+
+
+def bench_rom(sizes_kib: list, repeat: int, tmpdir: str = None, tools: list = None):
+    tools = [t for t in (tools or ELABORATORS) if shutil.which(t)]
+    with tempfile.TemporaryDirectory(dir=tmpdir) as tmp:
+        print(f"Elaborating with: {', '.join(tools) or 'no tool found in PATH'}")
+        results = {}
+        for size_kib in sizes_kib:
+            size = size_kib * KiB
+            data = os.urandom(size)
+            print(f"ROM of {size_kib} KiB:")
+            print(f"  {'backend':<10} {'generate':>10} {'size':>12}" + ''.join(f" {t:>10}" for t in tools))
+            for backend in gen_bootrom.BACKENDS:
+                sv = os.path.join(tmp, f'rom_{backend}.sv')
+                paths = dict(output_sv=sv, output_mem=os.path.join(tmp, f'rom.mem{backend[-1]}'),
+                             mem_ref=os.path.join(tmp, f'rom.mem{backend[-1]}'),
+                             output_bin=os.path.join(tmp, 'rom.bin'))
+                outputs, best = None, None
+                for _ in range(repeat):
+                    start = time.perf_counter()
+                    outputs = gen_bootrom.generate_rom(backend, data, ROM_BENCH_TEMPLATE, **paths)
+                    best = min(best or 1e9, time.perf_counter() - start)
+                for path, content in outputs.items():
+                    with open(path, 'wb') as f:
+                        f.write(content)
+                out_size = sum(len(content) for content in outputs.values())
+                line = f"  {backend:<10} {best * 1e3:7.1f} ms {out_size / KiB:9.1f} KiB"
+                elaborated = {}
+                for tool in tools:
+                    # the bin backend has no SystemVerilog to elaborate
+                    seconds = elaborate(tool, sv, tmp) if backend != 'bin' else None
+                    elaborated[tool] = seconds
+                    line += f" {seconds:8.2f} s" if seconds is not None else f" {'-':>10}"
+                print(line)
+                results[(size_kib, backend)] = {'generate': best, 'size': out_size, 'elaborate': elaborated}
+        return results
+
+
+def make_sparse_image(path: str, size: int, data: int = DEVICE_DATA[0], stride: int = DEVICE_DATA[1]):
+    # A sparse image with `data` random bytes every `stride` bytes, holes between
+    with open(path, 'wb') as f:
+        f.truncate(size)
+        for pos in range(0, size, stride):
+            f.seek(pos)
+            f.write(os.urandom(min(data, size - pos)))
+
+
+def make_hex(path: str, span: int, pattern: str) -> int:
+    # A Verilog hex file covering `span` bytes in the given gap pattern,
+    # returns the bytes of data in it
+    data, stride = HEX_PATTERNS[pattern]
+    data, stride = data or span, stride or span
+    segments = [imageload.Segment(0x1000_0000 + pos, os.urandom(min(data, span - pos)))
+                for pos in range(0, span, stride)]
+    with open(path, 'w') as f:
+        f.writelines(imageload.verilog_hex(segments))
+    return sum(len(seg) for seg in segments)
+
+
+def file_digest(path: str, length: int, algorithm: str = write.DEFAULT_DIGEST) -> str:
+    h = hashlib.new(algorithm)
+    with open(path, 'rb') as f:
+        for _ in range(0, length, MiB):
+            h.update(f.read(MiB))
+    return h.hexdigest()
+
+
+def measure(fn) -> dict:
+    # Run fn in a forked process with its output discarded; returns the
+    # seconds, the peak RSS and how far it grew beyond the RSS at the start
+    r, w = os.pipe()
+    pid = os.fork()
+    if pid == 0:
+        os.close(r)
+        code = 1
+        try:
+            with open(os.devnull, 'w') as null, contextlib.redirect_stdout(null):
+                before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+                start = time.perf_counter()
+                fn()
+                seconds = time.perf_counter() - start
+            peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+            result = {'seconds': seconds, 'peak_mib': peak / KiB, 'mem_mib': (peak - before) / KiB}
+            code = 0
+        except BaseException as e:
+            result = {'error': f"{type(e).__name__}: {e}"}
+        os.write(w, json.dumps(result).encode())
+        os._exit(code)
+    os.close(w)
+    with os.fdopen(r) as f:
+        result = json.loads(f.read() or '{"error": "no result"}')
+    os.waitpid(pid, 0)
+    return result
+
+
+def suite_cases(tmp: str, device_mib: list, hex_kib: list, rom_kib: int, only: str = None) -> dict:
+    # name -> (bytes processed, function) of the cases matching only; their
+    # inputs (and only theirs) are created up front
+    def wanted(*names):
+        return [name for name in names if not only or re.search(only, name)]
+
+    cases = {}
+    block_size = 512
+    for size_mib in device_mib:
+        names = wanted(f'flash/{size_mib}M', f'verify/{size_mib}M', f'dump/{size_mib}M')
+        if not names:
+            continue
+        size = size_mib * MiB
+        image = os.path.join(tmp, f'image{size_mib}.bin')
+        device = os.path.join(tmp, f'device{size_mib}.img')
+        dump = os.path.join(tmp, f'dump{size_mib}.img')
+        make_sparse_image(image, size)
+        make_device(device, size + MiB)
+        if names != [f'flash/{size_mib}M']:
+            # flashed once up front, so verify and dump also find the image when run alone
+            with open(os.devnull, 'w') as null, contextlib.redirect_stdout(null):
+                write.flash_raw(image, device, block_size, erase=True)
+        manifest = write.manifest_entry(image, 0, size, block_size, write.DEFAULT_DIGEST, None)
+
+        def flash(image=image, device=device):
+            write.flash_raw(image, device, block_size, erase=True)
+
+        def verify(device=device, manifest=manifest, image=image, size=size):
+            # read back against a digest, as --verify does for streamed images
+            manifest['digest'] = manifest['digest'] or file_digest(image, size)
+            write.check_device(device, manifest)
+
+        def dump_sparse(device=device, dump=dump, count=size // block_size):
+            read.read_blocks(device, count=count, block_size=block_size, out=dump, sparse=True)
+            os.remove(dump)
+
+        for name, fn in zip((f'flash/{size_mib}M', f'verify/{size_mib}M', f'dump/{size_mib}M'),
+                            (flash, verify, dump_sparse)):
+            if name in names:
+                cases[name] = (size, fn)
+        if f'verify/{size_mib}M' in names:
+            # the digest is not part of the measurement
+            manifest['digest'] = file_digest(image, size)
+
+    for span_kib in hex_kib:
+        for pattern in HEX_PATTERNS:
+            if not wanted(f'hex/{pattern}/{span_kib}K'):
+                continue
+            path = os.path.join(tmp, f'{pattern}{span_kib}.hex')
+            make_hex(path, span_kib * KiB, pattern)
+            cases[f'hex/{pattern}/{span_kib}K'] = (os.path.getsize(path), lambda path=path: imageload.load(path))
+
+    rom_hex = os.path.join(tmp, 'rom.hex')
+    backends = [b for b in gen_bootrom.BACKENDS if wanted(f'rom/{b}/{rom_kib}K')]
+    if backends:
+        make_hex(rom_hex, rom_kib * KiB, 'gaps')
+    for backend in backends:
+        def rom(backend=backend):
+            _, data = gen_bootrom.convert_hex_file(rom_hex, rom_kib * KiB, quiet=True)
+            data += bytes(rom_kib * KiB - len(data))
+            outputs = gen_bootrom.generate_rom(backend, data, ROM_BENCH_TEMPLATE,
+                                               output_sv=os.path.join(tmp, 'rom.sv'),
+                                               output_mem=os.path.join(tmp, f'rom.mem{backend[-1]}'),
+                                               output_bin=os.path.join(tmp, 'rom.bin'))
+            for path, content in outputs.items():
+                with open(path, 'wb') as f:
+                    f.write(content)
+        cases[f'rom/{backend}/{rom_kib}K'] = (rom_kib * KiB, rom)
+
+    def user_rom():
+        data = gen_user_rom.convert_string(gen_user_rom.string, rom_kib * KiB)
+        gen_user_rom.write_hex(os.path.join(tmp, 'user_rom.hex'), data)
+    if wanted(f'user_rom/{rom_kib}K'):
+        cases[f'user_rom/{rom_kib}K'] = (rom_kib * KiB, user_rom)
+    return cases
+
+
+def compare(results: dict, baseline: dict, max_slowdown: float, max_memory: float,
+            min_seconds: float = MIN_GATED_SECONDS) -> list:
+    # Print the results next to the baseline, returns the regressed cases. The
+    # time is only checked for cases that took at least min_seconds in the
+    # baseline. The baseline may override the thresholds per case
+    # ('thresholds' -> 'cases').
+    overrides = baseline.get('thresholds', {}).get('cases', {})
+    regressions = []
+    print(f"\n  {'case':<24} {'seconds':>9} {'baseline':>9} {'ratio':>6} {'MiB':>7} {'baseline':>9}")
+    for name, r in results.items():
+        b = baseline['results'].get(name)
+        if 'error' in r:
+            regressions.append(name)
+            print(f"  {name:<24} FAILED: {r['error']}")
+            continue
+        if not b or 'seconds' not in b:
+            print(f"  {name:<24} {r['seconds']:9.3f} {'new':>9}")
+            continue
+        slowdown = overrides.get(name, {}).get('slowdown', max_slowdown)
+        memory = overrides.get(name, {}).get('memory', max_memory)
+        ratio = r['seconds'] / max(b['seconds'], 1e-9)
+        flags = []
+        if b['seconds'] >= min_seconds and ratio > 1 + slowdown and r['seconds'] - b['seconds'] > TIME_SLACK:
+            flags.append(f"slower than +{slowdown:.0%}")
+        if r['mem_mib'] > b['mem_mib'] * (1 + memory) + MEMORY_SLACK_MIB:
+            flags.append(f"memory above +{memory:.0%}")
+        if flags:
+            regressions.append(name)
+        print(f"  {name:<24} {r['seconds']:9.3f} {b['seconds']:9.3f} {ratio:6.2f} {r['mem_mib']:7.1f}"
+              f" {b['mem_mib']:9.1f}" + (f"  REGRESSION: {', '.join(flags)}" if flags else ""))
+    return regressions
+
+
+def bench_suite(device_mib: list, hex_kib: list, rom_kib: int, repeat: int, tmpdir: str = None,
+                only: str = None, baseline: str = None, save: str = None, max_slowdown: float = None,
+                max_memory: float = None) -> int:
+    base = None
+    if baseline:
+        try:
+            with open(baseline) as f:
+                base = json.load(f)
+        except (OSError, ValueError) as e:
+            sys.exit(f"ERROR: cannot read baseline '{baseline}': {e}")
+    # thresholds: command line, else the baseline's, else the defaults
+    thresholds = (base or {}).get('thresholds', {})
+    max_slowdown = max_slowdown if max_slowdown is not None else thresholds.get('slowdown', MAX_SLOWDOWN)
+    max_memory = max_memory if max_memory is not None else thresholds.get('memory', MAX_MEMORY)
+    min_seconds = thresholds.get('min_seconds', MIN_GATED_SECONDS)
+
+    results = {}
+    with tempfile.TemporaryDirectory(dir=tmpdir) as tmp:
+        cases = suite_cases(tmp, device_mib, hex_kib, rom_kib, only)
+        print(f"Running {len(cases)} cases, best of {repeat}:")
+        print(f"  {'case':<24} {'seconds':>9} {'MB/s':>9} {'peak MiB':>9} {'+MiB':>7}")
+        for name, (size, fn) in cases.items():
+            runs = [measure(fn) for _ in range(repeat)]
+            ok = [r for r in runs if 'error' not in r]
+            if not ok:
+                results[name] = runs[0]
+                print(f"  {name:<24} FAILED: {runs[0]['error']}")
+                continue
+            best = min(ok, key=lambda r: r['seconds'])
+            results[name] = {'bytes': size, 'seconds': round(best['seconds'], 6),
+                             'mb_s': round(size / best['seconds'] / 1e6, 3),
+                             'peak_mib': round(max(r['peak_mib'] for r in ok), 1),
+                             'mem_mib': round(min(r['mem_mib'] for r in ok), 1)}
+            r = results[name]
+            print(f"  {name:<24} {r['seconds']:9.3f} {r['mb_s']:9.1f} {r['peak_mib']:9.1f} {r['mem_mib']:7.1f}")
+
+    if save:
+        with open(save, 'w') as f:
+            json.dump({'host': platform.node(), 'python': platform.python_version(),
+                       'created': time.strftime('%Y-%m-%dT%H:%M:%S'),
+                       'options': {'device_mib': device_mib, 'hex_kib': hex_kib, 'rom_kib': rom_kib,
+                                   'repeat': repeat},
+                       'thresholds': dict(thresholds, slowdown=max_slowdown, memory=max_memory,
+                                          min_seconds=min_seconds),
+                       'results': results}, f, indent=2)
+            f.write("\n")
+        print(f"Wrote baseline '{save}'")
+    failed = [name for name, r in results.items() if 'error' in r]
+    if base:
+        failed = compare(results, base, max_slowdown, max_memory, min_seconds)
+    if failed:
+        print(f"ERROR: {len(failed)} case(s) failed or regressed: {', '.join(failed)}")
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    p = argparse.ArgumentParser(
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+        description=textwrap.dedent("""
+            Benchmark the SD-card scripts against file-backed images.
+
+            Examples:
+              # compare the legacy and streaming flash paths on a 64 MiB image:
+              ./bench.py flash --size 64
+
+              # compare the legacy and streaming hex dumps on a 4 MiB image:
+              ./bench.py dump --size 4
+
+              # compare the gen_bootrom.py backends at 4 KiB, 64 KiB and 1 MiB:
+              ./bench.py rom
+
+              # run the regression suite and store the results as the baseline:
+              ./bench.py suite --save baseline.json
+
+              # later (e.g. in CI), fail on a slowdown of more than 30 %:
+              ./bench.py suite --baseline baseline.json --max-slowdown 0.3
+        """))
+    sub = p.add_subparsers(dest='bench', required=True)
+
+    f = sub.add_parser('flash', help='measure write.py flashing throughput')
+    f.add_argument('--size', '-s', type=int, default=16, help='image size in MiB (default: 16)')
+    f.add_argument('--block-size', '-b', type=int, default=512, help='bytes per block (default: 512)')
+    f.add_argument('--chunk-blocks', '-c', type=int, default=write.DEFAULT_CHUNK_BLOCKS,
+                   help=f'blocks per transfer (default: {write.DEFAULT_CHUNK_BLOCKS})')
+    f.add_argument('--repeat', '-r', type=int, default=3, help='runs per variant, best is reported (default: 3)')
+    f.add_argument('--fanout', '-n', type=int, default=4,
+                   help='file-backed devices flashed in parallel (default: 4)')
+    f.add_argument('--tmpdir', default=None, help='directory for the file-backed images')
+
+    d = sub.add_parser('dump', help='measure read.py hex-dump throughput')
+    d.add_argument('--size', '-s', type=int, default=4, help='image size in MiB (default: 4)')
+    d.add_argument('--block-size', '-b', type=int, default=512, help='bytes per block (default: 512)')
+    d.add_argument('--repeat', '-r', type=int, default=3, help='runs per variant, best is reported (default: 3)')
+    d.add_argument('--tmpdir', default=None, help='directory for the file-backed images')
+
+    r = sub.add_parser('rom', help='compare the ROM backends of gen_bootrom.py')
+    r.add_argument('--size', '-s', type=int, action='append', default=None,
+                   help='ROM size in KiB, repeatable (default: 4, 64 and 1024)')
+    r.add_argument('--tool', '-t', action='append', choices=list(ELABORATORS), default=None,
+                   help='elaborate with this tool only, repeatable (default: all found in PATH)')
+    r.add_argument('--repeat', '-r', type=int, default=3, help='runs per backend, best is reported (default: 3)')
+    r.add_argument('--tmpdir', default=None, help='directory for the generated files')
+
+    t = sub.add_parser('suite', help='run the regression suite, optionally against a baseline')
+    t.add_argument('--device', '-s', dest='device_mib', type=int, action='append', default=None, metavar='MIB',
+                   help=f'size of a file-backed device in MiB, repeatable, up to 4096 (default: {SUITE_DEVICE_MIB})')
+    t.add_argument('--hex', dest='hex_kib', type=int, action='append', default=None, metavar='KIB',
+                   help=f'span of the synthetic hex files in KiB, repeatable (default: {SUITE_HEX_KIB})')
+    t.add_argument('--rom', dest='rom_kib', type=int, default=SUITE_ROM_KIB, metavar='KIB',
+                   help=f'ROM size for the ROM generation cases (default: {SUITE_ROM_KIB})')
+    t.add_argument('--repeat', '-r', type=int, default=3, help='runs per case, best is reported (default: 3)')
+    t.add_argument('--only', default=None, metavar='REGEX', help='only run the cases matching REGEX')
+    t.add_argument('--baseline', default=None, metavar='FILE', help='compare against this baseline, exit 1 on a regression')
+    t.add_argument('--save', default=None, metavar='FILE', help='store the results as a baseline')
+    t.add_argument('--max-slowdown', type=float, default=None,
+                   help=f'allowed relative slowdown (default: from the baseline, else {MAX_SLOWDOWN})')
+    t.add_argument('--max-memory', type=float, default=None,
+                   help=f'allowed relative memory growth (default: from the baseline, else {MAX_MEMORY})')
+    t.add_argument('--tmpdir', default=None, help='directory for the file-backed devices')
+
+    args = p.parse_args()
+    if args.bench == 'flash':
+        bench_flash(args.size, args.block_size, args.chunk_blocks, args.repeat, args.tmpdir, args.fanout)
+    elif args.bench == 'dump':
+        bench_dump(args.size, args.block_size, args.repeat, args.tmpdir)
+    elif args.bench == 'rom':
+        bench_rom(args.size or [4, 64, 1024], args.repeat, args.tmpdir, args.tool)
+    elif args.bench == 'suite':
+        sys.exit(bench_suite(args.device_mib or SUITE_DEVICE_MIB, args.hex_kib or SUITE_HEX_KIB, args.rom_kib,
+                             args.repeat, args.tmpdir, args.only, args.baseline, args.save, args.max_slowdown,
+                             args.max_memory))
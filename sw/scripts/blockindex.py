@@ -0,0 +1,250 @@
+#!/usr/bin/env python3
+
+# Copyright (c) 2024 ETH Zurich and University of Bologna.
+# Licensed under the Apache License, Version 2.0, see LICENSE for details.
+# SPDX-License-Identifier: Apache-2.0
+#
+# Compact on-disk index of the blocks of a device (e.g. SD card) or image.
+#
+# An index is built once by streaming the device (`read.py --scan`) and
+# records per block whether it is zero, a short hash of its contents and the
+# offsets of byte patterns (e.g. a magic string or a reset vector). Queries
+# and diffs between two cards then run against the index files only.
+#
+# File layout:
+#     MAGIC, u32 header length, JSON header,
+#     bitmap of non-zero blocks (1 bit per block),
+#     per-block hashes (hash_size bytes per block, all zero for zero blocks)
+#
+# Usage:
+#     python blockindex.py --help
+
+import sys, argparse
+import hashlib, json, re, struct
+import textwrap
+
+MAGIC = b'CROCBIDX'
+VERSION = 1
+HASH_SIZE = 8  # bytes of BLAKE2b per block, enough to tell blocks apart
+MAX_MATCHES = 65536  # offsets recorded per pattern, further matches are only counted
+
+BITS_TO_ASCII = bytes.maketrans(b'\x00\x01', b'01')
+ASCII_TO_BITS = bytes.maketrans(b'01', b'\x00\x01')
+
+
+def parse_pattern(spec: str) -> bytes:
+    # 'hex:deadbeef', 'str:CROC' or a plain string
+    if spec.startswith('hex:'):
+        return bytes.fromhex(spec[4:])
+    if spec.startswith('str:'):
+        spec = spec[4:]
+    return spec.encode()
+
+
+def pack_bits(flags: bytes) -> bytes:
+    # One byte per block (0/1) to a bitmap, block 0 in the LSB of the first byte
+    if not flags:
+        return b''
+    value = int(bytes(flags[::-1]).translate(BITS_TO_ASCII), 2)
+    return value.to_bytes((len(flags) + 7) // 8, 'little')
+
+
+def unpack_bits(bitmap: bytes, count: int) -> bytearray:
+    if not count:
+        return bytearray()
+    bits = format(int.from_bytes(bitmap, 'little'), f'0{count}b')[::-1][:count]
+    return bytearray(bits.encode().translate(ASCII_TO_BITS))
+
+
+class BlockIndex:
+    """Per-block zero flags, hashes and pattern matches of a block range."""
+
+    GROUP = 4096  # blocks compared at once before narrowing down a diff
+
+    def __init__(self, block_size: int = 512, offset: int = 0, source: str = None, hash_size: int = HASH_SIZE):
+        self.block_size = block_size
+        self.offset = offset          # first indexed block on the device
+        self.source = source
+        self.hash_size = hash_size
+        self.flags = bytearray()      # one byte per block, 1: block is non-zero
+        self.hashes = bytearray()     # hash_size bytes per block
+        self.matches = {}             # pattern spec -> list of byte offsets
+        self.match_counts = {}        # pattern spec -> number of matches
+
+    @property
+    def blocks(self) -> int:
+        return len(self.flags)
+
+    def regions(self):
+        # Yield (first_block, count) runs of non-zero blocks
+        for m in re.finditer(rb'\x01+', self.flags):
+            yield m.start(), m.end() - m.start()
+
+    def diff(self, other: 'BlockIndex'):
+        # Yield (first_block, count) runs of blocks whose contents differ
+        if (self.block_size, self.offset, self.hash_size) != (other.block_size, other.offset, other.hash_size):
+            raise ValueError("indexes differ in block size, offset or hash size")
+        hs = self.hash_size
+        common = min(self.blocks, other.blocks)
+        differs = bytearray(max(self.blocks, other.blocks))
+        differs[common:] = b'\x01' * (len(differs) - common)
+        for g in range(0, common, self.GROUP):
+            end = min(g + self.GROUP, common)
+            if (self.flags[g:end] == other.flags[g:end]
+                    and self.hashes[g * hs:end * hs] == other.hashes[g * hs:end * hs]):
+                continue
+            for block in range(g, end):
+                if (self.flags[block] != other.flags[block]
+                        or self.hashes[block * hs:(block + 1) * hs] != other.hashes[block * hs:(block + 1) * hs]):
+                    differs[block] = 1
+        for m in re.finditer(rb'\x01+', differs):
+            yield m.start(), m.end() - m.start()
+
+    def save(self, path: str):
+        header = json.dumps({
+            'version': VERSION, 'source': self.source, 'block_size': self.block_size, 'offset': self.offset,
+            'blocks': self.blocks, 'hash': 'blake2b', 'hash_size': self.hash_size, 'matches': self.matches,
+            'match_counts': self.match_counts,
+        }).encode()
+        with open(path, 'wb') as f:
+            f.write(MAGIC + struct.pack('<I', len(header)) + header)
+            f.write(pack_bits(self.flags))
+            f.write(self.hashes)
+
+    @classmethod
+    def load(cls, path: str) -> 'BlockIndex':
+        with open(path, 'rb') as f:
+            if f.read(len(MAGIC)) != MAGIC:
+                raise ValueError(f"'{path}' is not a block index")
+            (length,) = struct.unpack('<I', f.read(4))
+            header = json.loads(f.read(length))
+            if header['version'] != VERSION:
+                raise ValueError(f"'{path}' has unsupported index version {header['version']}")
+            index = cls(header['block_size'], header['offset'], header['source'], header['hash_size'])
+            blocks = header['blocks']
+            index.matches = header['matches']
+            index.match_counts = header['match_counts']
+            index.flags = unpack_bits(f.read((blocks + 7) // 8), blocks)
+            index.hashes = bytearray(f.read(blocks * index.hash_size))
+        return index
+
+
+class IndexBuilder:
+    """Build a BlockIndex from a stream of chunks fed in device order.
+
+    Chunks must be multiples of the block size, except for the last one.
+    Pattern matches spanning two chunks are found by carrying the tail of
+    the previous chunk over.
+    """
+
+    def __init__(self, block_size: int = 512, offset: int = 0, source: str = None, patterns: list = ()):
+        self.index = BlockIndex(block_size, offset, source)
+        self.patterns = {spec: parse_pattern(spec) for spec in patterns}
+        self.index.matches = {spec: [] for spec in self.patterns}
+        self.index.match_counts = dict.fromkeys(self.patterns, 0)
+        self.overlap = max((len(p) for p in self.patterns.values()), default=1) - 1
+        self.tail = b''
+        self.pos = 0  # bytes fed so far
+        self.zeros = bytes(block_size)
+
+    def feed(self, data):
+        index = self.index
+        bs, hs = index.block_size, index.hash_size
+        data = bytes(data)
+        blocks = (len(data) + bs - 1) // bs
+        flags = bytearray(blocks)
+        hashes = bytearray(blocks * hs)
+        if data.count(0) != len(data):
+            for b in range(blocks):
+                block = data[b * bs:(b + 1) * bs]
+                if block != self.zeros[:len(block)]:
+                    flags[b] = 1
+                    hashes[b * hs:(b + 1) * hs] = hashlib.blake2b(block, digest_size=hs).digest()
+        index.flags += flags
+        index.hashes += hashes
+
+        # pattern search over the carried tail plus this chunk
+        base = self.pos - len(self.tail)
+        window = self.tail + data
+        for spec, pattern in self.patterns.items():
+            at = window.find(pattern)
+            while at != -1:
+                # matches entirely inside the tail were found with the last chunk
+                if at + len(pattern) > len(self.tail):
+                    index.match_counts[spec] += 1
+                    if len(index.matches[spec]) < MAX_MATCHES:
+                        index.matches[spec].append(index.offset * bs + base + at)
+                at = window.find(pattern, at + 1)
+        self.tail = window[max(0, len(window) - self.overlap):]
+        self.pos += len(data)
+
+    def finish(self) -> BlockIndex:
+        return self.index
+
+
+def format_run(index: BlockIndex, start: int, count: int) -> str:
+    bs = index.block_size
+    first = index.offset + start
+    return (f"blocks {first:>10} - {first + count - 1:<10} "
+            f"(0x{first * bs:08X} - 0x{(first + count) * bs - 1:08X}, {count * bs} bytes)")
+
+
+def main():
+    p = argparse.ArgumentParser(
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+        description=textwrap.dedent("""
+            Query block indexes built with `read.py --scan`.
+
+            Examples:
+              # build an index of the whole card, recording a magic string:
+              sudo ./read.py /dev/sdb --count 0 --scan card.idx --pattern str:CROC
+
+              # list the regions of the card that hold data:
+              ./blockindex.py regions card.idx
+
+              # list the offsets of the recorded patterns:
+              ./blockindex.py matches card.idx
+
+              # compare two cards without reading them again:
+              ./blockindex.py diff card_a.idx card_b.idx
+        """))
+    sub = p.add_subparsers(dest='command', required=True)
+    for name, text in (('info', 'summary of an index'), ('regions', 'list non-zero block regions'),
+                       ('matches', 'list recorded pattern matches')):
+        sub.add_parser(name, help=text).add_argument('index', help='index file')
+    d = sub.add_parser('diff', help='list block regions that differ between two indexes')
+    d.add_argument('index', help='index file')
+    d.add_argument('other', help='index file to compare against')
+    args = p.parse_args()
+
+    try:
+        index = BlockIndex.load(args.index)
+        if args.command == 'info':
+            nonzero = index.flags.count(1)
+            print(f"Source:     {index.source}")
+            print(f"Blocks:     {index.blocks} of {index.block_size} bytes from block {index.offset}")
+            print(f"Non-zero:   {nonzero} blocks ({nonzero * index.block_size} bytes)")
+            print(f"Patterns:   {', '.join(f'{k} ({n})' for k, n in index.match_counts.items()) or '-'}")
+        elif args.command == 'regions':
+            for start, count in index.regions():
+                print(format_run(index, start, count))
+        elif args.command == 'matches':
+            for spec, offsets in index.matches.items():
+                count = index.match_counts[spec]
+                print(f"{spec}: {count} match(es){f', first {len(offsets)} listed' if count > len(offsets) else ''}")
+                for off in offsets:
+                    print(f"  0x{off:08X} (block {off // index.block_size} + 0x{off % index.block_size:03X})")
+        elif args.command == 'diff':
+            other = BlockIndex.load(args.other)
+            differing = 0
+            for start, count in index.diff(other):
+                differing += count
+                print(format_run(index, start, count))
+            print(f"{differing} differing block(s)")
+            sys.exit(1 if differing else 0)
+    except (OSError, ValueError) as e:
+        sys.exit(f"ERROR: {e}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,87 @@
+
+# Copyright (c) 2024 ETH Zurich and University of Bologna.
+# Licensed under the Apache License, Version 2.0, see LICENSE for details.
+# SPDX-License-Identifier: Apache-2.0
+#
+# Block I/O helpers shared by the SD-card scripts.
+#
+# Page-aligned buffers (usable with O_DIRECT), full positional reads and
+# writes, fast buffer comparison and the throttled progress line. Used by
+# write.py and read.py.
+
+import os, sys
+import mmap, time
+
+PROGRESS_INTERVAL = 0.2  # seconds between progress updates
+
+
+class Progress:
+    """Single-line progress report, throttled to one update per interval."""
+
+    def __init__(self, label: str, total: int, interval: float = PROGRESS_INTERVAL, inline: bool = True,
+                 initial: int = 0):
+        self.label = label
+        self.inline = inline
+        self.total = max(total, 1) if total else None  # None: unknown, e.g. a compressed stream
+        self.initial = initial  # already done before the start (e.g. resumed), not part of the rate
+        self.interval = interval
+        self.start = time.monotonic()
+        self.last = 0.0
+
+    def update(self, done: int):
+        now = time.monotonic()
+        if now - self.last < self.interval and (self.total is None or done < self.total):
+            return
+        self.last = now
+        rate = (done - self.initial) / max(now - self.start, 1e-9) / 1e6
+        if self.total and done <= self.total:
+            status = f"{done*100/self.total:5.1f}%"
+        else:
+            status = f"{done / 2**20:.1f} MiB"
+        if self.inline:
+            print(f"\r{self.label} {status} ({rate:.1f} MB/s)...", end='', flush=True)
+        else:
+            # several devices report at once, so every update gets its own line
+            log(f"{self.label} {status} ({rate:.1f} MB/s)")
+
+    def finish(self, message: str):
+        elapsed = time.monotonic() - self.start
+        if self.inline:
+            print(f"\r{message} ✔ ({elapsed:.2f} s)          ")
+        else:
+            log(f"{message} ✔ ({elapsed:.2f} s)")
+
+
+def log(message: str):
+    # One write per line, so that lines of concurrent workers do not interleave
+    sys.stdout.write(f"{message}\n")
+    sys.stdout.flush()
+
+
+def alloc_buffer(size: int) -> memoryview:
+    # Anonymous mappings are page aligned, which satisfies O_DIRECT
+    return memoryview(mmap.mmap(-1, size))
+
+
+def same(a: memoryview, b: memoryview) -> bool:
+    # Comparing 64-bit words is much faster than comparing byte by byte
+    if len(a) % 8 == 0:
+        return a.cast('Q') == b.cast('Q')
+    return a == b
+
+
+def pwrite_full(fd: int, buf: memoryview, pos: int):
+    while len(buf):
+        n = os.pwritev(fd, [buf], pos)
+        buf = buf[n:]
+        pos += n
+
+
+def pread_full(fd: int, buf: memoryview, pos: int) -> int:
+    total = 0
+    while total < len(buf):
+        n = os.preadv(fd, [buf[total:]], pos + total)
+        if not n:
+            break
+        total += n
+    return total
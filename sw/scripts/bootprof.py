@@ -0,0 +1,320 @@
+#!/usr/bin/env python3
+
+# Copyright (c) 2024 ETH Zurich and University of Bologna.
+# Licensed under the Apache License, Version 2.0, see LICENSE for details.
+# SPDX-License-Identifier: Apache-2.0
+#
+# Boot-phase latency profile from bootrom logs.
+#
+# Reads testbench output (`@<time> | [UART]   <line>`, as printed by
+# rtl/tb_croc_soc.sv) or UART captures with a timestamp per line
+# (`[12.345678] <line>` like grabserial/picocom, or `2025-01-31 12:00:00.123
+# <line>` like `ts`). Lines are streamed, so logs of many runs can be
+# processed in constant memory per boot.
+#
+# The `BR>>` markers of sw/bootrom/bootrom.c split every boot into attempts
+# (`BR>> Started` after each reset) and phases:
+#     init    Started         -> TSPI initialized   (card init, baudrate change)
+#     header  TSPI initialized -> (No) boot header   (header block read)
+#     load    (No) boot header -> Blocks loaded      (block reads)
+#     finish  Blocks loaded    -> Jumping to ...     (CRC check, block swap on)
+#     app     Jumping to ...   -> first line of the program
+# Bootroms without the header marker have no header phase, their load phase
+# starts at TSPI initialized.
+# A boot ends with the jump; earlier attempts count as retries. Captures
+# without timestamps still give the retry statistics.
+#
+# Usage:
+#     python bootprof.py --help
+
+import os, sys, argparse
+import csv, json, re
+import statistics
+import textwrap
+from datetime import datetime
+
+TIME_UNITS = {'fs': 1e-15, 'ps': 1e-12, 'ns': 1e-9, 'us': 1e-6, 'ms': 1e-3, 's': 1.0}
+
+TB_LINE = re.compile(r'^@\s*([\d.]+)\s*(fs|ps|ns|us|ms|s)\s*\|\s*\[UART\]\s*(.*)$')
+TB_OTHER = re.compile(r'^@\s*[\d.]+\s*(fs|ps|ns|us|ms|s)\s*\|')
+BRACKET_LINE = re.compile(r'^\[\s*([\d.]+)\]\s?(.*)$')
+ISO_LINE = re.compile(r'^(\d{4}-\d\d-\d\d[ T]\d\d:\d\d:\d\d(?:[.,]\d+)?)\s+(.*)$')
+
+MARKERS = [
+    ('started', re.compile(r'BR>> Started')),
+    ('try', re.compile(r'BR>> Try ([0-9a-fA-F]+)')),
+    ('reset_counter', re.compile(r'BR>> Resetting retry counter')),
+    ('skip', re.compile(r'BR>> Too many retries')),
+    ('tspi_initialized', re.compile(r'BR>> TSPI initialized')),
+    ('header', re.compile(r'BR>> (Boot|No boot) header')),
+    ('blocks_loaded', re.compile(r'BR>> Blocks loaded')),
+    ('crc_error', re.compile(r'BR>> CRC mismatch')),
+    ('jump', re.compile(r'BR>> Jumping to 0x([0-9a-fA-F]+)')),
+]
+# (name, start markers in order of preference, end marker)
+PHASES = [
+    ('init', ('started',), 'tspi_initialized'),
+    ('header', ('tspi_initialized',), 'header'),
+    ('load', ('header', 'tspi_initialized'), 'blocks_loaded'),
+    ('finish', ('blocks_loaded',), 'jump'),
+]
+METRICS = [name for name, _, _ in PHASES] + ['app', 'attempt', 'boot', 'time_to_app']
+
+SD_WINDOW = 0x6000_0000  # READWRITE_OFFSET, jumps into it are SD boots
+
+
+def parse_line(line: str):
+    """(time in seconds or None, text) of a log line; None for non-UART testbench lines."""
+    line = line.rstrip('\r\n')
+    m = TB_LINE.match(line)
+    if m:
+        return float(m.group(1)) * TIME_UNITS[m.group(2)], m.group(3)
+    if TB_OTHER.match(line):
+        return None
+    m = BRACKET_LINE.match(line)
+    if m:
+        return float(m.group(1)), m.group(2)
+    m = ISO_LINE.match(line)
+    if m:
+        return datetime.fromisoformat(m.group(1).replace(',', '.')).timestamp(), m.group(2)
+    return None, line
+
+
+class BootParser:
+    """Turn a stream of (time, text) lines into one record per boot."""
+
+    def __init__(self, source: str, label: str):
+        self.source = source
+        self.label = label
+        self.boots = 0
+        self._new_boot()
+
+    def _new_boot(self):
+        self.attempts = []     # per attempt: {marker: time}
+        self.tries = []
+        self.skipped = False
+        self.crc_errors = 0
+        self.boot_header = None  # whether the card had a header, None without the marker
+        self.target = None
+        self.app_time = None
+        self.line = 0
+
+    def feed(self, time, text: str, line: int = 0):
+        """Process one line, returns a finished boot record or None."""
+        done = None
+        marker = None
+        for name, pattern in MARKERS:
+            m = pattern.search(text)
+            if m:
+                marker = name
+                break
+        if marker is None:
+            # first program output after the jump
+            if self.target is not None and self.app_time is None and text.strip():
+                self.app_time = time
+                done = self._finish()
+            return done
+        if marker == 'started':
+            if self.target is not None:
+                done = self._finish()  # the program printed nothing
+            self.attempts.append({})
+            if not self.line:
+                self.line = line
+        elif not self.attempts:
+            self.attempts.append({})  # capture started mid-boot
+        attempt = self.attempts[-1]
+        attempt.setdefault(marker, time)
+        if marker == 'try':
+            self.tries.append(int(m.group(1), 16))
+        elif marker == 'skip':
+            self.skipped = True
+        elif marker == 'header':
+            self.boot_header = m.group(1) == 'Boot'
+        elif marker == 'crc_error':
+            self.crc_errors += 1
+        elif marker == 'jump':
+            self.target = int(m.group(1), 16)
+        return done
+
+    def close(self):
+        """Record of the boot still in progress at the end of the log, if any."""
+        if self.attempts:
+            return self._finish()
+        return None
+
+    def _finish(self) -> dict:
+        self.boots += 1
+        last = self.attempts[-1]
+        record = {
+            'source': self.source,
+            'label': self.label,
+            'index': self.boots,
+            'line': self.line,
+            'complete': self.target is not None,
+            'attempts': len(self.attempts),
+            'retries': len(self.attempts) - 1,
+            'tries': ' '.join(str(t) for t in self.tries),
+            'skipped': self.skipped,
+            'crc_errors': self.crc_errors,
+            'boot_header': self.boot_header,
+            'target': None if self.target is None else f"0x{self.target:08X}",
+            'from_sd': self.target is not None and self.target >= SD_WINDOW and not self.skipped
+                       and not self.crc_errors,
+        }
+        for name, begins, end in PHASES:
+            begin = next((last[b] for b in begins if b in last), None)
+            record[name] = elapsed(begin, last.get(end))
+        record['app'] = elapsed(last.get('jump'), self.app_time)
+        record['attempt'] = elapsed(last.get('started'), last.get('jump'))
+        record['boot'] = elapsed(self.attempts[0].get('started'), last.get('jump'))
+        record['time_to_app'] = elapsed(self.attempts[0].get('started'), self.app_time)
+        self._new_boot()
+        return record
+
+
+def elapsed(begin, end):
+    if begin is None or end is None:
+        return None
+    return round(end - begin, 12)
+
+
+def parse_file(path: str, label: str):
+    """Yield the boot records of a log file."""
+    parser = BootParser(path, label)
+    with open(path, 'r', errors='replace') as f:
+        for number, line in enumerate(f, 1):
+            parsed = parse_line(line)
+            if parsed is None:
+                continue
+            record = parser.feed(parsed[0], parsed[1], number)
+            if record:
+                yield record
+    record = parser.close()
+    if record:
+        yield record
+
+
+def summarize(records: list) -> dict:
+    """Per label: boot and retry counts and statistics of every metric."""
+    groups = {}
+    for r in records:
+        groups.setdefault(r['label'], []).append(r)
+    summary = {}
+    for label, rs in groups.items():
+        entry = {
+            'boots': len(rs),
+            'complete': sum(r['complete'] for r in rs),
+            'from_sd': sum(r['from_sd'] for r in rs),
+            'retries': sum(r['retries'] for r in rs),
+            'skipped': sum(r['skipped'] for r in rs),
+            'crc_errors': sum(r['crc_errors'] for r in rs),
+            'attempts_histogram': {},
+            'metrics': {},
+        }
+        for r in rs:
+            key = str(r['attempts'])
+            entry['attempts_histogram'][key] = entry['attempts_histogram'].get(key, 0) + 1
+        for metric in METRICS:
+            values = sorted(r[metric] for r in rs if r[metric] is not None)
+            if values:
+                entry['metrics'][metric] = {
+                    'n': len(values),
+                    'mean': statistics.fmean(values),
+                    'min': values[0],
+                    'p50': percentile(values, 50),
+                    'p95': percentile(values, 95),
+                    'max': values[-1],
+                }
+        summary[label] = entry
+    return summary
+
+
+def percentile(values: list, p: float) -> float:
+    # nearest-rank percentile of sorted values
+    index = max(0, min(len(values) - 1, -(-len(values) * p // 100) - 1))
+    return values[int(index)]
+
+
+def format_seconds(value) -> str:
+    if value is None:
+        return '-'
+    if value < 1e-3:
+        return f"{value * 1e6:.1f} us"
+    if value < 1:
+        return f"{value * 1e3:.3f} ms"
+    return f"{value:.3f} s"
+
+
+def print_summary(summary: dict):
+    for label, entry in summary.items():
+        print(f"{label}: {entry['boots']} boot(s), {entry['complete']} complete, {entry['from_sd']} from SD,"
+              f" {entry['retries']} retries, {entry['skipped']} skipped, {entry['crc_errors']} CRC error(s)")
+        histogram = ', '.join(f"{k}: {v}" for k, v in sorted(entry['attempts_histogram'].items()))
+        print(f"  attempts per boot: {histogram}")
+        if entry['metrics']:
+            print(f"  {'phase':<12} {'n':>5} {'mean':>12} {'min':>12} {'p50':>12} {'p95':>12} {'max':>12}")
+            for metric, s in entry['metrics'].items():
+                print(f"  {metric:<12} {s['n']:>5} " + ' '.join(
+                    f"{format_seconds(s[k]):>12}" for k in ('mean', 'min', 'p50', 'p95', 'max')))
+
+
+def main():
+    p = argparse.ArgumentParser(
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+        description=textwrap.dedent("""
+            Profile the boot phases in testbench output or timestamped UART captures.
+
+            Examples:
+              # one simulation run:
+              ./bootprof.py ../../verilator/sim.log
+
+              # compare two baudrate dividers, one directory of captures each:
+              ./bootprof.py logs/div20/*.log logs/div08/*.log
+
+              # export the per-boot records and the summary:
+              ./bootprof.py logs/*/*.log --csv boots.csv --json boots.json
+        """))
+    p.add_argument('logs', nargs='+', help='log files (testbench output or UART captures)')
+    p.add_argument('--label', default=None, help='label for all boots (default: from --group-by)')
+    p.add_argument('--group-by', choices=['dir', 'file', 'none'], default='dir',
+                   help='label boots by the directory or name of their log (default: dir)')
+    p.add_argument('--csv', metavar='FILE', help='write one row per boot')
+    p.add_argument('--json', metavar='FILE', help='write the summary and the boots')
+    p.add_argument('--quiet', '-q', action='store_true', help='do not print the summary')
+    args = p.parse_args()
+
+    records = []
+    try:
+        for path in args.logs:
+            if args.label is not None:
+                label = args.label
+            elif args.group_by == 'dir':
+                label = os.path.basename(os.path.dirname(os.path.abspath(path)))
+            elif args.group_by == 'file':
+                label = os.path.basename(path)
+            else:
+                label = 'all'
+            records.extend(parse_file(path, label))
+
+        summary = summarize(records)
+        if args.csv:
+            with open(args.csv, 'w', newline='') as f:
+                fields = ['source', 'label', 'index', 'line', 'complete', 'attempts', 'retries', 'tries',
+                          'skipped', 'crc_errors', 'boot_header', 'target', 'from_sd'] + METRICS
+                writer = csv.DictWriter(f, fieldnames=fields)
+                writer.writeheader()
+                writer.writerows(records)
+        if args.json:
+            with open(args.json, 'w') as f:
+                json.dump({'summary': summary, 'boots': records}, f, indent=2)
+    except (OSError, ValueError) as e:
+        sys.exit(f"ERROR: {e}")
+
+    if not args.quiet:
+        print_summary(summary)
+    if not records:
+        sys.exit("ERROR: no boots found")
+
+
+if __name__ == '__main__':
+    main()
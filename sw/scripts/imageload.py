@@ -0,0 +1,349 @@
+#!/usr/bin/env python3
+
+# Copyright (c) 2024 ETH Zurich and University of Bologna.
+# Licensed under the Apache License, Version 2.0, see LICENSE for details.
+# SPDX-License-Identifier: Apache-2.0
+#
+# Load program images into a sparse list of segments.
+#
+# Verilog hex (`objcopy -O verilog`), Intel HEX, ELF (PT_LOAD program
+# headers, at their physical/load address like objcopy) and raw binaries are
+# parsed into (address, data) segments. Address gaps are never filled in, so
+# images with a few small sections far apart stay cheap; `flatten` builds one
+# contiguous buffer when a consumer (e.g. a ROM) needs it.
+#
+# Used by sw/bootrom/gen_bootrom.py, rtl/user_domain/gen_user_rom.py and
+# write.py. The command line converts any supported image into the Verilog
+# hex read by `jtag_load_hex` in rtl/tb_croc_soc.sv.
+#
+# Usage:
+#     python imageload.py --help
+
+import os, sys, argparse
+import re, struct
+import textwrap
+
+FORMATS = ['verilog', 'ihex', 'elf', 'binary']
+EXTENSIONS = {
+    '.hex': 'verilog', '.vhx': 'verilog', '.vmem': 'verilog', '.mem': 'verilog',
+    '.ihex': 'ihex', '.ihx': 'ihex',
+    '.elf': 'elf', '.o': 'elf',
+    '.bin': 'binary', '.img': 'binary',
+}
+BATCH_SIZE = 1 << 20  # characters of hex text parsed at once
+
+HEX_ADDRESS = re.compile(r'^[ \t]*@([0-9A-Fa-f]+)[ \t]*$', re.MULTILINE)
+HEX_COMMENT = re.compile(r'//.*$|/\*.*?\*/', re.MULTILINE | re.DOTALL)
+
+ELF_MAGIC = b'\x7fELF'
+PT_LOAD = 1
+
+
+class Segment:
+    """Contiguous data at an address."""
+
+    __slots__ = ('address', 'data')
+
+    def __init__(self, address: int, data: bytes):
+        self.address = address
+        self.data = data
+
+    @property
+    def end(self) -> int:
+        return self.address + len(self.data)
+
+    def __len__(self) -> int:
+        return len(self.data)
+
+    def __repr__(self) -> str:
+        return f"Segment(0x{self.address:08X}, {len(self.data)} bytes)"
+
+
+def detect_format(path: str) -> str:
+    # By the extension only: a raw image is written byte for byte even if its
+    # contents happen to look like an ELF or hex file
+    return EXTENSIONS.get(os.path.splitext(path)[1].lower(), 'binary')
+
+
+def parse_hex_data(text: str, warn=None) -> bytes:
+    # Hex bytes separated by whitespace, converted in one go; invalid lines are
+    # reported through warn(line) and skipped, or raise without warn
+    try:
+        return bytes.fromhex(text)
+    except ValueError:
+        pass
+    data = []
+    for line in text.splitlines():
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            data.append(bytes.fromhex(line))
+        except ValueError:
+            if warn is None:
+                raise ValueError(f"invalid hex line: {line}")
+            warn(line)
+    return b''.join(data)
+
+
+def read_verilog_hex(f, warn=None):
+    """Yield the segments of a Verilog hex file (byte data, `@address` lines).
+
+    The text is parsed in batches of lines, each split at its address lines
+    and converted section by section.
+    """
+    address = start = 0
+    run = []
+    while True:
+        lines = f.readlines(BATCH_SIZE)
+        if not lines:
+            break
+        text = ''.join(lines)
+        if '/' in text:
+            text = HEX_COMMENT.sub('', text)
+        parts = HEX_ADDRESS.split(text)
+        for i, part in enumerate(parts):
+            if i % 2:
+                new = int(part, 16)
+                if new != address and run:
+                    yield Segment(start, b''.join(run))
+                    run = []
+                if not run:
+                    start = new
+                address = new
+            else:
+                data = parse_hex_data(part, warn)
+                if data:
+                    run.append(data)
+                    address += len(data)
+    if run:
+        yield Segment(start, b''.join(run))
+
+
+def read_intel_hex(f):
+    """Yield the segments of an Intel HEX file (record types 00, 01, 02, 04)."""
+    base = 0
+    start = address = None
+    run = []
+    for number, line in enumerate(f, 1):
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            if not line.startswith(':'):
+                raise ValueError("missing ':'")
+            record = bytes.fromhex(line[1:])
+            if len(record) < 5 or len(record) != record[0] + 5:
+                raise ValueError("bad record length")
+            if sum(record) & 0xFF:
+                raise ValueError("bad checksum")
+        except ValueError as e:
+            raise ValueError(f"line {number}: invalid Intel HEX record ({e}): {line}")
+        kind, offset, data = record[3], int.from_bytes(record[1:3], 'big'), record[4:-1]
+        if kind == 0x00:
+            pos = base + offset
+            if pos != address and run:
+                yield Segment(start, b''.join(run))
+                run = []
+            if not run:
+                start = pos
+            run.append(data)
+            address = pos + len(data)
+        elif kind == 0x01:
+            break
+        elif kind == 0x02:
+            base = int.from_bytes(data, 'big') << 4
+        elif kind == 0x04:
+            base = int.from_bytes(data, 'big') << 16
+        # 03/05: start address, not part of the image
+    if run:
+        yield Segment(start, b''.join(run))
+
+
+def read_elf(f):
+    """Yield the PT_LOAD program headers of an ELF file with file contents, at their load address."""
+    ident = f.read(16)
+    if not ident.startswith(ELF_MAGIC):
+        raise ValueError("not an ELF file")
+    is64, order = ident[4] == 2, '<' if ident[5] == 1 else '>'
+    header = struct.unpack(order + ('HHIQQQIHHHHHH' if is64 else 'HHIIIIIHHHHHH'), f.read(48 if is64 else 36))
+    phoff, phentsize, phnum = header[4], header[8], header[9]
+    for i in range(phnum):
+        f.seek(phoff + i * phentsize)
+        if is64:
+            p_type, _, offset, _, paddr, filesz, _, _ = struct.unpack(order + 'IIQQQQQQ', f.read(56))
+        else:
+            p_type, offset, _, paddr, filesz, _, _, _ = struct.unpack(order + 'IIIIIIII', f.read(32))
+        if p_type != PT_LOAD or not filesz:
+            continue
+        f.seek(offset)
+        data = f.read(filesz)
+        if len(data) != filesz:
+            raise ValueError(f"program header {i} extends past the end of the file")
+        yield Segment(paddr, data)
+
+
+def read_binary(f, address: int = 0):
+    """Yield a raw binary as one segment at `address`."""
+    data = f.read()
+    if data:
+        yield Segment(address, data)
+
+
+def merge(segments) -> list:
+    """Sort segments and join adjacent ones; overlapping segments are an error."""
+    runs = []  # [address, [data, ...], end]
+    for seg in sorted(segments, key=lambda s: s.address):
+        if runs and seg.address < runs[-1][2]:
+            raise ValueError(f"overlapping data at 0x{seg.address:08X}")
+        if runs and seg.address == runs[-1][2]:
+            runs[-1][1].append(seg.data)
+            runs[-1][2] = seg.end
+        else:
+            runs.append([seg.address, [seg.data], seg.end])
+    return [Segment(address, b''.join(data)) for address, data, _ in runs]
+
+
+def load(path: str, fmt: str = None, address: int = 0, warn=None) -> list:
+    """Load an image as a sorted list of non-overlapping segments.
+
+    Args:
+        path: Image file
+        fmt: One of FORMATS, from the extension (raw binary if unknown) if None
+        address: Load address of raw binaries
+        warn: Called with invalid Verilog hex lines, which are then skipped
+    """
+    fmt = fmt or detect_format(path)
+    if fmt == 'verilog':
+        with open(path, 'r') as f:
+            return merge(read_verilog_hex(f, warn))
+    if fmt == 'ihex':
+        with open(path, 'r') as f:
+            return merge(read_intel_hex(f))
+    if fmt == 'elf':
+        with open(path, 'rb') as f:
+            return merge(read_elf(f))
+    if fmt == 'binary':
+        with open(path, 'rb') as f:
+            return merge(read_binary(f, address))
+    raise ValueError(f"unknown image format '{fmt}'")
+
+
+def span(segments: list) -> tuple:
+    # (first address, end address) of sorted segments
+    if not segments:
+        return 0, 0
+    return segments[0].address, segments[-1].end
+
+
+def flatten(segments: list, start: int = None, end: int = None, fill: int = 0) -> bytearray:
+    """Contiguous buffer from start to end (default: the span of the segments), gaps filled."""
+    first, last = span(segments)
+    start = first if start is None else start
+    end = last if end is None else end
+    buf = bytearray(bytes([fill]) * (end - start))
+    for seg in segments:
+        lo, hi = max(seg.address, start), min(seg.end, end)
+        if lo < hi:
+            buf[lo - start:hi - start] = seg.data[lo - seg.address:hi - seg.address]
+    return buf
+
+
+def align(segments: list, alignment: int) -> list:
+    """Extend segments to multiples of `alignment` (zero padded), joining those that then touch."""
+    aligned = []
+    for seg in segments:
+        lo = seg.address - seg.address % alignment
+        hi = seg.end + -seg.end % alignment
+        if aligned and lo <= aligned[-1].end:
+            lo = aligned[-1].address
+            aligned[-1] = Segment(lo, bytes(flatten(aligned[-1:] + [seg], lo, hi)))
+        else:
+            aligned.append(Segment(lo, bytes(flatten([seg], lo, hi))))
+    return aligned
+
+
+def reverse_bytes(segments: list, width: int = 4) -> list:
+    """Reverse the bytes within each `width`-byte word, like `objcopy --reverse-bytes`."""
+    out = []
+    for seg in align(segments, width):
+        data = bytearray(len(seg.data))
+        for i in range(width):
+            data[i::width] = seg.data[width - 1 - i::width]
+        out.append(Segment(seg.address, bytes(data)))
+    return out
+
+
+def words_hex(data: bytes) -> str:
+    """One little-endian 32-bit word per line as 8 hex digits (for $readmemh)."""
+    data = bytes(data) + bytes(-len(data) % 4)
+    swapped = bytearray(len(data))
+    for i in range(4):
+        swapped[i::4] = data[3 - i::4]
+    return ''.join(f"{line}\n" for line in swapped.hex(' ', 4).upper().split())
+
+
+def verilog_hex(segments: list, line_bytes: int = 16):
+    """Yield the lines of a Verilog hex file, one address line per segment."""
+    width = line_bytes * 3
+    for seg in segments:
+        yield f"@{seg.address:08X}\n"
+        digits = seg.data.hex(' ').upper() + ' '
+        for i in range(0, len(digits), width):
+            yield digits[i:i + width - 1] + "\n"
+
+
+def main():
+    p = argparse.ArgumentParser(
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+        description=textwrap.dedent("""
+            Inspect and convert program images (Verilog hex, Intel HEX, ELF, raw binary).
+
+            Examples:
+              # list the loaded segments of an image:
+              ./imageload.py info ../bin/helloworld_sram.elf
+
+              # convert an ELF into the word-aligned Verilog hex read by the testbench:
+              ./imageload.py hex ../bin/helloworld_sram.elf helloworld.hex
+
+              # convert an Intel HEX into a raw binary starting at its lowest address:
+              ./imageload.py bin image.ihex image.bin
+        """))
+    p.add_argument('command', choices=['info', 'hex', 'bin'], help='list segments, write Verilog hex or raw binary')
+    p.add_argument('image', help='input image')
+    p.add_argument('output', nargs='?', help='output file (hex, bin)')
+    p.add_argument('--format', '-f', choices=FORMATS, default=None, help='input format (default: from the extension, raw binary if unknown)')
+    p.add_argument('--address', '-a', type=lambda s: int(s, 0), default=0, help='load address of raw binaries')
+    p.add_argument('--reverse-bytes', '-r', type=int, default=0, metavar='WIDTH',
+                   help='reverse the bytes of each WIDTH-byte word (like objcopy, e.g. 4 for SD images)')
+    args = p.parse_args()
+
+    try:
+        fmt = args.format or detect_format(args.image)
+        segments = load(args.image, fmt, args.address)
+        if args.reverse_bytes:
+            segments = reverse_bytes(segments, args.reverse_bytes)
+        if args.command == 'info':
+            first, last = span(segments)
+            loaded = sum(len(s) for s in segments)
+            print(f"{args.image}: {fmt}, {len(segments)} segment(s), {loaded} bytes loaded,"
+                  f" span 0x{first:08X} - 0x{last:08X} ({last - first} bytes)")
+            for seg in segments:
+                print(f"  0x{seg.address:08X} - 0x{seg.end - 1:08X}  {len(seg):>10} bytes")
+            return
+        if not args.output:
+            sys.exit(f"ERROR: '{args.command}' needs an output file")
+        if args.command == 'hex':
+            # the testbench writes whole words
+            with open(args.output, 'w') as f:
+                f.writelines(verilog_hex(align(segments, 4)))
+        else:
+            with open(args.output, 'wb') as f:
+                f.write(flatten(segments))
+        print(f"Wrote {args.output}")
+    except (OSError, ValueError) as e:
+        sys.exit(f"ERROR: {e}")
+
+
+if __name__ == '__main__':
+    main()
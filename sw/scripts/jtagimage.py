@@ -0,0 +1,135 @@
+#!/usr/bin/env python3
+
+# Copyright (c) 2024 ETH Zurich and University of Bologna.
+# Licensed under the Apache License, Version 2.0, see LICENSE for details.
+# SPDX-License-Identifier: Apache-2.0
+#
+# Pre-pack a program image for the testbench JTAG loader.
+#
+# `jtag_load_hex` in rtl/tb_croc_soc.sv parses the byte-wise Verilog hex
+# with one `$sscanf` per byte and writes every word over the system bus,
+# zeros included. The load image written here holds one 32-bit word per line
+# (little-endian, as the loader assembles them) and an `@address` record per
+# run, so the testbench (`+jtag_image=...`) needs one `$sscanf` per word. If
+# the SRAM is known to be cleared, runs of zero words are dropped; runs that
+# are only a few words apart can be merged to save address records. A warm
+# reset does not clear the SRAM, so --sram-cleared images are only valid for
+# the first load after power-up.
+#
+# Every word and every address record costs one DMI write over JTAG.
+#
+# Usage:
+#     python jtagimage.py --help
+
+import sys, argparse
+import re
+import textwrap
+
+import imageload
+
+WORD = 4
+TCK_PER_WRITE = 60  # approx. JTAG clock cycles per DMI write (IR + 41-bit DR scan)
+
+
+def split_zero_runs(segments: list, min_words: int = 2) -> list:
+    """Drop runs of at least `min_words` zero words (segments must be word-aligned)."""
+    # candidate zero runs; unaligned ones may hold fewer whole words, checked below
+    zero_words = re.compile(rb'\x00{%d,}' % (min_words * WORD))
+    out = []
+    for seg in segments:
+        start = 0
+        for m in zero_words.finditer(seg.data):
+            lo = m.start() + -m.start() % WORD
+            hi = m.end() - m.end() % WORD
+            if (hi - lo) // WORD < min_words:
+                continue
+            if lo > start:
+                out.append(imageload.Segment(seg.address + start, seg.data[start:lo]))
+            start = hi
+        if start < len(seg.data):
+            out.append(imageload.Segment(seg.address + start, seg.data[start:]))
+    return out
+
+
+def merge_gaps(segments: list, max_words: int) -> list:
+    """Join segments at most `max_words` words apart, filling the gap with zeros."""
+    out = []
+    for seg in segments:
+        if out and seg.address - out[-1].end <= max_words * WORD:
+            gap = bytes(seg.address - out[-1].end)
+            out[-1] = imageload.Segment(out[-1].address, out[-1].data + gap + seg.data)
+        else:
+            out.append(seg)
+    return out
+
+
+def image_lines(segments: list, source: str = None):
+    """Yield the lines of a load image: a comment, then per run `@ADDRESS` and its words."""
+    words = sum(len(s) for s in segments) // WORD
+    yield f"// jtag load image{f' of {source}' if source else ''}: {words} words in {len(segments)} runs\n"
+    for seg in segments:
+        yield f"@{seg.address:08X}\n"
+        yield imageload.words_hex(seg.data)
+
+
+def dmi_writes(segments: list) -> int:
+    # one write per word and one per address record
+    return sum(len(s) for s in segments) // WORD + len(segments)
+
+
+def main():
+    p = argparse.ArgumentParser(
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+        description=textwrap.dedent("""
+            Pre-pack a program image into the word-per-line load image read by the
+            testbench with +jtag_image=<file> (instead of +binary=<hex>).
+
+            Examples:
+              # pack the SRAM image of a program:
+              ./jtagimage.py ../bin/helloworld_sram.elf helloworld.jtag
+
+              # drop zero runs, the simulated SRAM starts out cleared:
+              ./jtagimage.py ../bin/helloworld_sram.hex helloworld.jtag --sram-cleared
+
+              # also join runs at most 2 words apart:
+              ./jtagimage.py ../bin/helloworld_sram.hex helloworld.jtag --sram-cleared --merge-gap 2
+        """))
+    p.add_argument('image', help='input image (Verilog hex, Intel HEX, ELF or raw binary)')
+    p.add_argument('output', help='output load image')
+    p.add_argument('--format', '-f', choices=imageload.FORMATS, default=None, help='input format (default: from the extension, raw binary if unknown)')
+    p.add_argument('--address', '-a', type=lambda s: int(s, 0), default=0, help='load address of raw binaries')
+    p.add_argument('--sram-cleared', '-z', action='store_true',
+                   help='the target memory is zero (not true after a warm reset), drop runs of zero words')
+    p.add_argument('--zero-run', type=int, default=2, metavar='WORDS',
+                   help='shortest zero run dropped with --sram-cleared (default: 2)')
+    p.add_argument('--merge-gap', type=int, default=0, metavar='WORDS',
+                   help='join runs at most WORDS words apart, writing the zeros between them (default: 0)')
+    p.add_argument('--tck', type=float, default=50, metavar='NS',
+                   help='JTAG clock period for the (unverified) load time estimate (default: 50 ns, ClkPeriodJtag)')
+    args = p.parse_args()
+
+    if args.zero_run < 1 or args.merge_gap < 0:
+        sys.exit("ERROR: --zero-run must be positive and --merge-gap not negative")
+    try:
+        # the testbench writes whole words
+        segments = imageload.align(imageload.load(args.image, args.format, args.address, warn=lambda line: print(
+            f"Warning: Skipping invalid hex line: {line}")), WORD)
+        before = dmi_writes(segments)
+        if args.sram_cleared:
+            segments = split_zero_runs(segments, args.zero_run)
+        if args.merge_gap:
+            segments = merge_gaps(segments, args.merge_gap)
+        with open(args.output, 'w') as f:
+            f.writelines(image_lines(segments, args.image))
+    except (OSError, ValueError) as e:
+        sys.exit(f"ERROR: {e}")
+
+    after = dmi_writes(segments)
+    per_write = TCK_PER_WRITE * args.tck * 1e-9
+    print(f"Wrote {args.output}: {after - len(segments)} words in {len(segments)} runs")
+    print(f"DMI writes: {before} with +binary, {after} with +jtag_image"
+          f" (unverified estimate: {before * per_write * 1e3:.2f} ms -> {after * per_write * 1e3:.2f} ms simulated)")
+
+
+if __name__ == '__main__':
+    main()
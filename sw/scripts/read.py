@@ -12,12 +12,34 @@
 # This script reads raw blocks from a block device (e.g. SD card) and either
 # hex-dumps the data to stdout or writes it to a specified output file.
 #
+# The device is read in bounded chunks into one reused buffer, so arbitrarily
+# large ranges can be dumped in constant memory. Hex lines are formatted a
+# whole chunk at a time and written to stdout in large batches.
+#
+# Dumps to a file (`--out`) are pipelined: a reader thread issues large
+# sequential reads (with readahead hints) into a ring of buffers while the
+# previous ones are written, optionally skipping zero blocks (`--sparse`) and
+# digesting the data on the fly (`--checksum`).
+#
 # Usage:
 #     python read.py --help
 
 import os, sys, argparse
+import array, hashlib, queue, stat, threading
 import textwrap
 
+from blockindex import IndexBuilder
+from blockio import Progress, alloc_buffer, pread_full, pwrite_full, same
+
+CHUNK_SIZE = 1 << 20  # bytes per read, a multiple of the line width
+DUMP_BUFFERS = 4      # chunk buffers in flight between the reader and the writer
+SPARSE_GRANULE = 4096  # zero runs of at least this size become holes with --sparse
+CHECKSUMS = ['blake2b', 'sha256', 'md5']
+
+# Printable ASCII maps to itself, everything else to '.'
+ASCII_TABLE = bytes(b if 32 <= b < 127 else ord('.') for b in range(256))
+
+
 def hex_dump(data: bytes, offset: int = 0, width: int = 16):
     for i in range(0, len(data), width):
         chunk = data[i:i+width]
@@ -30,15 +52,243 @@ def hex_dump(data: bytes, offset: int = 0, width: int = 16):
         ascii_bytes = ''.join((chr(b) if 32 <= b < 127 else '.') for b in chunk)
         print(f'{i+offset:08X}  {hex_bytes:<{width*3+2}}  |{ascii_bytes}|')
 
-def read_blocks(device: str, offset: int = 0, count: int = 1, block_size: int = 512, out: str = None):
-    # must be root
-    if hasattr(os, 'geteuid'):
-        if os.geteuid() != 0:
-            sys.exit("ERROR: this script must be run as root (sudo).")
 
+class HexDumper:
+    """Streaming hex dumper producing the same lines as `hex_dump`.
+
+    Data is fed in chunks of any size. Full 16-byte lines are laid out a chunk
+    at a time: the output is pre-filled from a line template and every column
+    (address digits, hex digits, ASCII) is filled with one strided slice
+    assignment, so there is no per-line Python work. With `squeeze`, repeated
+    lines are collapsed into a single `*` like `hexdump -C`.
+    """
+
+    WIDTH = 16
+    TEMPLATE = b'00000000  00 00 00 00 00 00 00 00  00 00 00 00 00 00 00 00    |................|\n'
+    HEX_COLUMNS = [10 + 3 * i + i // 8 for i in range(WIDTH)]
+    ASCII_COLUMN = TEMPLATE.index(b'|') + 1
+
+    def __init__(self, out=None, offset: int = 0, squeeze: bool = False):
+        self.out = out or sys.stdout
+        self.addr = offset
+        self.squeeze = squeeze
+        self.prev = None      # previous line, for squeezing
+        self.starred = False  # a '*' was printed for the current repetition
+        self.pending = b''    # partial line carried over to the next chunk
+
+    def feed(self, data):
+        data = self.pending + bytes(data)
+        full = len(data) - len(data) % self.WIDTH
+        self.pending = data[full:]
+        if full:
+            self.out.write(''.join(self._squeezed(data[:full]) if self.squeeze else [self._format(data[:full])]))
+
+    def close(self):
+        text = ''
+        if self.pending:
+            text = ''.join(self._squeezed(self.pending) if self.squeeze else [self._format(self.pending)])
+            self.pending = b''
+        if self.squeeze:
+            # like hexdump, end with the final offset so skipped tails are visible
+            text += f'{self.addr:08X}\n'
+        self.out.write(text)
+        self.out.flush()
+
+    def _squeezed(self, data):
+        # Yield formatted runs of lines, replacing repetitions by '*'
+        w = self.WIDTH
+        if self.prev is not None and data == self.prev * (len(data) // w):
+            # the whole chunk repeats the previous line
+            self.addr += len(data)
+            if not self.starred:
+                self.starred = True
+                yield '*\n'
+            return
+
+        start = i = 0
+        prev = self.prev
+        while i < len(data):
+            line = data[i:i + w]
+            if line != prev:
+                self.starred = False
+                prev = line
+                i += w
+                continue
+            if start < i:
+                yield self._format(data[start:i])
+            if not self.starred:
+                self.starred = True
+                yield '*\n'
+            # skip the whole repetition, probing with growing steps
+            end, step = i + w, w
+            while end < len(data):
+                n = min(step, len(data) - end)
+                if data[end:end + n] == prev * (n // w):
+                    end, step = end + n, step * 2
+                elif step > w:
+                    step = w
+                else:
+                    break
+            self.addr += end - i
+            start = i = end
+        self.prev = prev
+        if start < len(data):
+            yield self._format(data[start:])
+
+    def _format(self, data) -> str:
+        w = self.WIDTH
+        full = len(data) - len(data) % w
+        addr = self.addr
+        self.addr += len(data)
+        if addr + len(data) > 0xFFFFFFFF:
+            # wider addresses change the line layout, format line by line
+            return ''.join(self._format_line(data[i:i + w], addr + i) for i in range(0, len(data), w))
+
+        lines = full // w
+        out = bytearray(self.TEMPLATE * lines)
+        width = len(self.TEMPLATE)
+        # address column: big-endian 32-bit words hex-encode to 8 digits each
+        addrs = array.array('I', range(addr, addr + full, w))
+        if sys.byteorder == 'little':
+            addrs.byteswap()
+        digits = addrs.tobytes().hex().upper().encode()
+        for c in range(8):
+            out[c::width] = digits[c::8]
+        # hex columns, two digits per byte
+        digits = data[:full].hex().upper().encode()
+        for i, c in enumerate(self.HEX_COLUMNS):
+            out[c::width] = digits[2 * i::2 * w]
+            out[c + 1::width] = digits[2 * i + 1::2 * w]
+        # ASCII column
+        text = data[:full].translate(ASCII_TABLE)
+        for i in range(w):
+            out[self.ASCII_COLUMN + i::width] = text[i::w]
+
+        result = out.decode('ascii')
+        if full < len(data):
+            result += self._format_line(data[full:], addr + full)
+        return result
+
+    def _format_line(self, line, addr: int) -> str:
+        # a single line in the layout of hex_dump, also used for short lines
+        groups = '  '.join(line[j:j + 8].hex(' ').upper() for j in range(0, len(line), 8))
+        text = line.translate(ASCII_TABLE).decode('ascii')
+        return f'{addr:08X}  {groups:<{self.WIDTH*3+2}}  |{text}|\n'
+
+
+def read_chunks(dev, total_bytes: int, chunk_size: int = CHUNK_SIZE):
+    # Yield successive chunks of at most chunk_size bytes from the current
+    # position, reusing one buffer; the views are only valid until the next one
+    buf = memoryview(bytearray(max(min(chunk_size, total_bytes), 1)))
+    remaining = total_bytes
+    while remaining:
+        n = dev.readinto(buf[:min(len(buf), remaining)])
+        if not n:
+            break
+        remaining -= n
+        yield buf[:n]
+
+
+def read_ahead(fd: int, pos: int, total: int, free: queue.Queue, full: queue.Queue):
+    # Reader thread: fill free buffers with consecutive chunks of the device
+    # and pass them on, hinting the kernel to fetch the next chunk meanwhile.
+    # None ends the range (or, in `free`, stops reading early).
+    try:
+        os.posix_fadvise(fd, pos, total, os.POSIX_FADV_SEQUENTIAL)
+        done = 0
+        while done < total:
+            buf = free.get()
+            if buf is None:
+                return
+            n = min(len(buf), total - done)
+            if done + n < total:
+                os.posix_fadvise(fd, pos + done + n, min(len(buf), total - done - n), os.POSIX_FADV_WILLNEED)
+            got = pread_full(fd, buf[:n], pos + done)
+            full.put((buf, got))
+            done += got
+            if got < n:
+                break
+        full.put(None)
+    except OSError as e:
+        full.put(e)
+
+
+def data_runs(data: memoryview, zeros: memoryview, granule: int):
+    # Yield (start, end) of the runs of data that are not all-zero granules
+    if same(data, zeros[:len(data)]):
+        return
+    start = None
+    for i in range(0, len(data), granule):
+        j = min(i + granule, len(data))
+        if same(data[i:j], zeros[:j - i]):
+            if start is not None:
+                yield start, i
+                start = None
+        elif start is None:
+            start = i
+    if start is not None:
+        yield start, len(data)
+
+
+def dump(fd: int, out: str, pos: int, total: int, block_size: int = 512, sparse: bool = False,
+         checksum: str = None) -> tuple:
+    # Copy `total` bytes of the device at `pos` into the file `out`, reading
+    # and writing concurrently. Returns (bytes read, bytes left as holes, digest).
+    chunk = CHUNK_SIZE - CHUNK_SIZE % block_size
+    granule = block_size * max(1, SPARSE_GRANULE // block_size)
+    zeros = alloc_buffer(chunk) if sparse else None
+    h = hashlib.new(checksum) if checksum else None
+    free, full = queue.Queue(), queue.Queue()
+    for _ in range(DUMP_BUFFERS):
+        free.put(alloc_buffer(chunk))
+    reader = threading.Thread(target=read_ahead, args=(fd, pos, total, free, full), daemon=True)
+    done = holes = 0
+    out_fd = os.open(out, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644)
+    try:
+        reader.start()
+        progress = Progress("Dumped", total)
+        while True:
+            item = full.get()
+            if item is None:
+                break
+            if isinstance(item, Exception):
+                raise item
+            buf, n = item
+            data = buf[:n]
+            if h:
+                h.update(data)
+            if sparse:
+                written = 0
+                for start, end in data_runs(data, zeros, granule):
+                    pwrite_full(out_fd, data[start:end], done + start)
+                    written += end - start
+                holes += n - written
+            else:
+                pwrite_full(out_fd, data, done)
+            done += n
+            free.put(buf)
+            progress.update(done)
+        # a trailing hole still has to count for the file size
+        os.ftruncate(out_fd, done)
+        progress.finish("Dump complete")
+    finally:
+        free.put(None)
+        reader.join()
+        os.close(out_fd)
+    return done, holes, h.hexdigest() if h else None
+
+
+def read_blocks(device: str, offset: int = 0, count: int = 1, block_size: int = 512, out: str = None,
+                squeeze: bool = False, scan: str = None, pattern: list = None, sparse: bool = False,
+                checksum: str = None):
     if not os.path.exists(device):
         sys.exit(f"ERROR: device '{device}' not found.")
 
+    # must be root, except for file-backed images
+    if hasattr(os, 'geteuid') and stat.S_ISBLK(os.stat(device).st_mode):
+        if os.geteuid() != 0:
+            sys.exit("ERROR: this script must be run as root (sudo).")
+
     try:
         with open(device, 'rb') as dev:
             pass
@@ -48,27 +298,51 @@ def read_blocks(device: str, offset: int = 0, count: int = 1, block_size: int =
     byte_offset = offset * block_size
     total_bytes = count * block_size
 
+    read = 0
     try:
-        with open(device, 'rb') as dev:
+        with open(device, 'rb', buffering=0) as dev:
+            if count == 0:
+                # up to the end of the device
+                total_bytes = max(dev.seek(0, os.SEEK_END) - byte_offset, 0)
             dev.seek(byte_offset)
-            data = dev.read(total_bytes)
-            if len(data) < total_bytes:
-                print(f"WARNING: only read {len(data)} of {total_bytes} bytes.", file=sys.stderr)
-
+            if scan:
+                # stream the range once into a block index (see blockindex.py)
+                builder = IndexBuilder(block_size, offset, os.path.abspath(device), pattern or [])
+                for chunk in read_chunks(dev, total_bytes, CHUNK_SIZE - CHUNK_SIZE % block_size):
+                    builder.feed(chunk)
+                    read += len(chunk)
+                index = builder.finish()
+                index.save(scan)
+            elif out:
+                read, holes, digest = dump(dev.fileno(), out, byte_offset, total_bytes, block_size, sparse,
+                                           checksum)
+            else:
+                dumper = HexDumper(offset=byte_offset, squeeze=squeeze)
+                for chunk in read_chunks(dev, total_bytes):
+                    dumper.feed(chunk)
+                    read += len(chunk)
+                dumper.close()
     except PermissionError as e:
         sys.exit(f"ERROR: permission denied: {e}")
+    except BrokenPipeError:
+        # e.g. piped into `head`: point stdout at devnull, so the flush at
+        # exit does not raise again, and stop (see the Python signal docs)
+        os.dup2(os.open(os.devnull, os.O_WRONLY), sys.stdout.fileno())
+        sys.exit(1)
     except OSError as e:
         sys.exit(f"ERROR: I/O error: {e}")
 
-    if out:
-        try:
-            with open(out, 'wb') as fout:
-                fout.write(data)
-            print(f"Dumped {len(data)} bytes to '{out}'.")
-        except OSError as e:
-            sys.exit(f"ERROR writing output file: {e}")
-    else:
-        hex_dump(data, offset=byte_offset)
+    if read < total_bytes:
+        print(f"WARNING: only read {read} of {total_bytes} bytes.", file=sys.stderr)
+    if scan:
+        print(f"Indexed {index.blocks} blocks ({read} bytes) into '{scan}', "
+              f"{index.flags.count(1)} non-zero, "
+              f"{sum(index.match_counts.values())} pattern match(es).")
+    elif out:
+        print(f"Dumped {read} bytes to '{out}'" + (f" ({holes} bytes of zeros left as holes)." if sparse else "."))
+        if checksum:
+            print(f"{checksum}: {digest}")
+
 
 if __name__ == '__main__':
     p = argparse.ArgumentParser(
@@ -83,15 +357,35 @@ if __name__ == '__main__':
               # dump 128 blocks (64 KiB) at offset 2048 to a file:
               sudo ./read.py --device /dev/sdb --offset 2048 \\
                                        --count 128 --block-size 512 --out dump.bin
+
+              # hex-dump 256 MiB, collapsing repeated (e.g. zero) lines into '*':
+              sudo ./read.py /dev/sdb --count 524288 --squeeze
+
+              # dump the whole card, keeping zero blocks as holes, with a checksum:
+              sudo ./read.py /dev/sdb --count 0 --out card.img --sparse --checksum sha256
+
+              # index the whole card, recording where a magic string occurs
+              # (query the index with blockindex.py):
+              sudo ./read.py /dev/sdb --count 0 --scan card.idx --pattern str:CROC
         """))
     p.add_argument('device', help='path to block device (e.g. /dev/sdb)')
     p.add_argument('--offset',   '-o', type=int, default=0,
                    help='block offset to start reading (default: 0)')
     p.add_argument('--count',    '-n', type=int, default=1,
-                   help='number of blocks to read (default: 1)')
+                   help='number of blocks to read, 0 for all up to the end (default: 1)')
     p.add_argument('--block-size','-b', type=int, default=512,
                    help='bytes per block (default: 512)')
     p.add_argument('--out',      '-f', default=None,
                    help='optional output file (raw); if omitted, data is hex-dumped')
+    p.add_argument('--squeeze', '--skip-zero', '-s', action='store_true',
+                   help="collapse repeated hex-dump lines (e.g. zeros) into '*' like hexdump -C")
+    p.add_argument('--sparse', '-S', action='store_true',
+                   help='with --out, seek over zero blocks so that the dump stays sparse')
+    p.add_argument('--checksum', '-c', choices=CHECKSUMS, default=None,
+                   help='with --out, print a digest of the dumped data')
+    p.add_argument('--scan', default=None, metavar='INDEX',
+                   help='build a block index (zero flags, hashes, pattern matches) instead of dumping')
+    p.add_argument('--pattern', '-p', action='append', default=None,
+                   help="byte pattern to record with --scan: 'hex:<bytes>', 'str:<text>' or text (repeatable)")
     
-    read_blocks(**vars(p.parse_args()))
\ No newline at end of file
+    read_blocks(**vars(p.parse_args()))
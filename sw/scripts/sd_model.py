@@ -0,0 +1,684 @@
+#!/usr/bin/env python3
+
+# Copyright (c) 2024 ETH Zurich and University of Bologna.
+# Licensed under the Apache License, Version 2.0, see LICENSE for details.
+# SPDX-License-Identifier: Apache-2.0
+#
+# Byte-level model of an SD card in SPI mode, backed by an image file.
+#
+# The model answers the command frames the TSPI host sends (CMD0, CMD8, CMD59,
+# CMD58, CMD55/ACMD41, single and multi-block reads and writes) with R1/R2/R3/R7
+# responses, data tokens and CRC16 protected blocks, and can inject faults
+# (busy periods, CRC errors, slow start tokens, missing responses, slow init).
+#
+# `boot` replays the bootrom sequence (sw/bootrom/bootrom.c) against the model,
+# including the NUM_RETRIES handling, and reports the SPI time per phase.
+# `serve` puts the model behind a TCP socket so a DPI/VPI shim in the
+# simulation can exchange bytes with it. Protocol, one request per message:
+#     'X' u16 length, MOSI bytes   -> MISO bytes (same length)
+#     'S' u8 level                 -> chip select level (0: selected), no reply
+#     'P'                          -> power cycle, no reply
+#
+# Usage:
+#     python sd_model.py --help
+
+import sys, argparse
+import binascii, mmap, socket, struct
+import textwrap
+from collections import deque
+
+import imageload
+import sdimage
+
+BLOCK_SIZE = 512
+NUM_RETRIES = 3         # see sw/bootrom/bootrom.c
+ACMD41_POLLS = 10       # ACMD41 iterations the TSPI host allows (cnt_cmd 79 in steps of 8)
+NCR = 8                 # max. bytes between a command and its response
+TOKEN_TIMEOUT = 4096    # bytes the host model waits for a start token or the end of busy
+RESET_BAUDRATE_DIV = 0x19  # tspi_cmd_ctrl.sv config register reset value
+BOOT_BAUDRATE_DIV = 0x20   # written by the bootrom after initialization
+CLK_FREQUENCY = 20_000_000  # TB_FREQUENCY in sw/config.h
+
+# R1 bits
+R1_IDLE = 0x01
+R1_ILLEGAL = 0x04
+R1_CRC = 0x08
+R1_PARAMETER = 0x40
+
+# data tokens and responses
+TOKEN_START = 0xFE
+TOKEN_MULTI_WRITE = 0xFC
+TOKEN_STOP = 0xFD
+TOKEN_ERROR = 0x01       # data error token (`000xxxxx`): general error
+DATA_ACCEPTED = 0x05
+DATA_CRC_ERROR = 0x0B
+DATA_WRITE_ERROR = 0x0D
+
+OCR_VOLTAGES = 0x00FF8000  # 2.7 - 3.6 V
+OCR_CCS = 0x40000000
+OCR_READY = 0x80000000
+
+
+def _crc7_table():
+    table = []
+    for byte in range(256):
+        crc = byte
+        for _ in range(8):
+            crc = ((crc << 1) ^ (0x12 if crc & 0x80 else 0)) & 0xFF
+        table.append(crc)
+    return table
+
+CRC7_TABLE = _crc7_table()
+
+
+def crc7(data: bytes) -> int:
+    # x^7 + x^3 + 1 over the first five bytes of a command frame, kept in the upper 7 bits
+    crc = 0
+    for byte in data:
+        crc = CRC7_TABLE[crc ^ byte]
+    return crc >> 1
+
+
+def crc16(data: bytes) -> int:
+    # CRC-16-CCITT (XMODEM) as used for SD data blocks
+    return binascii.crc_hqx(data, 0)
+
+
+def command_frame(cmd: int, arg: int, crc: int = None) -> bytes:
+    frame = bytes([0x40 | cmd]) + arg.to_bytes(4, 'big')
+    return frame + bytes([(crc7(frame) << 1 | 1) if crc is None else crc])
+
+
+class Faults:
+    """Fault injection settings of a card, all counters are consumed as faults fire."""
+
+    FIELDS = {
+        'response_delay': "bytes of 0xFF before each response (Ncr, 1 - 8)",
+        'start_delay': "bytes of 0xFF before each read start token (Nac)",
+        'busy': "busy bytes (0x00) after each written block",
+        'init_polls': "ACMD41 polls answered with 'idle' before the card is ready",
+        'crc_errors': "commands answered with a CRC error",
+        'no_response': "commands that are ignored",
+        'read_errors': "reads answered with a data error token",
+        'data_crc_errors': "read blocks sent with a wrong CRC16",
+        'write_errors': "written blocks rejected with a write error",
+    }
+
+    def __init__(self, **values):
+        self.response_delay = 1
+        self.start_delay = 1
+        self.busy = 4
+        self.init_polls = 1
+        self.crc_errors = 0
+        self.no_response = 0
+        self.read_errors = 0
+        self.data_crc_errors = 0
+        self.write_errors = 0
+        for name, value in values.items():
+            if name not in self.FIELDS:
+                raise ValueError(f"unknown fault '{name}'")
+            setattr(self, name, value)
+
+    @classmethod
+    def parse(cls, specs: list) -> 'Faults':
+        # ['busy=100', 'crc_errors=1', ...]
+        values = {}
+        for spec in specs:
+            name, _, value = spec.partition('=')
+            try:
+                values[name.replace('-', '_')] = int(value, 0)
+            except ValueError:
+                raise ValueError(f"invalid fault '{spec}', expected name=value")
+        return cls(**values)
+
+    def take(self, name: str) -> bool:
+        # Consume one occurrence of a counted fault
+        if getattr(self, name) > 0:
+            setattr(self, name, getattr(self, name) - 1)
+            return True
+        return False
+
+
+class SdCard:
+    """SD card in SPI mode on top of an image file.
+
+    With `use_mmap` the image is mapped and writes go straight to the file,
+    otherwise the image is read into memory and the file is never modified.
+    `exchange` clocks bytes in on MOSI and returns the bytes seen on MISO.
+    """
+
+    def __init__(self, image: str, sdhc: bool = True, use_mmap: bool = False, faults: Faults = None):
+        self.sdhc = sdhc
+        self.faults = faults or Faults()
+        self.file = None
+        if use_mmap:
+            self.file = open(image, 'r+b')
+            self.data = mmap.mmap(self.file.fileno(), 0)
+        else:
+            with open(image, 'rb') as f:
+                self.data = bytearray(f.read())
+        self.blocks = len(self.data) // BLOCK_SIZE
+        self.stats = dict.fromkeys(('commands', 'bytes', 'blocks_read', 'blocks_written', 'errors'), 0)
+        self.power_cycle()
+
+    def close(self):
+        if self.file:
+            self.data.close()
+            self.file.close()
+            self.file = None
+
+    def power_cycle(self):
+        self.selected = False
+        self.idle = True
+        self.ready = False
+        self.crc_on = False     # SPI mode starts with CRC checking off (CMD0/CMD8 are always checked)
+        self.app_cmd = False
+        self.out = deque()      # MISO bytes queued for the host
+        self.frame = bytearray()
+        self.mode = 'cmd'       # 'cmd', 'write_token', 'write_data'
+        self.reading = None     # next block of a multi-block read
+        self.writing = None     # next block of a single/multi-block write
+        self.multi_write = False
+        self.polls = 0
+
+    def select(self, selected: bool = True):
+        self.selected = selected
+        if not selected:
+            self.frame.clear()
+
+    # -- byte exchange -------------------------------------------------------------------------
+
+    def exchange(self, mosi: bytes) -> bytes:
+        miso = bytearray(len(mosi))
+        if not self.selected:
+            miso[:] = b'\xff' * len(mosi)
+            return bytes(miso)
+        out, receive = self.out, self._receive
+        for i, byte in enumerate(mosi):
+            if not out and self.reading is not None:
+                self._queue_block(self.reading)
+            miso[i] = out.popleft() if out else 0xFF
+            receive(byte)
+        self.stats['bytes'] += len(mosi)
+        return bytes(miso)
+
+    def _receive(self, byte: int):
+        if self.mode == 'write_token':
+            if byte == 0xFF:
+                return
+            if self.multi_write and byte == TOKEN_STOP:
+                self.mode = 'cmd'
+                self.writing = None
+                self.out.extend(b'\xff' + b'\x00' * self.faults.busy)
+            elif byte == (TOKEN_MULTI_WRITE if self.multi_write else TOKEN_START):
+                self.mode = 'write_data'
+                self.frame.clear()
+            elif byte & 0xC0 == 0x40:
+                # a new command instead of a data block
+                self.mode = 'cmd'
+                self.writing = None
+                self.frame[:] = bytes([byte])
+            return
+        if self.mode == 'write_data':
+            self.frame.append(byte)
+            if len(self.frame) == BLOCK_SIZE + 2:
+                self._write_block()
+            return
+        if not self.frame and byte & 0xC0 != 0x40:
+            return
+        self.frame.append(byte)
+        if len(self.frame) == 6:
+            frame = bytes(self.frame)
+            self.frame.clear()
+            self._command(frame)
+
+    # -- commands ------------------------------------------------------------------------------
+
+    def _r1(self, flags: int = 0) -> int:
+        return flags | (R1_IDLE if self.idle else 0)
+
+    def _respond(self, *response: int):
+        self.out.clear()
+        self.out.extend(b'\xff' * max(1, min(self.faults.response_delay, NCR)))
+        self.out.extend(response)
+
+    def _command(self, frame: bytes):
+        cmd, arg = frame[0] & 0x3F, int.from_bytes(frame[1:5], 'big')
+        app, self.app_cmd = self.app_cmd, False
+        self.stats['commands'] += 1
+        if cmd == 12 and self.reading is not None:
+            # stop transmission: one stuff byte, then R1 and a short busy
+            self.reading = None
+            self.out.clear()
+            self.out.extend((0xFF, 0xFF, self._r1()))
+            self.out.extend(b'\x00' * self.faults.busy)
+            return
+        self.reading = None
+        if self.faults.take('no_response'):
+            self.out.clear()
+            return
+        crc_ok = frame[5] == (crc7(frame[:5]) << 1 | 1)
+        if self.faults.take('crc_errors') or (not crc_ok and (self.crc_on or cmd in (0, 8))):
+            self.stats['errors'] += 1
+            self._respond(self._r1(R1_CRC))
+            return
+
+        if cmd == 0:
+            self.idle, self.ready, self.crc_on = True, False, False
+            self._respond(R1_IDLE)
+        elif cmd == 8:
+            self._respond(self._r1(), 0x00, 0x00, (arg >> 8) & 0x0F, arg & 0xFF)
+        elif cmd == 59:
+            self.crc_on = bool(arg & 1)
+            self._respond(self._r1())
+        elif cmd == 58:
+            ocr = OCR_VOLTAGES | (OCR_READY | (OCR_CCS if self.sdhc else 0) if self.ready else 0)
+            self._respond(self._r1(), *ocr.to_bytes(4, 'big'))
+        elif cmd == 55:
+            self.app_cmd = True
+            self._respond(self._r1())
+        elif cmd == 41 and app:
+            # an SDHC card never leaves idle without the host capacity support bit
+            if self.polls >= self.faults.init_polls and (arg & OCR_CCS or not self.sdhc):
+                self.idle, self.ready = False, True
+            self.polls += 1
+            self._respond(self._r1())
+        elif self.idle:
+            self.stats['errors'] += 1
+            self._respond(self._r1(R1_ILLEGAL))
+        elif cmd == 13:
+            self._respond(self._r1(), 0x00)
+        elif cmd == 16:
+            self._respond(self._r1(0 if arg == BLOCK_SIZE else R1_PARAMETER))
+        elif cmd == 9:
+            self._respond(self._r1())
+            self._queue_data(self._csd())
+        elif cmd in (17, 18, 24, 25):
+            block = arg if self.sdhc else arg // BLOCK_SIZE
+            if block >= self.blocks:
+                self.stats['errors'] += 1
+                self._respond(self._r1(R1_PARAMETER))
+                return
+            self._respond(self._r1())
+            if cmd == 17:
+                self._queue_block(block, multi=False)
+            elif cmd == 18:
+                self.reading = block
+            else:
+                self.writing = block
+                self.multi_write = cmd == 25
+                self.mode = 'write_token'
+        else:
+            self.stats['errors'] += 1
+            self._respond(self._r1(R1_ILLEGAL))
+
+    def _csd(self) -> bytes:
+        # CSD version 2.0 with C_SIZE in units of 512 KiB
+        c_size = max(self.blocks // 1024, 1) - 1
+        csd = bytearray(16)
+        csd[0] = 0x40
+        csd[1:5] = b'\x0e\x00\x32\x5b'
+        csd[5] = 0x59
+        csd[7:10] = (c_size & 0x3FFFFF).to_bytes(3, 'big')
+        csd[10:13] = b'\x7f\x80\x0a'
+        csd[13] = 0x40
+        csd[15] = crc7(csd[:15]) << 1 | 1
+        return bytes(csd)
+
+    # -- data ----------------------------------------------------------------------------------
+
+    def _queue_data(self, data: bytes):
+        out = self.out
+        out.extend(b'\xff' * self.faults.start_delay)
+        if self.faults.take('read_errors'):
+            self.stats['errors'] += 1
+            out.append(TOKEN_ERROR)
+            return False
+        crc = crc16(data) ^ (0xFFFF if self.faults.take('data_crc_errors') else 0)
+        out.append(TOKEN_START)
+        out.extend(data)
+        out.extend(crc.to_bytes(2, 'big'))
+        return True
+
+    def _queue_block(self, block: int, multi: bool = True):
+        if block >= self.blocks:
+            # multi-block read past the end of the card
+            self.reading = None
+            self.out.extend(b'\xff' * self.faults.start_delay)
+            self.out.append(0x08)  # out of range error token
+            return
+        data = self.data[block * BLOCK_SIZE:(block + 1) * BLOCK_SIZE]
+        if self._queue_data(bytes(data)):
+            self.stats['blocks_read'] += 1
+        if multi:
+            self.reading = block + 1
+
+    def _write_block(self):
+        data, crc = bytes(self.frame[:BLOCK_SIZE]), int.from_bytes(self.frame[BLOCK_SIZE:], 'big')
+        self.frame.clear()
+        out = self.out
+        if self.crc_on and crc != crc16(data):
+            response = DATA_CRC_ERROR
+        elif self.faults.take('write_errors') or self.writing >= self.blocks:
+            response = DATA_WRITE_ERROR
+        else:
+            response = DATA_ACCEPTED
+            pos = self.writing * BLOCK_SIZE
+            self.data[pos:pos + BLOCK_SIZE] = data
+            self.stats['blocks_written'] += 1
+        if response != DATA_ACCEPTED:
+            self.stats['errors'] += 1
+        out.clear()
+        out.append(response)
+        out.extend(b'\x00' * self.faults.busy)
+        if self.multi_write and response == DATA_ACCEPTED:
+            self.writing += 1
+            self.mode = 'write_token'
+        else:
+            self.writing = None
+            self.mode = 'cmd'
+
+
+class SdError(Exception):
+    pass
+
+
+class SpiHost:
+    """SPI master on top of a card that counts the bytes it clocks.
+
+    `phase` names the current phase; bytes and SPI time are accumulated per
+    phase using the baudrate divider of the TSPI (2 * (div + 1) clock cycles
+    per SPI clock).
+    """
+
+    def __init__(self, card: SdCard, clk_frequency: int = CLK_FREQUENCY, baudrate_div: int = RESET_BAUDRATE_DIV):
+        self.card = card
+        self.clk_frequency = clk_frequency
+        self.baudrate_div = baudrate_div
+        self.phase = None
+        self.phases = {}  # phase -> [bytes, seconds]
+
+    def xfer(self, data: bytes) -> bytes:
+        stats = self.phases.setdefault(self.phase, [0, 0.0])
+        stats[0] += len(data)
+        stats[1] += len(data) * 8 * 2 * (self.baudrate_div + 1) / self.clk_frequency
+        return self.card.exchange(data)
+
+    def command(self, cmd: int, arg: int = 0, crc: int = None, extra: int = 0):
+        # Send a command frame, wait for R1 and read `extra` response bytes
+        self.xfer(b'\xff' + command_frame(cmd, arg, crc))
+        for _ in range(NCR):
+            r1 = self.xfer(b'\xff')[0]
+            if not r1 & 0x80:
+                return r1, self.xfer(b'\xff' * extra)
+        raise SdError(f"CMD{cmd}: no response")
+
+    def wait_token(self) -> int:
+        for _ in range(TOKEN_TIMEOUT):
+            token = self.xfer(b'\xff')[0]
+            if token != 0xFF:
+                return token
+        raise SdError("timeout waiting for a start token")
+
+    def wait_busy(self):
+        for _ in range(TOKEN_TIMEOUT):
+            if self.xfer(b'\xff')[0] == 0xFF:
+                return
+        raise SdError("card stayed busy")
+
+    def read_data(self, length: int = BLOCK_SIZE) -> bytes:
+        token = self.wait_token()
+        if token != TOKEN_START:
+            raise SdError(f"data error token 0x{token:02X}")
+        data = self.xfer(b'\xff' * (length + 2))
+        if crc16(data[:length]) != int.from_bytes(data[length:], 'big'):
+            raise SdError("data CRC16 mismatch")
+        return data[:length]
+
+    def block_arg(self, offset: int) -> int:
+        # Argument of a block command for a byte offset: SDHC cards are block
+        # addressed, SDSC cards byte addressed
+        return offset // BLOCK_SIZE if self.card.sdhc else offset
+
+    def read_block(self, arg: int) -> bytes:
+        r1, _ = self.command(17, arg)
+        if r1:
+            raise SdError(f"CMD17 0x{arg:08X}: R1 0x{r1:02X}")
+        return self.read_data()
+
+    def read_blocks(self, arg: int, count: int) -> bytes:
+        r1, _ = self.command(18, arg)
+        if r1:
+            raise SdError(f"CMD18 0x{arg:08X}: R1 0x{r1:02X}")
+        data = b''.join(self.read_data() for _ in range(count))
+        self.command(12)
+        self.wait_busy()
+        return data
+
+    def write_block(self, arg: int, data: bytes):
+        r1, _ = self.command(24, arg)
+        if r1:
+            raise SdError(f"CMD24 0x{arg:08X}: R1 0x{r1:02X}")
+        self._send_block(TOKEN_START, data)
+
+    def write_blocks(self, arg: int, data: bytes):
+        r1, _ = self.command(25, arg)
+        if r1:
+            raise SdError(f"CMD25 0x{arg:08X}: R1 0x{r1:02X}")
+        for pos in range(0, len(data), BLOCK_SIZE):
+            self._send_block(TOKEN_MULTI_WRITE, data[pos:pos + BLOCK_SIZE])
+        self.xfer(bytes([TOKEN_STOP, 0xFF]))
+        self.wait_busy()
+
+    def _send_block(self, token: int, data: bytes):
+        data = data.ljust(BLOCK_SIZE, b'\x00')
+        self.xfer(bytes([0xFF, token]) + data + crc16(data).to_bytes(2, 'big'))
+        response = self.xfer(b'\xff')[0] & 0x1F
+        if response != DATA_ACCEPTED:
+            raise SdError(f"data response 0x{response:02X}")
+        self.wait_busy()
+
+
+# Blocks read by the bootrom as byte offsets into READWRITE_OFFSET. The block
+# swap hands the TSPI the block number (address bits [28:9]) as the command
+# argument, which is what SDHC cards expect; see SpiHost.block_arg.
+BOOT_READS = [0x000, 0x200, 0x400, 0x600, 0x800, 0xA00, 0xC00, 0xE00, 0x1000, 0x1200, 0x1400, 0x1600]
+BOOT_HEADER_ARG = sdimage.HEADER_OFFSET  # fixed header block, see sdimage.py
+
+
+def read_boot_header(host: SpiHost):
+    # Boot header of an sdimage.py image, None if the card has none
+    if BOOT_HEADER_ARG // BLOCK_SIZE >= host.card.blocks:
+        return None  # the image ends before the header block
+    block = host.read_block(host.block_arg(BOOT_HEADER_ARG))
+    try:
+        return sdimage.parse_header(imageload.reverse_bytes([imageload.Segment(0, block)])[0].data)
+    except ValueError:
+        return None
+
+
+def verify_segments(host: SpiHost, header: dict, loaded: dict, log=print) -> bool:
+    # CRC of every segment over the loaded blocks, False on a mismatch;
+    # blocks that were not preloaded are swapped in on demand, as on the SoC
+    for address, size, crc in header['segments']:
+        offset = address - sdimage.WINDOW_BASE
+        first, last = offset // BLOCK_SIZE, (offset + size - 1) // BLOCK_SIZE
+        for block in range(first, last + 1):
+            if block not in loaded:
+                loaded[block] = host.read_block(host.block_arg(block * BLOCK_SIZE))
+        data = b''.join(loaded[b] for b in range(first, last + 1))
+        data = imageload.reverse_bytes([imageload.Segment(0, data)])[0].data
+        start = offset - first * BLOCK_SIZE
+        if sdimage.crc32(data[start:start + size]) != crc:
+            log(f"BR>> CRC mismatch in segment at 0x{address:x}")
+            return False
+    return True
+
+
+def init_card(host: SpiHost):
+    # Command bytes and expected responses as in tspi_cmd_ctrl.sv / tspi_resp_checker.sv
+    host.card.select(False)
+    host.xfer(b'\xff' * 10)  # BEGINNING_OFFSET: >= 74 clocks with CS high
+    host.card.select(True)
+    r1, _ = host.command(0, 0, 0x95)
+    if r1 != R1_IDLE:
+        raise SdError(f"CMD0: R1 0x{r1:02X}")
+    r1, r7 = host.command(8, 0x1AA, 0x87, extra=4)
+    if r1 != R1_IDLE or r7[3] != 0xAA:
+        raise SdError(f"CMD8: R1 0x{r1:02X}, R7 {r7.hex()}")
+    r1, _ = host.command(59, 0, 0x91)
+    if r1 != R1_IDLE:
+        raise SdError(f"CMD59: R1 0x{r1:02X}")
+    r1, ocr = host.command(58, 0, 0x01, extra=4)
+    if r1 != R1_IDLE or ocr[:3] != b'\x00\xff\x80':
+        raise SdError(f"CMD58: R1 0x{r1:02X}, OCR {ocr.hex()}")
+    for _ in range(ACMD41_POLLS):
+        host.command(55, 0, 0x01)
+        r1, _ = host.command(41, OCR_CCS, 0x01)
+        if r1 == 0x00:
+            break
+        if r1 != R1_IDLE:
+            raise SdError(f"ACMD41: R1 0x{r1:02X}")
+    else:
+        raise SdError(f"ACMD41: card not ready after {ACMD41_POLLS} polls")
+
+
+def boot(card: SdCard, retries: int = NUM_RETRIES, clk_frequency: int = CLK_FREQUENCY, log=print,
+         stream: bool = False):
+    """Replay the bootrom: initialization, baudrate change and block reads.
+
+    A failure resets the SoC and the bootrom tries again, the retry counter in
+    SRAM survives the reset. With a boot header (sdimage.py) only the blocks
+    of the image are preloaded and the segment CRCs are checked. `stream`
+    reads the preloaded blocks with one CMD18 instead of CMD17 per block, to
+    estimate a multi-block TSPI path. Returns (booted_from_sd, attempts, host).
+    """
+    host = SpiHost(card, clk_frequency)
+    counter = 0
+    attempts = 0
+    while True:
+        counter += 1
+        if counter > retries:
+            counter = 0
+        if counter == retries:
+            log("BR>> Too many retries, skipping initialization!")
+            return False, attempts, host
+        attempts += 1
+        log(f"BR>> Try {counter + 1:x}")
+        host.baudrate_div = RESET_BAUDRATE_DIV
+        try:
+            host.phase = f'try {attempts} init'
+            init_card(host)
+            host.baudrate_div = BOOT_BAUDRATE_DIV
+            log("BR>> TSPI initialized")
+            host.phase = f'try {attempts} load'
+            header = read_boot_header(host)
+            blocks = len(BOOT_READS)
+            if header:
+                blocks = min(header['blocks'], sdimage.NUM_BLOCK_SLOTS)
+                log(f"BR>> Boot header: {header['blocks']:x} blocks, entry 0x{header['entry']:x}")
+            else:
+                log("BR>> No boot header")
+            if stream:
+                data = host.read_blocks(host.block_arg(BOOT_READS[0]), blocks) if blocks else b''
+                loaded = {b: data[b * BLOCK_SIZE:(b + 1) * BLOCK_SIZE] for b in range(blocks)}
+            else:
+                loaded = {b: host.read_block(host.block_arg(offset)) for b, offset in enumerate(BOOT_READS[:blocks])}
+            log("BR>> Blocks loaded")
+            if header and header['flags'] & sdimage.FLAG_VERIFY:
+                host.phase = f'try {attempts} verify'
+                if not verify_segments(host, header, loaded, log):
+                    return False, attempts, host  # the bootrom jumps to SRAM instead
+            return True, attempts, host
+        except SdError as e:
+            log(f"BR>> {e} (reset)")
+
+
+def serve(card: SdCard, host: str, port: int):
+    # Exchange bytes with a simulator shim, one connection at a time
+    with socket.create_server((host, port)) as server:
+        print(f"Listening on {host}:{port}")
+        while True:
+            conn, peer = server.accept()
+            print(f"Connected: {peer[0]}:{peer[1]}")
+            with conn, conn.makefile('rb') as f:
+                while True:
+                    op = f.read(1)
+                    if not op:
+                        break
+                    if op == b'X':
+                        (length,) = struct.unpack('<H', f.read(2))
+                        conn.sendall(card.exchange(f.read(length)))
+                    elif op == b'S':
+                        card.select(f.read(1) == b'\x00')
+                    elif op == b'P':
+                        card.power_cycle()
+                    else:
+                        print(f"Unknown request {op!r}, closing")
+                        break
+            print(f"Disconnected, card stats: {card.stats}")
+
+
+def main():
+    p = argparse.ArgumentParser(
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+        description=textwrap.dedent("""
+            Model an SD card in SPI mode on top of an image file.
+
+            Examples:
+              # replay the bootrom sequence against an image:
+              ./sd_model.py boot image.bin
+
+              # boot a packed image (sdimage.py), modelling CMD18 preloading:
+              ./sd_model.py boot helloworld.img --stream
+
+              # check the retries: the first two ACMD41 loops time out
+              ./sd_model.py boot image.bin --fault init_polls=15
+
+              # slow card: long busy periods and start tokens
+              ./sd_model.py boot image.bin --fault start_delay=200 --fault busy=1000
+
+              # serve the card to a simulation shim, writes go to the image:
+              ./sd_model.py serve image.bin --port 5555 --mmap
+        """))
+    p.add_argument('command', choices=['boot', 'serve'], help='replay the bootrom or serve the card over TCP')
+    p.add_argument('image', help='card image (raw, multiple of 512 bytes)')
+    p.add_argument('--sdsc', action='store_true', help='standard capacity card (byte addressed)')
+    p.add_argument('--mmap', action='store_true', help='map the image, writes modify the file')
+    p.add_argument('--fault', '-f', action='append', default=[], metavar='NAME=VALUE',
+                   help='inject a fault: ' + ', '.join(f"{k} ({v})" for k, v in Faults.FIELDS.items()))
+    p.add_argument('--retries', type=int, default=NUM_RETRIES, help='NUM_RETRIES of the bootrom')
+    p.add_argument('--stream', action='store_true',
+                   help='preload with one multi-block read (CMD18) instead of one CMD17 per block')
+    p.add_argument('--clk', type=int, default=CLK_FREQUENCY, help='system clock frequency in Hz')
+    p.add_argument('--host', default='127.0.0.1', help='address to listen on')
+    p.add_argument('--port', type=int, default=5555, help='port to listen on')
+    args = p.parse_args()
+
+    try:
+        card = SdCard(args.image, sdhc=not args.sdsc, use_mmap=args.mmap, faults=Faults.parse(args.fault))
+    except (OSError, ValueError) as e:
+        sys.exit(f"ERROR: {e}")
+
+    try:
+        if args.command == 'serve':
+            serve(card, args.host, args.port)
+            return
+        booted, attempts, host = boot(card, args.retries, args.clk, stream=args.stream)
+        print()
+        print(f"{'Phase':<12} {'Bytes':>8} {'SPI time':>12}")
+        for phase, (count, seconds) in host.phases.items():
+            print(f"{phase:<12} {count:>8} {seconds * 1e3:>9.3f} ms")
+        total = sum(seconds for _, seconds in host.phases.values())
+        print(f"{'total':<12} {sum(c for c, _ in host.phases.values()):>8} {total * 1e3:>9.3f} ms")
+        print(f"Attempts: {attempts}, card stats: {card.stats}")
+        if not booted:
+            sys.exit("ERROR: boot from SD card failed")
+    except KeyboardInterrupt:
+        pass
+    finally:
+        card.close()
+
+
+if __name__ == '__main__':
+    main()
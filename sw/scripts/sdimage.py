@@ -0,0 +1,176 @@
+#!/usr/bin/env python3
+
+# Copyright (c) 2024 ETH Zurich and University of Bologna.
+# Licensed under the Apache License, Version 2.0, see LICENSE for details.
+# SPDX-License-Identifier: Apache-2.0
+#
+# Pack a program into an SD boot image with a boot header.
+#
+# The card is seen through the block swap window at READWRITE_OFFSET
+# (0x6000_0000 - 0x7FFF_FFFF), address bits [28:9] being the card block.
+# Programs linked with sw/link_sd.ld start at the beginning of the window, so
+# the boot header goes into a fixed block, the last one of the first 2 MiB of
+# the card (HEADER_BLOCK, BOOT_HEADER_BLOCK in sw/bootrom/bootrom.c). The bootrom reads it, preloads only the blocks the program
+# occupies (at most the number of block swap slots) and checks the CRC32 of
+# every segment before jumping to the entry point. Cards without a valid
+# header boot as before.
+#
+# Header (CPU view, little-endian 32-bit words):
+#     magic 'CRSD', u16 version, u16 number of segments, entry address,
+#     blocks to preload, flags (bit 0: verify), CRC32 of the header (this
+#     field zero), then MAX_SEGMENTS x (address, size, CRC32)
+#
+# Like the _sd.bin images of sw/Makefile, the whole image is stored with the
+# bytes of each 32-bit word reversed, as the TSPI shifts words MSB first.
+#
+# Usage:
+#     python sdimage.py --help
+
+import sys, argparse
+import struct, zlib
+import textwrap
+
+import imageload
+
+BLOCK_SIZE = 512
+WINDOW_BASE = 0x6000_0000   # READWRITE_OFFSET in sw/bootrom/bootrom.c
+HEADER_BLOCK = 0xFFF        # BOOT_HEADER_BLOCK in sw/bootrom/bootrom.c
+HEADER_OFFSET = HEADER_BLOCK * BLOCK_SIZE
+IMAGE_SIZE = HEADER_OFFSET + BLOCK_SIZE
+NUM_BLOCK_SLOTS = 12        # NUM_SRAM_ADDRESSES in rtl/croc_pkg.sv
+LEGACY_BLOCKS = 12          # blocks the bootrom loads without a header
+
+MAGIC = 0x44535243          # 'CRSD'
+VERSION = 1
+MAX_SEGMENTS = 8
+FLAG_VERIFY = 1
+HEADER = struct.Struct('<IHHIIII')
+SEGMENT = struct.Struct('<III')
+HEADER_SIZE = HEADER.size + MAX_SEGMENTS * SEGMENT.size
+
+
+def crc32(data: bytes) -> int:
+    # reflected CRC-32 (0xEDB88320), as computed by the bootrom
+    return zlib.crc32(data) & 0xFFFFFFFF
+
+
+def build_header(segments: list, entry: int, verify: bool = True) -> bytes:
+    """Boot header (CPU view) for segments inside the window."""
+    if len(segments) > MAX_SEGMENTS:
+        raise ValueError(f"{len(segments)} segments, the boot header holds at most {MAX_SEGMENTS}")
+    end = max(seg.end for seg in segments) - WINDOW_BASE
+    blocks = (end + BLOCK_SIZE - 1) // BLOCK_SIZE
+    table = b''.join(SEGMENT.pack(s.address, len(s), crc32(s.data)) for s in segments)
+    table = table.ljust(MAX_SEGMENTS * SEGMENT.size, b'\x00')
+    flags = FLAG_VERIFY if verify else 0
+    header = HEADER.pack(MAGIC, VERSION, len(segments), entry, blocks, flags, 0) + table
+    return HEADER.pack(MAGIC, VERSION, len(segments), entry, blocks, flags, crc32(header)) + table
+
+
+def parse_header(data: bytes) -> dict:
+    """Decode and check a boot header (CPU view), raises ValueError if invalid."""
+    magic, version, count, entry, blocks, flags, crc = HEADER.unpack_from(data)
+    if magic != MAGIC:
+        raise ValueError("no boot header")
+    if version != VERSION or count > MAX_SEGMENTS:
+        raise ValueError(f"unsupported boot header (version {version}, {count} segments)")
+    if crc32(data[:HEADER.size - 4] + bytes(4) + data[HEADER.size:HEADER_SIZE]) != crc:
+        raise ValueError("boot header CRC mismatch")
+    segments = [SEGMENT.unpack_from(data, HEADER.size + i * SEGMENT.size) for i in range(count)]
+    return {'entry': entry, 'blocks': blocks, 'flags': flags, 'segments': segments}
+
+
+def pack(segments: list, entry: int = None, verify: bool = True) -> list:
+    """Segments of the boot image (CPU view): the program plus the header block."""
+    if not segments:
+        raise ValueError("empty image")
+    for seg in segments:
+        if seg.address < WINDOW_BASE or seg.end > WINDOW_BASE + HEADER_OFFSET:
+            raise ValueError(f"segment 0x{seg.address:08X} - 0x{seg.end - 1:08X} outside of the SD window"
+                             f" 0x{WINDOW_BASE:08X} - 0x{WINDOW_BASE + HEADER_OFFSET - 1:08X}")
+    segments = imageload.align(segments, 4)
+    entry = segments[0].address if entry is None else entry
+    header = build_header(segments, entry, verify)
+    return segments + [imageload.Segment(WINDOW_BASE + HEADER_OFFSET, header.ljust(BLOCK_SIZE, b'\x00'))]
+
+
+def elf_entry(path: str) -> int:
+    # e_entry of a 32-bit ELF, None for 64-bit files
+    with open(path, 'rb') as f:
+        ident = f.read(28)
+    if ident[4] != 1:
+        return None
+    return struct.unpack_from('<I' if ident[5] == 1 else '>I', ident, 24)[0]
+
+
+def main():
+    p = argparse.ArgumentParser(
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+        description=textwrap.dedent("""
+            Pack a program into an SD boot image with a boot header, so the bootrom
+            only loads (and verifies) the blocks the program occupies.
+
+            Examples:
+              # pack the SD build of a program:
+              ./sdimage.py ../bin/helloworld_sd.elf helloworld.img
+
+              # pack a byte-swapped raw binary as built by sw/Makefile:
+              ./sdimage.py ../bin/helloworld_sd.bin helloworld.img --swapped
+
+              # show the header of a packed image:
+              ./sdimage.py --info helloworld.img
+
+              # flash it:
+              sudo ./write.py helloworld.img /dev/sdb --delta
+        """))
+    p.add_argument('image', help='program (ELF, hex or raw binary at the window base) or, with --info, a packed image')
+    p.add_argument('output', nargs='?', help='boot image to write (raw, 2 MiB, zero blocks left sparse)')
+    p.add_argument('--format', '-f', choices=imageload.FORMATS, default=None, help='input format (default: from the extension, raw binary if unknown)')
+    p.add_argument('--swapped', action='store_true',
+                   help='the input already has the bytes of each word reversed (like the _sd.bin/_sd.hex outputs)')
+    p.add_argument('--entry', type=lambda s: int(s, 0), default=None,
+                   help='entry point (default: ELF entry or start of the first segment)')
+    p.add_argument('--no-verify', action='store_true', help='do not let the bootrom check the segment CRCs')
+    p.add_argument('--info', action='store_true', help='decode the header of a packed image')
+    args = p.parse_args()
+
+    try:
+        if args.info:
+            with open(args.image, 'rb') as f:
+                f.seek(HEADER_OFFSET)
+                block = f.read(BLOCK_SIZE)
+            header = parse_header(bytes(imageload.reverse_bytes([imageload.Segment(0, block)])[0].data))
+            print(f"Entry 0x{header['entry']:08X}, {header['blocks']} blocks preloaded,"
+                  f" verify {'on' if header['flags'] & FLAG_VERIFY else 'off'}")
+            for address, size, crc in header['segments']:
+                print(f"  0x{address:08X} - 0x{address + size - 1:08X}  {size:>8} bytes  CRC32 0x{crc:08X}")
+            return
+        if not args.output:
+            sys.exit("ERROR: an output file is needed")
+
+        fmt = args.format or imageload.detect_format(args.image)
+        segments = imageload.load(args.image, fmt, WINDOW_BASE)
+        if args.swapped:
+            segments = imageload.reverse_bytes(segments)
+        entry = args.entry
+        if entry is None and fmt == 'elf':
+            entry = elf_entry(args.image)
+        image = imageload.reverse_bytes(pack(segments, entry, not args.no_verify))
+
+        with open(args.output, 'wb') as f:
+            for seg in image:
+                f.seek(seg.address - WINDOW_BASE)
+                f.write(seg.data)
+            f.truncate(IMAGE_SIZE)
+    except (OSError, ValueError) as e:
+        sys.exit(f"ERROR: {e}")
+
+    header = parse_header(bytes(imageload.reverse_bytes(image[-1:])[0].data))
+    loaded = min(header['blocks'], NUM_BLOCK_SLOTS)
+    extra = header['blocks'] - loaded
+    print(f"Wrote {args.output}: {len(image) - 1} segment(s), entry 0x{header['entry']:08X}")
+    print(f"Bootrom loads {loaded} block(s) and the header instead of {LEGACY_BLOCKS} blocks"
+          + (f", the other {extra} on demand" if extra else ""))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,401 @@
+#!/usr/bin/env python3
+
+# Copyright (c) 2024 ETH Zurich and University of Bologna.
+# Licensed under the Apache License, Version 2.0, see LICENSE for details.
+# SPDX-License-Identifier: Apache-2.0
+#
+# Profile an execution trace of the cve2 tracer.
+#
+# With the tracer enabled (TRACE_EXECUTION, rtl/cve2/cve2_tracer.sv), the
+# simulation writes `trace_core_<hartid>.log` with one tab-separated line per
+# retired instruction:
+#     time  cycle  PC  insn  mnemonic  [operands]  register and memory contents
+# The log is streamed and only aggregated per PC, so the memory needed does
+# not grow with the length of the trace. The cycles between two retired
+# instructions are charged to the later one; everything beyond one cycle
+# counts as stall (fetch, memory and multi-cycle execution).
+#
+# Reported are the hottest PCs and functions (symbolized with the symbol
+# tables of the given ELF files, e.g. sw/bin/<prog>_sram.elf), the
+# instruction class mix, cycles and stalls per code region and a histogram
+# of the loads and stores per address map region (rtl/croc_pkg.sv,
+# rtl/user_pkg.sv). With --jobs the file is split into byte ranges that are
+# processed in parallel.
+#
+# Usage:
+#     python tracestat.py --help
+
+import os, sys, argparse
+import bisect, json, struct
+import multiprocessing
+import textwrap
+
+# address map: name, start, size
+REGIONS = [
+    ('debug', 0x0000_0000, 0x0004_0000),
+    ('soc_ctrl', 0x0300_0000, 0x1000),
+    ('uart', 0x0300_2000, 0x1000),
+    ('gpio', 0x0300_5000, 0x1000),
+    ('timer', 0x0300_A000, 0x1000),
+    ('bootrom', 0x0300_D000, 0x1000),
+    ('sram', 0x1000_0000, 4 * 512 * 4),
+    ('user_rom', 0x2000_0000, 0x1000),
+    ('block_swap', 0x2001_0000, 0x100),
+    ('tspi', 0x4000_0000, 0x2000_0000),       # transparent SPI
+    ('sd_window', 0x6000_0000, 0x2000_0000),  # block swap window on the SD card
+]
+REGION_STARTS = [start for _, start, _ in REGIONS]
+
+# instruction classes by mnemonic (compressed instructions without the `c.`)
+CLASSES = {
+    'load': ['lb', 'lh', 'lw', 'lbu', 'lhu', 'lwsp'],
+    'store': ['sb', 'sh', 'sw', 'swsp'],
+    'branch': ['beq', 'bne', 'blt', 'bge', 'bltu', 'bgeu', 'beqz', 'bnez'],
+    'jump': ['jal', 'jalr', 'j', 'jr'],
+    'mul': ['mul', 'mulh', 'mulhsu', 'mulhu'],
+    'div': ['div', 'divu', 'rem', 'remu'],
+    'csr': ['csrrw', 'csrrs', 'csrrc', 'csrrwi', 'csrrsi', 'csrrci'],
+    'system': ['ecall', 'ebreak', 'mret', 'dret', 'wfi', 'fence', 'fence.i'],
+}
+CLASS_OF = {mnemonic: name for name, mnemonics in CLASSES.items() for mnemonic in mnemonics}
+
+SHT_SYMTAB = 2
+SHF_EXECINSTR = 0x4
+STT_NOTYPE, STT_FUNC = 0, 2
+
+
+def region_of(address: int) -> str:
+    i = bisect.bisect_right(REGION_STARTS, address) - 1
+    if i >= 0 and address < REGIONS[i][1] + REGIONS[i][2]:
+        return REGIONS[i][0]
+    return 'unmapped'
+
+
+def class_of(mnemonic: str) -> str:
+    base = mnemonic[2:] if mnemonic.startswith('c.') else mnemonic
+    return CLASS_OF.get(base, 'alu')
+
+
+def read_symbols(path: str) -> list:
+    """(address, size, name) of the functions and code labels in the symbol table of an ELF file."""
+    with open(path, 'rb') as f:
+        data = f.read()
+    if not data.startswith(b'\x7fELF'):
+        raise ValueError(f"{path}: not an ELF file")
+    is64, order = data[4] == 2, '<' if data[5] == 1 else '>'
+    if is64:
+        shoff, shentsize, shnum = struct.unpack_from(order + 'Q', data, 40)[0], *struct.unpack_from(order + 'HH', data, 58)
+        sh_fmt, sym_fmt = order + 'IIQQQQIIQQ', order + 'IBBHQQ'
+    else:
+        shoff, shentsize, shnum = struct.unpack_from(order + 'I', data, 32)[0], *struct.unpack_from(order + 'HH', data, 46)
+        sh_fmt, sym_fmt = order + 'IIIIIIIIII', order + 'IIIBBH'
+    sections = [struct.unpack_from(sh_fmt, data, shoff + i * shentsize) for i in range(shnum)]
+    symbols = []
+    for sh in sections:
+        if sh[1] != SHT_SYMTAB:
+            continue
+        offset, size, link, entsize = sh[4], sh[5], sh[6], sh[9]
+        strtab = sections[link][4]
+        for pos in range(offset, offset + size, entsize):
+            if is64:
+                name, info, _, shndx, value, st_size = struct.unpack_from(sym_fmt, data, pos)
+            else:
+                name, value, st_size, info, _, shndx = struct.unpack_from(sym_fmt, data, pos)
+            # only code, not linker symbols like _end
+            if info & 0xF not in (STT_NOTYPE, STT_FUNC) or not 0 < shndx < len(sections):
+                continue
+            if not sections[shndx][2] & SHF_EXECINSTR:
+                continue
+            if not st_size:
+                # labels (e.g. in crt0.S) extend to the end of their section
+                st_size = sections[shndx][3] + sections[shndx][5] - value
+            name = data[strtab + name:data.index(b'\x00', strtab + name)].decode(errors='replace')
+            if name and not name.startswith(('$', '.L')):
+                symbols.append((value, st_size, name, info & 0xF == STT_FUNC))
+    if not symbols:
+        raise ValueError(f"{path}: no symbols (stripped?)")
+    return [(address, size, name) for address, size, name, _ in sorted(symbols, key=lambda s: (s[0], not s[3]))]
+
+
+class Symbolizer:
+    """Map addresses to the closest preceding symbol."""
+
+    def __init__(self, symbols: list):
+        # the first (function) symbol at an address wins
+        self.symbols = []
+        for s in symbols:
+            if not self.symbols or self.symbols[-1][0] != s[0]:
+                self.symbols.append(s)
+        self.addresses = [s[0] for s in self.symbols]
+
+    def lookup(self, address: int):
+        """(name, offset) or None outside of all symbols."""
+        i = bisect.bisect_right(self.addresses, address) - 1
+        if i < 0:
+            return None
+        start, size, name = self.symbols[i]
+        if size and address >= start + size:
+            return None
+        return name, address - start
+
+    def function(self, address: int) -> str:
+        found = self.lookup(address)
+        return found[0] if found else f"[{region_of(address)}]"
+
+    def format(self, address: int) -> str:
+        found = self.lookup(address)
+        if not found:
+            return ''
+        return found[0] + (f"+0x{found[1]:x}" if found[1] else '')
+
+
+class TraceStats:
+    """Per-PC counters of a trace (or a part of it), mergeable."""
+
+    def __init__(self, bin_size: int = 4096):
+        self.bin_size = bin_size
+        self.pcs = {}        # (pc, insn) -> [mnemonic, count, cycles]
+        self.mem = {}        # (region, bin, class) -> [count, cycles]
+        self.lines = 0
+        self.skipped = 0
+        self.first = None    # (cycle, pc, insn, data key) of the first instruction, cycles unknown
+        self.last_cycle = None
+        self.time = [None, None]
+
+    def add(self, line: str):
+        fields = line.split('\t')
+        if len(fields) < 6:
+            self.skipped += 1
+            return
+        try:
+            cycle = int(fields[1])
+            pc = int(fields[2], 16)
+        except ValueError:
+            self.skipped += 1  # header
+            return
+        self.lines += 1
+        insn = fields[3]
+        mnemonic = fields[4].strip()
+        key = (pc, insn)
+        data = None
+        at = fields[-1].find('PA:0x')
+        if at >= 0:
+            address = int(fields[-1][at + 5:at + 13], 16)
+            data = (region_of(address), address // self.bin_size, class_of(mnemonic))
+        if self.time[0] is None:
+            self.time[0] = fields[0].strip()
+        self.time[1] = fields[0]
+        if self.last_cycle is None:
+            self.first = (cycle, key, mnemonic, data)
+            self.last_cycle = cycle
+            return
+        # a reset restarts the counter, charge one cycle
+        cycles = cycle - self.last_cycle if cycle > self.last_cycle else 1
+        self.last_cycle = cycle
+        self.charge(key, mnemonic, data, cycles)
+
+    def charge(self, key, mnemonic: str, data, cycles: int):
+        entry = self.pcs.get(key)
+        if entry is None:
+            self.pcs[key] = [mnemonic, 1, cycles]
+        else:
+            entry[1] += 1
+            entry[2] += cycles
+        if data:
+            entry = self.mem.get(data)
+            if entry is None:
+                self.mem[data] = [1, cycles]
+            else:
+                entry[0] += 1
+                entry[1] += cycles
+
+    def merge(self, other: 'TraceStats'):
+        """Append the statistics of the part of the trace that follows this one."""
+        if other.first is not None:
+            cycle, key, mnemonic, data = other.first
+            if self.last_cycle is None:
+                self.first = other.first
+            else:
+                self.charge(key, mnemonic, data, cycle - self.last_cycle if cycle > self.last_cycle else 1)
+            self.last_cycle = other.last_cycle
+        for key, (mnemonic, count, cycles) in other.pcs.items():
+            entry = self.pcs.get(key)
+            if entry is None:
+                self.pcs[key] = [mnemonic, count, cycles]
+            else:
+                entry[1] += count
+                entry[2] += cycles
+        for key, (count, cycles) in other.mem.items():
+            entry = self.mem.setdefault(key, [0, 0])
+            entry[0] += count
+            entry[1] += cycles
+        self.lines += other.lines
+        self.skipped += other.skipped
+        if self.time[0] is None:
+            self.time[0] = other.time[0]
+        if other.time[1] is not None:
+            self.time[1] = other.time[1]
+
+    def finish(self):
+        # the first instruction takes one cycle as far as we know
+        if self.first is not None:
+            _, key, mnemonic, data = self.first
+            self.charge(key, mnemonic, data, 1)
+            self.first = None
+        if self.time[1] is not None:
+            self.time[1] = self.time[1].strip()
+
+
+def process_range(args) -> TraceStats:
+    """Statistics of the lines starting in [start, end) of a trace."""
+    path, start, end, bin_size = args
+    stats = TraceStats(bin_size)
+    with open(path, 'rb') as f:
+        f.seek(start)
+        if start:
+            f.readline()  # belongs to the previous range
+        position = f.tell()
+        while position < end:
+            line = f.readline()
+            if not line:
+                break
+            position += len(line)
+            stats.add(line.decode(errors='replace'))
+    return stats
+
+
+def analyze(path: str, jobs: int = 1, bin_size: int = 4096) -> TraceStats:
+    size = os.path.getsize(path)
+    if jobs <= 1 or size < jobs << 20:
+        stats = process_range((path, 0, size, bin_size))
+    else:
+        bounds = [size * i // jobs for i in range(jobs + 1)]
+        with multiprocessing.Pool(jobs) as pool:
+            parts = pool.map(process_range, [(path, bounds[i], bounds[i + 1], bin_size) for i in range(jobs)])
+        stats = parts[0]
+        for part in parts[1:]:
+            stats.merge(part)
+    stats.finish()
+    return stats
+
+
+def report(stats: TraceStats, symbolizer: Symbolizer = None, top: int = 20) -> dict:
+    """Aggregate the per-PC counters into profiles."""
+    function = symbolizer.function if symbolizer else (lambda pc: f"[{region_of(pc)}]")
+    instructions = sum(e[1] for e in stats.pcs.values())
+    cycles = sum(e[2] for e in stats.pcs.values())
+    functions, classes, regions, mnemonics = {}, {}, {}, {}
+    for (pc, _), (mnemonic, count, pc_cycles) in stats.pcs.items():
+        for table, key in ((functions, function(pc)), (classes, class_of(mnemonic)),
+                           (regions, region_of(pc)), (mnemonics, mnemonic)):
+            entry = table.setdefault(key, [0, 0])
+            entry[0] += count
+            entry[1] += pc_cycles
+
+    def rows(table: dict, limit: int = None) -> list:
+        ordered = sorted(table.items(), key=lambda item: (-item[1][1], item[0]))
+        return [{'name': name, 'instructions': count, 'cycles': c, 'stalls': c - count,
+                 'cpi': round(c / count, 3), 'share': round(c / cycles, 4) if cycles else 0}
+                for name, (count, c) in ordered[:limit]]
+
+    hot = sorted(stats.pcs.items(), key=lambda item: (-item[1][2], item[0]))[:top]
+    memory = {}
+    for (region, bin_index, cls), (count, c) in sorted(stats.mem.items()):
+        entry = memory.setdefault(region, {'loads': 0, 'stores': 0, 'cycles': 0, 'stalls': 0, 'bins': {}})
+        entry['loads' if cls == 'load' else 'stores'] += count
+        entry['cycles'] += c
+        entry['stalls'] += c - count
+        address = f"0x{bin_index * stats.bin_size:08X}"
+        entry['bins'][address] = entry['bins'].get(address, 0) + count
+    return {
+        'instructions': instructions,
+        'cycles': cycles,
+        'cpi': round(cycles / instructions, 3) if instructions else None,
+        'time': stats.time,
+        'skipped_lines': stats.skipped,
+        'hot_pcs': [{'pc': f"0x{pc:08X}", 'insn': insn, 'mnemonic': mnemonic,
+                     'symbol': symbolizer.format(pc) if symbolizer else '',
+                     'count': count, 'cycles': c, 'stalls': c - count}
+                    for (pc, insn), (mnemonic, count, c) in hot],
+        'functions': rows(functions, top),
+        'classes': rows(classes),
+        'mnemonics': rows(mnemonics),
+        'code_regions': rows(regions),
+        'memory': memory,
+        'memory_bin_size': stats.bin_size,
+    }
+
+
+def print_report(r: dict, hist_bins: int = 8):
+    print(f"{r['instructions']} instructions in {r['cycles']} cycles (CPI {r['cpi']}), {r['time'][0]} - {r['time'][1]}")
+
+    def table(title: str, rows: list):
+        print(f"\n{title:<32} {'instr':>10} {'cycles':>12} {'stalls':>12} {'CPI':>7} {'cycles%':>8}")
+        for row in rows:
+            print(f"{row['name'][:32]:<32} {row['instructions']:>10} {row['cycles']:>12} {row['stalls']:>12}"
+                  f" {row['cpi']:>7.3f} {row['share'] * 100:>7.1f}%")
+
+    table('function', r['functions'])
+    table('instruction class', r['classes'])
+    table('code region', r['code_regions'])
+
+    print(f"\n{'hot PC':<12} {'insn':<9} {'mnemonic':<10} {'symbol':<28} {'count':>10} {'cycles':>12} {'stalls':>12}")
+    for h in r['hot_pcs']:
+        print(f"{h['pc']:<12} {h['insn']:<9} {h['mnemonic']:<10} {h['symbol'][:28]:<28} {h['count']:>10}"
+              f" {h['cycles']:>12} {h['stalls']:>12}")
+
+    if r['memory']:
+        print(f"\n{'data region':<12} {'loads':>10} {'stores':>10} {'cycles':>12} {'stalls':>12}")
+        for region, m in r['memory'].items():
+            print(f"{region:<12} {m['loads']:>10} {m['stores']:>10} {m['cycles']:>12} {m['stalls']:>12}")
+            bins = sorted(m['bins'].items(), key=lambda item: -item[1])[:hist_bins]
+            peak = bins[0][1] if bins else 0
+            for address, count in sorted(bins):
+                print(f"  {address}  {count:>10}  {'#' * max(1, round(40 * count / peak))}")
+
+
+def main():
+    p = argparse.ArgumentParser(
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+        description=textwrap.dedent("""
+            Profile a cve2 execution trace (trace_core_<hartid>.log): hot PCs and
+            functions, instruction mix, stalls per region and memory accesses.
+
+            Examples:
+              # profile a trace, symbolized with the program and the bootrom:
+              ./tracestat.py ../../trace_core_00000000.log --elf ../bin/helloworld_sram.elf --elf ../bootrom/build/bootrom.elf
+
+              # a long trace with 8 processes, JSON for further processing:
+              ./tracestat.py trace_core_00000000.log --jobs 8 --json profile.json
+        """))
+    p.add_argument('trace', help='trace written by rtl/cve2/cve2_tracer.sv')
+    p.add_argument('--elf', action='append', default=[], help='ELF file with symbols (repeatable)')
+    p.add_argument('--jobs', '-j', type=int, default=1, help='split the trace among processes (default: 1)')
+    p.add_argument('--top', type=int, default=20, help='hot PCs and functions shown (default: 20)')
+    p.add_argument('--bin-size', type=lambda s: int(s, 0), default=4096,
+                   help='bytes per memory histogram bin (default: 4096)')
+    p.add_argument('--json', metavar='FILE', help='write the full report')
+    p.add_argument('--quiet', '-q', action='store_true', help='do not print the report')
+    args = p.parse_args()
+
+    if args.jobs < 1 or args.bin_size < 1:
+        sys.exit("ERROR: --jobs and --bin-size must be positive")
+    try:
+        symbols = [s for path in args.elf for s in read_symbols(path)]
+        symbolizer = Symbolizer(sorted(symbols, key=lambda s: s[0])) if symbols else None
+        stats = analyze(args.trace, args.jobs, args.bin_size)
+        if not stats.lines:
+            sys.exit(f"ERROR: no trace lines in {args.trace}")
+        r = report(stats, symbolizer, args.top)
+        if args.json:
+            with open(args.json, 'w') as f:
+                json.dump(r, f, indent=2)
+    except (OSError, ValueError) as e:
+        sys.exit(f"ERROR: {e}")
+
+    if not args.quiet:
+        print_report(r)
+
+
+if __name__ == '__main__':
+    main()
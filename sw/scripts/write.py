@@ -13,108 +13,872 @@
 # optionally erases the device, writes with an offset, and verifies the written
 # data after flashing.
 #
+# The image is streamed in large chunks of many blocks through a single
+# reused, page-aligned buffer, so flashing is bound by the device and not by
+# per-block syscalls. With `--direct` the page cache is bypassed (O_DIRECT).
+# With `--delta` the device is read first and only the runs of blocks that
+# differ from the image are written (all-zero runs are zeroed in place where
+# the target supports it) and verified. Several devices can be given; the
+# image is then mapped once and flashed to all of them in parallel.
+# A digest of the flashed range can be stored in a manifest with `--manifest`
+# and checked against devices later with `--check`, without the image.
+# Verilog hex, Intel HEX and ELF images are loaded as sparse segments (see
+# imageload.py) and only the blocks holding loaded data are written, relative
+# to the lowest load address (or `--base`). Raw images compressed with gzip,
+# xz, zstd or bzip2 are decompressed on a separate thread while flashing,
+# without a temporary copy. With `--journal` every window made durable with
+# fsync (see `--sync-mib`) is recorded with its digest, so an interrupted
+# flash can be continued with `--resume` instead of starting over.
+#
 # Usage:
 #     python write.py --help
 
 import os, sys, argparse
+import concurrent.futures, ctypes, fcntl, hashlib, json, mmap, stat, struct
+import bz2, gzip, lzma, queue, shutil, subprocess, threading
+from functools import partial
 import textwrap
 
-def flash_raw(image: str, device: str, block_size: int = 512, offset: int = 0, erase: bool = True, verify: bool = False):
-    # 1) sanity check
-    if os.geteuid() != 0:
+import imageload
+from blockio import PROGRESS_INTERVAL, Progress, alloc_buffer, log, pread_full, pwrite_full, same
+
+DEFAULT_CHUNK_BLOCKS = 2048  # blocks per transfer (1 MiB with 512 B blocks)
+PROGRESS_INTERVAL_MULTI = 2  # seconds between progress updates when several devices are flashed at once
+DEFAULT_MAX_MISMATCHES = 8   # mismatching block ranges reported by --verify
+DEFAULT_DIGEST = 'blake2b'
+DIGESTS = ('blake2b', 'sha256')  # digest algorithms of --manifest
+STREAM_BUFFERS = 4           # chunk buffers between decompression and writing
+DEFAULT_JOURNAL_SYNC_MIB = 64  # fsync and journal cadence with --journal
+JOURNAL_DIGEST = 'blake2b'
+
+# compressed raw images are decompressed while flashing
+COMPRESSIONS = {
+    'gzip': b'\x1f\x8b',
+    'xz': b'\xfd7zXZ\x00',
+    'zstd': b'\x28\xb5\x2f\xfd',
+    'bzip2': b'BZh',
+}
+
+BLKZEROOUT = 0x127f          # <linux/fs.h>: zero a range of a block device
+FALLOC_FL_KEEP_SIZE = 0x01   # <linux/falloc.h>
+FALLOC_FL_PUNCH_HOLE = 0x02
+
+_libc = ctypes.CDLL(None, use_errno=True)
+_libc.fallocate.argtypes = [ctypes.c_int, ctypes.c_int, ctypes.c_int64, ctypes.c_int64]
+
+
+def is_block_device(path: str) -> bool:
+    return stat.S_ISBLK(os.stat(path).st_mode)
+
+
+def zero_range(fd: int, pos: int, length: int, block_device: bool) -> bool:
+    # Zero a range without transferring data: BLKZEROOUT on block devices, a
+    # punched hole on regular files. Returns False if this is not supported.
+    if pos % 512 or length % 512:
+        return False
+    try:
+        if block_device:
+            fcntl.ioctl(fd, BLKZEROOUT, struct.pack('QQ', pos, length))
+        elif _libc.fallocate(fd, FALLOC_FL_PUNCH_HOLE | FALLOC_FL_KEEP_SIZE, pos, length) != 0:
+            return False
+    except OSError:
+        return False
+    return True
+
+
+def chunks(ranges: list, chunk_size: int):
+    # Split (offset, length) ranges into transfers of at most chunk_size bytes
+    for off, length in ranges:
+        for pos in range(off, off + length, chunk_size):
+            yield pos, min(chunk_size, off + length - pos)
+
+
+def add_range(ranges: list, off: int, length: int):
+    # Append a range, merging it with the previous one if they are adjacent
+    if ranges and ranges[-1][0] + ranges[-1][1] == off:
+        ranges[-1] = (ranges[-1][0], ranges[-1][1] + length)
+    else:
+        ranges.append((off, length))
+
+
+def diff_runs(a: memoryview, b: memoryview, block_size: int, zeros: memoryview = None):
+    # Yield (offset, length, is_zero) runs of consecutive blocks in which a
+    # and b differ. Given a zero buffer, runs are also split where the blocks
+    # of a switch between zero and non-zero.
+    run, kind = 0, None
+    for i in range(0, len(a), block_size):
+        j = min(i + block_size, len(a))
+        key = None if same(a[i:j], b[i:j]) else zeros is not None and same(a[i:j], zeros[:j - i])
+        if key != kind:
+            if kind is not None:
+                yield run, i - run, kind
+            run, kind = i, key
+    if kind is not None:
+        yield run, len(a) - run, kind
+
+
+class FlashError(Exception):
+    pass
+
+
+def open_device(device: str, flags: int, direct: bool = False) -> int:
+    if direct:
+        flags |= os.O_DIRECT
+    try:
+        return os.open(device, flags)
+    except OSError as e:
+        raise FlashError(f"cannot open device '{device}': {e}")
+
+
+def image_chunk(image: memoryview, buf: memoryview, pos: int, n: int) -> memoryview:
+    # Return n bytes of the image at pos, zero padded past its end. Full chunks
+    # are views into the shared mapping, only the tail is copied into buf.
+    if pos + n <= len(image):
+        return image[pos:pos + n]
+    got = max(len(image) - pos, 0)
+    buf[:got] = image[pos:pos + got]
+    buf[got:n] = bytes(n - got)
+    return buf[:n]
+
+
+def check_devices(devices: list, block_size: int, chunk_blocks: int, direct: bool):
+    for device in devices:
+        if not os.path.exists(device):
+            sys.exit(f"ERROR: device '{device}' not found")
+    # file-backed images (e.g. for benchmarks) do not need root
+    if any(is_block_device(device) for device in devices) and os.geteuid() != 0:
         sys.exit("ERROR: must run as root (or via sudo)")
+    if len(set(map(os.path.realpath, devices))) != len(devices):
+        sys.exit("ERROR: the same device is given more than once")
+    if chunk_blocks < 1:
+        sys.exit("ERROR: chunk size must be at least one block")
+    if direct and block_size % 512 != 0:
+        sys.exit("ERROR: O_DIRECT requires a block size that is a multiple of 512 bytes")
+
+
+def run_devices(task, devices: list, jobs: int = 0, **options):
+    # Run task(device, **options) on every device, concurrently if there are
+    # several (the work is I/O bound), and exit with an error on any failure
+    if len(devices) == 1:
+        try:
+            task(devices[0], **options)
+            return
+        except (FlashError, OSError) as e:
+            error = f"\rERROR: {e}"
+        # exit outside the handler, so the traceback no longer holds views of the mapped image
+        sys.exit(error)
+
+    jobs = jobs or len(devices)
+    failed = {}
+    with concurrent.futures.ThreadPoolExecutor(max_workers=jobs) as pool:
+        futures = {pool.submit(task, device, prefix=f"[{device}] ", **options): device for device in devices}
+        for future in concurrent.futures.as_completed(futures):
+            try:
+                future.result()
+            except (FlashError, OSError) as e:
+                failed[futures[future]] = e
+
+    print("Summary:")
+    for device in devices:
+        status = f"FAILED: {failed[device]}" if device in failed else "OK ✔"
+        print(f"  {device:<24} {status}")
+    if failed:
+        sys.exit(f"ERROR: {len(failed)} of {len(devices)} devices failed")
+
+
+def flash_raw(image: str, devices: list, block_size: int = 512, offset: int = 0, erase: bool = True,
+              verify: bool = False, chunk_blocks: int = DEFAULT_CHUNK_BLOCKS, direct: bool = False,
+              delta: bool = False, jobs: int = 0, max_mismatches: int = DEFAULT_MAX_MISMATCHES,
+              manifest: str = None, digest: str = DEFAULT_DIGEST, image_format: str = None, base: int = None,
+              reverse_bytes: int = 0, journal: str = None, resume: bool = False, sync_mib: int = 0):
+    if isinstance(devices, str):
+        devices = [devices]
+
+    # 1) sanity check
     if not os.path.exists(image):
         sys.exit(f"ERROR: image '{image}' not found")
-    if not os.path.exists(device):
-        sys.exit(f"ERROR: device '{device}' not found")
+    check_devices(devices, block_size, chunk_blocks, direct)
+    if resume and not journal:
+        sys.exit("ERROR: --resume needs a --journal")
+    if sync_mib < 0:
+        sys.exit("ERROR: --sync-mib must not be negative")
+    sync_interval = sync_mib << 20
+    if journal and not sync_interval:
+        sync_interval = DEFAULT_JOURNAL_SYNC_MIB << 20
 
-    try:
-        with open(device, 'rb') as dev:
-            pass
-    except IOError as e:
-        sys.exit(f"ERROR: cannot open device '{device}': {e}")
+    compression = detect_compression(image)
+    if compression:
+        if (image_format or 'binary') != 'binary' or reverse_bytes or base is not None:
+            sys.exit("ERROR: compressed images must be raw binaries")
+        if journal:
+            sys.exit("ERROR: --journal needs an uncompressed raw image")
+        flash_stream(image, compression, devices, block_size=block_size, offset=offset, erase=erase,
+                     verify=verify, chunk_blocks=chunk_blocks, direct=direct, delta=delta, jobs=jobs,
+                     manifest=manifest, digest=digest, sync_interval=sync_interval)
+        return
+
+    image_format = image_format or imageload.detect_format(image)
+    if image_format != 'binary' or reverse_bytes:
+        if manifest or journal:
+            sys.exit("ERROR: --manifest and --journal need a raw binary image")
+        extents = load_extents(image, image_format, block_size, base, reverse_bytes)
+        if len(devices) > 1:
+            print(f"Flashing {image} to {len(devices)} devices with {jobs or len(devices)} workers...")
+        run_devices(partial(flash_extents, extents), devices, jobs, block_size=block_size, offset=offset,
+                    erase=erase, verify=verify, chunk_blocks=chunk_blocks, direct=direct, delta=delta,
+                    max_mismatches=max_mismatches, sync_interval=sync_interval)
+        return
 
     # 2) unmount any mounted partitions
     #    (on Linux you could do `os.system(f"umount {device}?*")`)
     #    but simplest is: make sure they're unmounted beforehand.
 
-    if erase:
-        # 3) open and erase blocks
-        with open(image, 'rb') as img, open(device, 'wb') as dev:
-            total = os.path.getsize(image)
+    total = os.path.getsize(image)
+    if total == 0:
+        sys.exit(f"ERROR: image '{image}' is empty")
+    print(f"Image size: {total} bytes ({total // 1024} KiB)")
+
+    # The image is mapped once and shared read-only by all workers
+    with open(image, 'rb') as img:
+        image_map = mmap.mmap(img.fileno(), 0, access=mmap.ACCESS_READ)
+    image_view = memoryview(image_map)
+    try:
+        if manifest:
+            # the digest covers exactly what is flashed, including the padded tail
+            length = flashed_length(total, block_size, erase, direct)
+            write_manifest(manifest, image, image_view, offset, length, block_size, digest, chunk_blocks)
+
+        # 3) flash the device(s)
+        if len(devices) > 1:
+            print(f"Flashing {image} to {len(devices)} devices with {jobs or len(devices)} workers...")
+        journals = None
+        if journal:
+            # one journal per device, named after the device if there are several
+            journals = {device: journal if len(devices) == 1 else f"{journal}.{os.path.basename(device)}"
+                        for device in devices}
+            identity = image_identity(image)
+        run_devices(partial(flash_device, image_view), devices, jobs, block_size=block_size, offset=offset,
+                    erase=erase, verify=verify, chunk_blocks=chunk_blocks, direct=direct, delta=delta,
+                    max_mismatches=max_mismatches, sync_interval=sync_interval,
+                    journals=journals and {d: (path, identity) for d, path in journals.items()}, resume=resume)
+    finally:
+        image_view.release()
+        image_map.close()
+
+
+def load_extents(image: str, image_format: str, block_size: int, base: int = None, reverse_bytes: int = 0) -> list:
+    # Load a sparse image as block-aligned runs of data, addressed relative to
+    # `base` (default: the lowest load address); gaps are not materialized
+    try:
+        segments = imageload.load(image, image_format)
+        if reverse_bytes:
+            segments = imageload.reverse_bytes(segments, reverse_bytes)
+    except (OSError, ValueError) as e:
+        sys.exit(f"ERROR: cannot load image '{image}': {e}")
+    if not segments:
+        sys.exit(f"ERROR: image '{image}' is empty")
+    first, end = imageload.span(segments)
+    base = first if base is None else base
+    if first < base:
+        sys.exit(f"ERROR: image '{image}' loads data at 0x{first:08X}, below the base address 0x{base:08X}")
+    extents = imageload.align([imageload.Segment(seg.address - base, seg.data) for seg in segments], block_size)
+    loaded = sum(len(seg) for seg in segments)
+    print(f"Image: {image_format}, {len(segments)} segment(s), {loaded} bytes loaded"
+          f" (0x{first:08X} - 0x{end - 1:08X}, base 0x{base:08X}),"
+          f" {sum(len(e) for e in extents) // block_size} blocks in {len(extents)} run(s)")
+    return extents
+
+
+def extent_gaps(extents: list) -> list:
+    # (offset, length) of the holes between the runs, from the base address on
+    gaps = []
+    end = 0
+    for extent in extents:
+        if extent.address > end:
+            gaps.append((end, extent.address - end))
+        end = extent.end
+    return gaps
+
+
+def erase_gaps(gaps: list, device: str, block_size: int, offset: int, chunk_blocks: int, direct: bool,
+               prefix: str = ""):
+    # Zero the holes of a sparse image on the device, discarding where possible
+    fd = open_device(device, os.O_WRONLY, direct)
+    block_device = is_block_device(device)
+    zeros = None
+    try:
+        for pos, n in gaps:
+            pos += offset * block_size
+            if zero_range(fd, pos, n, block_device):
+                continue
+            zeros = zeros or alloc_buffer(chunk_blocks * block_size)
+            for p, m in chunks([(pos, n)], len(zeros)):
+                pwrite_full(fd, zeros[:m], p)
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+    log(f"{prefix}Erased {sum(n for _, n in gaps) // block_size} blocks between the runs")
+
+
+def flash_extents(extents: list, device: str, block_size: int = 512, offset: int = 0, prefix: str = "",
+                  **options):
+    # Flash each block-aligned run of a sparse image at its block on the device;
+    # --erase also zeroes the holes between them, as it covers the whole image range
+    gaps = extent_gaps(extents)
+    if options.get('erase') and gaps:
+        erase_gaps(gaps, device, block_size, offset, options.get('chunk_blocks', DEFAULT_CHUNK_BLOCKS),
+                   options.get('direct', False), prefix)
+    for i, extent in enumerate(extents, 1):
+        first = offset + extent.address // block_size
+        log(f"{prefix}Run {i}/{len(extents)}: blocks {first} - {first + len(extent) // block_size - 1}")
+        data = memoryview(extent.data)
+        if options.get('direct'):
+            # O_DIRECT needs page-aligned buffers, the loaded data is not
+            data = alloc_buffer(len(extent))
+            data[:] = extent.data
+        flash_device(data, device, block_size, first, prefix=prefix, **options)
+
+
+def detect_compression(path: str) -> str:
+    # Compressed images by their magic, None for anything else
+    with open(path, 'rb') as f:
+        head = f.read(6)
+    for kind, magic in COMPRESSIONS.items():
+        if head.startswith(magic):
+            return kind
+    return None
+
+
+def stream_size(path: str, kind: str) -> int:
+    # Uncompressed size from the stream metadata where there is one, else
+    # None. Only used for the progress, the flashed length is counted.
+    try:
+        with open(path, 'rb') as f:
+            if kind == 'gzip':
+                # ISIZE of the last member, modulo 4 GiB: smaller than the
+                # best deflate ratio (1032:1) allows means it wrapped around
+                f.seek(-4, os.SEEK_END)
+                size = struct.unpack('<I', f.read(4))[0]
+                return size if size >= os.path.getsize(path) // 1032 else None
+            if kind == 'xz':
+                # the index at the end of the (last) stream lists the uncompressed block sizes
+                f.seek(-12, os.SEEK_END)
+                footer = f.read(12)
+                index_size = (struct.unpack_from('<I', footer, 4)[0] + 1) * 4
+                f.seek(-12 - index_size, os.SEEK_END)
+                index = f.read(index_size)
+                values, value, shift = [], 0, 0
+                for byte in index[1:]:
+                    value |= (byte & 0x7F) << shift
+                    shift += 7
+                    if not byte & 0x80:
+                        values.append(value)
+                        value, shift = 0, 0
+                    if values and len(values) == 1 + 2 * values[0]:
+                        return sum(values[2::2])
+                return None
+            if kind == 'zstd':
+                # Frame_Content_Size of the first frame, if the compressor recorded it
+                header = f.read(18)
+                descriptor = header[4]
+                single = descriptor >> 5 & 1
+                pos = 5 + (0 if single else 1) + (0, 1, 2, 4)[descriptor & 3]
+                fcs = (1 if single else 0, 2, 4, 8)[descriptor >> 6]
+                if not fcs:
+                    return None
+                size = int.from_bytes(header[pos:pos + fcs], 'little')
+                return size + 256 if fcs == 2 else size
+    except (OSError, struct.error, IndexError):
+        pass
+    return None
+
+
+class ZstdProcess:
+    """Decompress with the zstd command line tool, if the Python bindings are missing."""
+
+    def __init__(self, path: str):
+        self.process = subprocess.Popen(['zstd', '-dc', '--', path], stdout=subprocess.PIPE)
 
-            print(f"Image size: {total} bytes ({total // 1024} KiB)")
+    def readinto(self, view: memoryview) -> int:
+        n = self.process.stdout.readinto(view)
+        if not n and self.process.wait() != 0:
+            raise OSError(f"zstd exited with status {self.process.returncode}")
+        return n
 
-            total_blocks = total // block_size
-            if total % block_size != 0:
-                total_blocks += 1
+    def close(self):
+        self.process.stdout.close()
+        if self.process.poll() is None:
+            self.process.kill()
+        self.process.wait()
 
-            # Go to offset
-            dev.seek(offset * block_size)
 
-            # Erase the device first (optional, but recommended)
-            print(f"Erasing {total_blocks} blocks of {block_size} bytes each...")
-            for _ in range(total_blocks):
-                dev.write(b'\x00' * block_size)
-                print(f"\rErased {_+1}/{total_blocks} blocks...", end='', flush=True)
-            print("\rErasing complete ✔     ")
+def open_stream(path: str, kind: str):
+    # A binary stream of the decompressed image
+    if kind == 'gzip':
+        return gzip.open(path, 'rb')
+    if kind == 'xz':
+        return lzma.open(path, 'rb')
+    if kind == 'bzip2':
+        return bz2.open(path, 'rb')
+    try:
+        import zstandard
+        return zstandard.ZstdDecompressor().stream_reader(open(path, 'rb'), read_across_frames=True, closefd=True)
+    except ImportError:
+        pass
+    if shutil.which('zstd'):
+        return ZstdProcess(path)
+    sys.exit("ERROR: zstd images need the zstandard module or the zstd command")
+
 
-    # 4) write the image to the device
-    with open(image, 'rb') as img, open(device, 'wb') as dev:
-        total = os.path.getsize(image)
-        print(f"Flashing {image} to {device}...")
+def fill(stream, view: memoryview) -> int:
+    # Read until the view is full or the stream ends
+    total = 0
+    while total < len(view):
+        n = stream.readinto(view[total:])
+        if not n:
+            break
+        total += n
+    return total
 
-        # Go to offset
-        dev.seek(offset * block_size)
 
-        written = 0
+def decompress(stream, free: queue.Queue, full: queue.Queue):
+    # Producer thread: fill the free buffers with the decompressed image and
+    # hand them to the writer. A short buffer ends the image, None stops early.
+    try:
         while True:
-            chunk = img.read(block_size)
-            if not chunk:
+            buf = free.get()
+            if buf is None:
+                return
+            n = fill(stream, buf)
+            full.put((buf, n))
+            if n < len(buf):
+                return
+    except Exception as e:
+        full.put(e)
+
+
+def flash_stream(image: str, kind: str, devices: list, block_size: int = 512, offset: int = 0,
+                 erase: bool = True, verify: bool = False, chunk_blocks: int = DEFAULT_CHUNK_BLOCKS,
+                 direct: bool = False, delta: bool = False, jobs: int = 0, manifest: str = None,
+                 digest: str = DEFAULT_DIGEST, sync_interval: int = 0):
+    # Flash a compressed raw image without decompressing it to disk: a thread
+    # decompresses into a ring of STREAM_BUFFERS chunk buffers while this one
+    # writes each chunk to every device and digests it. --verify compares the
+    # devices against that digest, as the stream cannot be read twice.
+    estimate = stream_size(image, kind)
+    print(f"Image: {kind} compressed, {os.path.getsize(image)} bytes"
+          f" ({f'{estimate} bytes' if estimate is not None else 'size unknown'} uncompressed)")
+    start = offset * block_size
+    chunk_size = chunk_blocks * block_size
+    dev_buf = alloc_buffer(chunk_size) if delta else None
+    zeros = alloc_buffer(chunk_size) if delta else None
+
+    states = {}
+    for device in devices:
+        fd = open_device(device, os.O_RDWR if delta else os.O_WRONLY, direct)
+        states[device] = {'fd': fd, 'block_device': is_block_device(device), 'written': [], 'zeroed': 0,
+                          'error': None}
+
+    free, full = queue.Queue(), queue.Queue()
+    for _ in range(STREAM_BUFFERS):
+        free.put(alloc_buffer(chunk_size))
+    stream = open_stream(image, kind)
+    producer = threading.Thread(target=decompress, args=(stream, free, full), daemon=True)
+    h = hashlib.new(digest)
+    total = length = synced = 0
+    try:
+        producer.start()
+        print(f"Flashing {image} to {', '.join(devices)} in chunks of {chunk_blocks} blocks...")
+        progress = Progress("Written", estimate)
+        while True:
+            item = full.get()
+            if isinstance(item, Exception):
+                sys.exit(f"\rERROR: cannot decompress '{image}': {item}")
+            buf, n = item
+            total += n
+            if n % block_size and (erase or direct):
+                # like flashed_length: the tail of the last block is zeroed
+                pad = -n % block_size
+                buf[n:n + pad] = bytes(pad)
+                n += pad
+            data = buf[:n]
+            h.update(data)
+            for device, state in states.items():
+                if state['error']:
+                    continue
+                try:
+                    if delta:
+                        state['zeroed'] += write_delta(state['fd'], data, start + length, dev_buf, zeros, block_size,
+                                                       state['block_device'], state['written'], length)
+                    else:
+                        pwrite_full(state['fd'], data, start + length)
+                        add_range(state['written'], length, n)
+                except OSError as e:
+                    state['error'] = e
+            if all(state['error'] for state in states.values()):
+                break
+            length += n
+            if sync_interval and length - synced >= sync_interval:
+                for state in states.values():
+                    if not state['error']:
+                        os.fsync(state['fd'])
+                synced = length
+            progress.update(length)
+            if n < chunk_size:
                 break
-            dev.write(chunk)
-            written += len(chunk)
-            # simple progress
-            print(f"\rWritten {written*100/total:5.1f}%...", end='', flush=True)
-        print("\rFlashing complete ✔     ")
+            free.put(buf)
+        if total == 0:
+            sys.exit(f"\rERROR: image '{image}' is empty")
+        if not all(state['error'] for state in states.values()):
+            progress.finish("Flashing complete")
+        for device, state in states.items():
+            try:
+                os.fsync(state['fd'])
+            except OSError as e:
+                state['error'] = state['error'] or e
+    finally:
+        free.put(None)
+        producer.join()
+        stream.close()
+        for state in states.values():
+            os.close(state['fd'])
 
-    # 4) force write‐back all buffers to the card
-    os.sync()
+    print(f"Image size: {total} bytes ({total // 1024} KiB)")
+    if delta:
+        for device, state in states.items():
+            changed = sum(run for _, run in state['written'])
+            print(f"{device}: {(changed + block_size - 1) // block_size} of {(length + block_size - 1) // block_size}"
+                  f" blocks differed in {len(state['written'])} runs"
+                  f" ({(state['zeroed'] + block_size - 1) // block_size} blocks zeroed in place)")
+    entry = manifest_entry(image, offset, length, block_size, digest, h.hexdigest())
+    if manifest:
+        save_manifest(manifest, entry)
 
+    failed = [device for device, state in states.items() if state['error']]
+    if failed:
+        for device in failed:
+            print(f"  {device:<24} FAILED: {states[device]['error']}")
+        sys.exit(f"ERROR: {len(failed)} of {len(devices)} devices failed")
     if verify:
-        # 5) verify written data
-        with open(image, 'rb') as img, open(device, 'rb') as dev:
-            img.seek(offset * block_size)
-            dev.seek(offset * block_size)
+        # re-read the devices only, against the digest taken while writing
+        run_devices(check_device, devices, jobs, manifest=entry, chunk_blocks=chunk_blocks, direct=direct)
+
+
+def flashed_length(total: int, block_size: int, erase: bool, direct: bool) -> int:
+    # Erasing is fused into the write: every block of the image range is
+    # overwritten anyway, so only the tail of the last block is zeroed.
+    # O_DIRECT can only transfer whole blocks, so the tail is padded too.
+    if erase or direct:
+        return (total + block_size - 1) // block_size * block_size
+    return total
+
+
+def image_identity(image: str) -> dict:
+    # A journal only applies to the same image file
+    st = os.stat(image)
+    return {'image': os.path.abspath(image), 'size': st.st_size, 'mtime_ns': st.st_mtime_ns}
+
 
-            total = os.path.getsize(image)
-            total_blocks = total // block_size
-            if total % block_size != 0:
-                total_blocks += 1
+def sync_window(fd: int, journal, image: memoryview, buf: memoryview, begin: int, end: int) -> int:
+    # Make the device range up to `end` durable and commit [begin, end) to the
+    # journal with the digest of the image data. Returns the new synced end.
+    os.fsync(fd)
+    if journal and end > begin:
+        digest = hash_range(lambda view, pos: image_chunk(image, view, begin + pos, len(view)), end - begin, buf,
+                            JOURNAL_DIGEST)
+        journal.commit(begin, end - begin, digest)
+    return end
 
-            print(f"Verifying {total_blocks} blocks of {block_size} bytes each...")
-            verified = 0
-            while True:
-                img_chunk = img.read(block_size)
-                dev_chunk = dev.read(block_size)
 
-                if not img_chunk and not dev_chunk:
-                    break
+class Journal:
+    """Append-only record of the windows of a flash that reached the device.
 
-                if len(dev_chunk) > len(img_chunk):
-                    dev_chunk = dev_chunk[:len(img_chunk)]
+    The first line describes the flash (image, device, offset, ...), every
+    further line one window made durable with fsync, with the digest of its
+    data, and the last line marks a complete flash. On resume, windows are
+    trusted up to the first gap; the last one is read back from the device
+    and dropped (repeatedly) if it does not match its digest.
+    """
 
-                if img_chunk != dev_chunk:
-                    sys.exit(f"\rERROR: verification failed! Data mismatch detected at offset 0x{verified * block_size + offset * block_size:08X}\n"
-                             f"Expected:\n\t{bytes(img_chunk).hex()}\n"
-                             f"Got:\n\t{dev_chunk.hex()}")
+    def __init__(self, path: str, header: dict, resume: bool = False, device_digest=None):
+        self.path = path
+        self.header = header
+        self.windows = []
+        if resume and os.path.exists(path):
+            self._load(device_digest)
+        # rewrite the journal with only the windows that are still valid
+        tmp = f"{path}.tmp"
+        with open(tmp, 'w') as f:
+            for entry in [header] + [{'pos': p, 'length': n, 'digest': d} for p, n, d in self.windows]:
+                f.write(json.dumps(entry) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, path)
+        self.file = open(path, 'a')
+
+    def _load(self, device_digest):
+        try:
+            with open(self.path) as f:
+                entries = [json.loads(line) for line in f if line.strip()]
+        except (OSError, ValueError) as e:
+            raise FlashError(f"cannot read journal '{self.path}': {e}")
+        if not entries or entries[0] != self.header:
+            raise FlashError(f"journal '{self.path}' belongs to another image, device or layout,"
+                             f" start over without --resume")
+        end = 0
+        for entry in entries[1:]:
+            if 'pos' not in entry:
+                continue
+            if entry['pos'] != end:
+                break  # only a contiguous prefix is trusted
+            self.windows.append((entry['pos'], entry['length'], entry['digest']))
+            end += entry['length']
+        while self.windows and device_digest:
+            pos, n, digest = self.windows[-1]
+            if device_digest(pos, n) == digest:
+                break
+            self.windows.pop()
+
+    @property
+    def committed(self) -> int:
+        return self.windows[-1][0] + self.windows[-1][1] if self.windows else 0
+
+    def commit(self, pos: int, length: int, digest: str):
+        self.windows.append((pos, length, digest))
+        self.file.write(json.dumps({'pos': pos, 'length': length, 'digest': digest}) + "\n")
+        self.file.flush()
+        os.fsync(self.file.fileno())
+
+    def finish(self):
+        self.file.write(json.dumps({'complete': True}) + "\n")
+
+    def close(self):
+        self.file.close()
+
+
+def flash_device(image: memoryview, device: str, block_size: int = 512, offset: int = 0, erase: bool = True,
+                 verify: bool = False, chunk_blocks: int = DEFAULT_CHUNK_BLOCKS, direct: bool = False,
+                 delta: bool = False, max_mismatches: int = DEFAULT_MAX_MISMATCHES, prefix: str = "",
+                 sync_interval: int = 0, journals: dict = None, resume: bool = False):
+    # Flash the mapped image to one device, raising FlashError on failure
+    block_device = is_block_device(device)
+    total = len(image)
+    total_blocks = (total + block_size - 1) // block_size
+    start = offset * block_size
+    chunk_size = chunk_blocks * block_size
+    inline = not prefix  # single device, progress is updated in place
+    length = flashed_length(total, block_size, erase, direct)
+
+    buf = alloc_buffer(chunk_size)
+    dev_buf = alloc_buffer(chunk_size) if delta or verify else None
+    zeros = alloc_buffer(chunk_size) if delta else None
+    journal = None
+    resume_pos = 0
+    if journals and device in journals:
+        path, identity = journals[device]
+        header = dict(identity, device=os.path.realpath(device), offset=offset, block_size=block_size,
+                      length=length)
+        # the device range is read back to check the last committed window
+        fd = open_device(device, os.O_RDONLY, direct)
+        try:
+            journal = Journal(path, header, resume, lambda pos, n: hash_range(
+                lambda view, p: view[:pread_full(fd, view, start + pos + p)], n, buf, JOURNAL_DIGEST))
+        finally:
+            os.close(fd)
+        resume_pos = journal.committed
+        if resume_pos:
+            log(f"{prefix}Resuming at block {offset + resume_pos // block_size}"
+                f" ({(resume_pos + block_size - 1) // block_size} of {(length + block_size - 1) // block_size}"
+                f" blocks committed in '{path}')")
+
+    fd = None
+    written = []
+    try:
+        fd = open_device(device, os.O_RDWR if delta else os.O_WRONLY, direct)
+        # write the image to the device
+        if erase:
+            log(f"{prefix}Writing {total_blocks} blocks of {block_size} bytes each (tail of the last block zeroed)...")
+        log(f"{prefix}Flashing to {device} in chunks of {chunk_blocks} blocks...")
+        progress = Progress(f"{prefix}{'Scanned' if delta else 'Written'}", length,
+                            PROGRESS_INTERVAL if inline else PROGRESS_INTERVAL_MULTI, inline, resume_pos)
+        zeroed = 0
+        synced = resume_pos  # end of the last window made durable (and committed to the journal)
+        if resume_pos:
+            # already on the device, verified with the rest
+            add_range(written, 0, resume_pos)
+        for pos, n in chunks([(resume_pos, length - resume_pos)], chunk_size):
+            data = image_chunk(image, buf, pos, n)
+            if not delta:
+                pwrite_full(fd, data, start + pos)
+                add_range(written, pos, n)
+            else:
+                zeroed += write_delta(fd, data, start + pos, dev_buf, zeros, block_size, block_device, written, pos)
+            if sync_interval and pos + n - synced >= sync_interval:
+                synced = sync_window(fd, journal, image, buf, synced, pos + n)
+            progress.update(pos + n)
+        progress.finish(f"{prefix}Flashing complete")
+        if delta:
+            changed = sum(run for _, run in written)
+            log(f"{prefix}Delta: {(changed + block_size - 1) // block_size} of {total_blocks} blocks differed"
+                f" in {len(written)} runs ({(zeroed + block_size - 1) // block_size} blocks zeroed in place)")
+
+        # force write-back all buffers to the card
+        sync_window(fd, journal, image, buf, synced, length)
+        if journal:
+            journal.finish()
+    finally:
+        if fd is not None:
+            os.close(fd)
+        if journal:
+            journal.close()  # also on errors, so the committed windows are flushed
+
+    if verify:
+        # verify written data, reading from the medium rather than the cache
+        fd = open_device(device, os.O_RDONLY, direct)
+        try:
+            os.posix_fadvise(fd, start, length, os.POSIX_FADV_DONTNEED)
+            verify_ranges(image, fd, written, start, buf, dev_buf, block_size, max_mismatches, prefix)
+        finally:
+            os.close(fd)
 
-                verified += 1
-                print(f"\rVerified {verified*100/total_blocks:5.1f}%...", end='', flush=True)
-                if verified == total_blocks:
-                    break
 
-            print("\rVerification complete ✔     ")
+def write_delta(fd: int, data: memoryview, dev_pos: int, dev_buf: memoryview, zeros: memoryview,
+                block_size: int, block_device: bool, written: list, pos: int) -> int:
+    # Only write the runs of blocks of data that differ from the device at
+    # dev_pos, recording them at pos in `written`. Returns the bytes zeroed in place.
+    n = len(data)
+    zeroed = 0
+    if pread_full(fd, dev_buf[:n], dev_pos) < n:
+        runs = [(0, n, same(data, zeros[:n]))]
+    else:
+        runs = diff_runs(data, dev_buf[:n], block_size, zeros)
+    for off, run, is_zero in runs:
+        if is_zero and zero_range(fd, dev_pos + off, run, block_device):
+            zeroed += run
+        else:
+            pwrite_full(fd, data[off:off + run], dev_pos + off)
+        add_range(written, pos + off, run)
+    return zeroed
+
+
+def verify_ranges(image: memoryview, fd: int, ranges: list, start: int, buf: memoryview, dev_buf: memoryview,
+                  block_size: int = 512, max_mismatches: int = DEFAULT_MAX_MISMATCHES, prefix: str = ""):
+    # Compare (offset, length) ranges of the image with the device at `start`,
+    # collecting up to max_mismatches differing block ranges before failing
+    total = sum(length for _, length in ranges)
+    if not total:
+        log(f"{prefix}Nothing written, nothing to verify ✔")
+        return
+    log(f"{prefix}Verifying {(total + block_size - 1) // block_size} blocks of {block_size} bytes each...")
+    progress = Progress(f"{prefix}Verified", total,
+                        PROGRESS_INTERVAL_MULTI if prefix else PROGRESS_INTERVAL, not prefix)
+    mismatches = []
+    first = None
+    verified = 0
+    for pos, n in chunks(ranges, len(buf)):
+        expected = image_chunk(image, buf, pos, n)
+        got = pread_full(fd, dev_buf[:n], start + pos)
+        if got < n or not same(expected, dev_buf[:n]):
+            for off, run, _ in diff_runs(expected[:got], dev_buf[:got], block_size):
+                add_range(mismatches, pos + off, run)
+            if got < n:
+                add_range(mismatches, pos + got, n - got)
+            if first is None:
+                # keep the contents of the first mismatching block for the report
+                off = mismatches[0][0] - pos
+                first = (bytes(expected[off:off + block_size]), bytes(dev_buf[off:min(off + block_size, got)]))
+            if len(mismatches) > max_mismatches:
+                break
+        verified += n
+        progress.update(verified)
+
+    if mismatches:
+        more = len(mismatches) > max_mismatches
+        lines = [f"verification failed! {'More than ' if more else ''}{min(len(mismatches), max_mismatches)}"
+                 f" mismatching block range(s):"]
+        for off, length in mismatches[:max_mismatches]:
+            lines.append(f"\t0x{start + off:08X} - 0x{start + off + length - 1:08X}"
+                         f" ({(length + block_size - 1) // block_size} blocks)")
+        lines.append(f"First mismatching block, expected:\n\t{first[0].hex()}\nGot:\n\t{first[1].hex()}")
+        raise FlashError("\n".join(lines))
+    progress.finish(f"{prefix}Verification complete")
+
+
+def hash_range(read, length: int, buf: memoryview, algorithm: str) -> str:
+    # Digest `length` bytes delivered chunk-wise by read(view, pos) -> view
+    h = hashlib.new(algorithm)
+    for pos, n in chunks([(0, length)], len(buf)):
+        h.update(read(buf[:n], pos))
+    return h.hexdigest()
+
+
+def write_manifest(path: str, image: str, image_view: memoryview, offset: int, length: int, block_size: int,
+                   algorithm: str, chunk_blocks: int = DEFAULT_CHUNK_BLOCKS):
+    # Record a digest of the flashed range so that devices can be checked later
+    # without the original image (see check_manifest)
+    buf = alloc_buffer(chunk_blocks * block_size)
+    digest = hash_range(lambda view, pos: image_chunk(image_view, view, pos, len(view)), length, buf, algorithm)
+    save_manifest(path, manifest_entry(image, offset, length, block_size, algorithm, digest))
+
+
+def manifest_entry(image: str, offset: int, length: int, block_size: int, algorithm: str, digest: str) -> dict:
+    return {'image': os.path.basename(image), 'offset': offset, 'block_size': block_size,
+            'length': length, 'algorithm': algorithm, 'digest': digest}
+
+
+def save_manifest(path: str, entry: dict):
+    with open(path, 'w') as f:
+        json.dump(entry, f, indent=2)
+        f.write("\n")
+    print(f"Wrote manifest '{path}' ({entry['algorithm']}: {entry['digest']})")
+
+
+def check_manifest(manifest: str, devices: list, chunk_blocks: int = DEFAULT_CHUNK_BLOCKS, direct: bool = False,
+                   jobs: int = 0, digest: str = None):
+    # Verify devices against a manifest written by --manifest, without the image;
+    # digest, if given, must be the algorithm the manifest was written with
+    if isinstance(devices, str):
+        devices = [devices]
+    if not os.path.exists(manifest):
+        sys.exit(f"ERROR: manifest '{manifest}' not found")
+    try:
+        with open(manifest) as f:
+            m = json.load(f)
+        block_size, algorithm = m['block_size'], m['algorithm']
+    except (OSError, ValueError, KeyError) as e:
+        sys.exit(f"ERROR: invalid manifest '{manifest}': {e}")
+    if algorithm not in DIGESTS:
+        sys.exit(f"ERROR: invalid manifest '{manifest}': unknown digest algorithm '{algorithm}'")
+    if digest and digest != algorithm:
+        sys.exit(f"ERROR: manifest '{manifest}' holds a {algorithm} digest, not {digest}")
+    check_devices(devices, block_size, chunk_blocks, direct)
+    print(f"Checking {len(devices)} device(s) against '{manifest}' ({m['length']} bytes at block {m['offset']})...")
+    run_devices(check_device, devices, jobs, manifest=m, chunk_blocks=chunk_blocks, direct=direct)
+
+
+def check_device(device: str, manifest: dict, chunk_blocks: int = DEFAULT_CHUNK_BLOCKS, direct: bool = False,
+                 prefix: str = ""):
+    block_size = manifest['block_size']
+    start = manifest['offset'] * block_size
+    length = manifest['length']
+    buf = alloc_buffer(chunk_blocks * block_size)
+
+    def read(view, pos):
+        # O_DIRECT reads whole blocks, only the part in the manifest is hashed
+        n = len(view)
+        if pread_full(fd, buf[:n + (-n % block_size if direct else 0)], start + pos) < n:
+            raise FlashError(f"device ends before the manifest range (at 0x{start + pos:08X})")
+        return buf[:n]
+
+    fd = open_device(device, os.O_RDONLY, direct)
+    try:
+        os.posix_fadvise(fd, start, length, os.POSIX_FADV_DONTNEED)
+        digest = hash_range(read, length, buf, manifest['algorithm'])
+    finally:
+        os.close(fd)
+    if digest != manifest['digest']:
+        raise FlashError(f"digest mismatch: expected {manifest['digest']}, got {digest}")
+    log(f"{prefix}Digest matches ✔ ({manifest['algorithm']}: {digest})")
 
 
 if __name__ == "__main__":
@@ -130,7 +894,7 @@ if __name__ == "__main__":
               # flash a raw image to a block device with custom block size:
               sudo ./write.py /path/to/image.bin /dev/sdb --block-size 4096
                                     
-              # erase the device before flashing:
+              # zero the tail of the last block (and the holes of sparse images):
               sudo ./write.py /path/to/image.bin /dev/sdb --erase
                                     
               # flash a raw image to a block device with an offset (10 blocks):
@@ -138,13 +902,75 @@ if __name__ == "__main__":
                                     
               # flash a raw image and verify after writing:
               sudo ./write.py /path/to/image.bin /dev/sdb --verify
+
+              # flash with 4 MiB transfers, bypassing the page cache:
+              sudo ./write.py /path/to/image.bin /dev/sdb --chunk-blocks 8192 --direct
+
+              # reflash, only writing (and verifying) the blocks that changed:
+              sudo ./write.py /path/to/image.bin /dev/sdb --delta --verify
+
+              # flash and verify several cards in parallel, two at a time:
+              sudo ./write.py /path/to/image.bin /dev/sdb /dev/sdc /dev/sdd --verify --jobs 2
+
+              # flash and record a digest of the flashed range in a manifest:
+              sudo ./write.py /path/to/image.bin /dev/sdb --manifest image.json
+
+              # later, check a card against the manifest without the image:
+              sudo ./write.py --check image.json /dev/sdb
+
+              # flash only the loaded segments of an ELF, byte-swapped like the _sd.bin images:
+              sudo ./write.py ../bin/helloworld_sd.elf /dev/sdb --reverse-bytes 4
+
+              # flash a compressed image (.gz, .xz, .zst or .bz2) without unpacking it first:
+              sudo ./write.py /path/to/image.bin.xz /dev/sdb --verify
+
+              # journal the flash, syncing every 128 MiB, and continue it after an interruption:
+              sudo ./write.py /path/to/image.bin /dev/sdb --journal sdb.journal --sync-mib 128
+              sudo ./write.py /path/to/image.bin /dev/sdb --journal sdb.journal --sync-mib 128 --resume
         """)
     )
-    p.add_argument('image', help='path to the raw image file')
-    p.add_argument('device', help='path to the block device (e.g. /dev/sdb)')
+    p.add_argument('image', help='path to the image file: raw (optionally compressed), Verilog hex, Intel HEX or ELF'
+                        ' (the manifest with --check)')
+    p.add_argument('devices', nargs='+', metavar='device',
+                   help='path to the block device (e.g. /dev/sdb), several are flashed in parallel')
     p.add_argument('--block-size', '-b', type=int, default=512, help='bytes per block (default: 512)')
     p.add_argument('--offset', '-o', type=int, default=0, help='block offset to start writing (default: 0)')
-    p.add_argument('--erase', '-e', action='store_true', help='erase the device before flashing')
+    p.add_argument('--erase', '-e', action='store_true',
+                   help='zero the rest of the image range (the tail of the last block, the holes of sparse images)')
     p.add_argument('--verify', '-v', action='store_true', help='verify written data after flashing')
+    p.add_argument('--chunk-blocks', '-c', type=int, default=DEFAULT_CHUNK_BLOCKS,
+                   help=f'blocks per transfer (default: {DEFAULT_CHUNK_BLOCKS})')
+    p.add_argument('--direct', '-d', action='store_true', help='bypass the page cache (O_DIRECT)')
+    p.add_argument('--delta', '-D', action='store_true',
+                   help='only write the blocks that differ from the device')
+    p.add_argument('--jobs', '-j', type=int, default=0,
+                   help='devices flashed concurrently (default: all given devices)')
+    p.add_argument('--max-mismatches', '-m', type=int, default=DEFAULT_MAX_MISMATCHES,
+                   help=f'mismatching block ranges reported by --verify (default: {DEFAULT_MAX_MISMATCHES})')
+    p.add_argument('--manifest', default=None, help='write a digest manifest of the flashed range to this file')
+    p.add_argument('--digest', default=None, choices=DIGESTS,
+                   help=f'digest algorithm for --manifest (default: {DEFAULT_DIGEST});'
+                        ' with --check, the algorithm the manifest must use')
+    p.add_argument('--format', '-f', dest='image_format', choices=imageload.FORMATS, default=None,
+                   help='image format (default: from the extension, raw binary if unknown)')
+    p.add_argument('--base', type=lambda s: int(s, 0), default=None,
+                   help='load address written to --offset for non-raw images (default: the lowest one)')
+    p.add_argument('--reverse-bytes', '-r', type=int, default=0, metavar='WIDTH',
+                   help='reverse the bytes of each WIDTH-byte word, e.g. 4 for SD images from an ELF')
+    p.add_argument('--journal', default=None, metavar='FILE',
+                   help='record the windows written to the device, to --resume an interrupted flash'
+                        ' (several devices: FILE.<device>)')
+    p.add_argument('--resume', action='store_true',
+                   help='continue after the last window in the --journal that still matches the device')
+    p.add_argument('--sync-mib', type=int, default=0, metavar='MIB',
+                   help=f'fsync every MIB MiB (default: only at the end, {DEFAULT_JOURNAL_SYNC_MIB} with --journal)')
+    p.add_argument('--check', action='store_true',
+                   help='only check the devices against the manifest given as image, nothing is written')
 
-    flash_raw(**vars(p.parse_args()))
+    args = vars(p.parse_args())
+    if args.pop('check'):
+        check_manifest(args['image'], args['devices'], args['chunk_blocks'], args['direct'], args['jobs'],
+                       args['digest'])
+    else:
+        args['digest'] = args['digest'] or DEFAULT_DIGEST
+        flash_raw(**args)